@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned caching helpers.
+
+Every model has a version number stored in the cache. It is bumped by the
+``post_save`` and ``post_delete`` signals, so cache keys containing the
+versions of the models the cached data depends on become obsolete as soon as
+any of these models changes. Set ``BOB_TRACK_MODEL_VERSIONS = True`` in your
+settings to enable it; the caching features relying on the versions refuse
+to work without it. Note that ``QuerySet.update`` sends no signals.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete, post_save
+
+
+VERSION_TIMEOUT = 30 * 24 * 60 * 60
+LOCK_POLL_INTERVAL = 0.05
+
+
+def get_version_cache():
+    return get_cache(getattr(settings, 'BOB_VERSION_CACHE', 'default'))
+
+
+def model_version_key(model):
+    return 'bob:version:{}.{}'.format(
+        model._meta.app_label, model._meta.object_name.lower(),
+    )
+
+
+def new_version():
+    """A fresh version number. It's based on time, so that versions lost by
+    the cache are not reused."""
+    return int(time.time() * 1000)
+
+
+def get_model_versions(models):
+    """Returns the list of versions of the given models."""
+    cache = get_version_cache()
+    keys = [model_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), VERSION_TIMEOUT)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_model_version(model):
+    """Invalidates all the data cached for the given model."""
+    cache = get_version_cache()
+    key = model_version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, new_version(), VERSION_TIMEOUT)
+
+
+def _model_changed(sender, **kwargs):
+    if getattr(settings, 'BOB_TRACK_MODEL_VERSIONS', False):
+        bump_model_version(sender)
+
+post_save.connect(_model_changed, dispatch_uid='bob.cache.post_save')
+post_delete.connect(_model_changed, dispatch_uid='bob.cache.post_delete')
+
+
+def check_model_versions(feature):
+    """Raises ``ImproperlyConfigured`` if the model versions are not
+    tracked, as ``feature`` would then serve stale data after the models
+    change, until its cache expires."""
+    if not getattr(settings, 'BOB_TRACK_MODEL_VERSIONS', False):
+        raise ImproperlyConfigured(
+            '{} needs BOB_TRACK_MODEL_VERSIONS = True in the settings.'.format(
+                feature,
+            )
+        )
+
+
+def make_versioned_key(prefix, models, *parts):
+    """Creates a cache key for data depending on ``models`` and described by
+    ``parts``."""
+    data = '\n'.join(
+        ['{}'.format(part) for part in parts] +
+        ['{}'.format(version) for version in get_model_versions(models)]
+    )
+    return '{}:{}'.format(
+        prefix, hashlib.md5(data.encode('utf-8')).hexdigest(),
+    )
+
+
+def get_or_create(key, create, timeout=DEFAULT_TIMEOUT, lock_timeout=30,
+                  cache_alias='default'):
+    """
+    Returns the value cached under ``key``. If it is missing, only one of
+    concurrent callers calls ``create`` and stores the result, the others
+    wait for it at most ``lock_timeout`` seconds, after which they create
+    the value themselves.
+
+    :param key: the cache key
+    :param create: a function returning the value to be cached
+    :param timeout: the cache timeout of the value
+    """
+    cache = get_cache(cache_alias)
+    value = cache.get(key)
+    if value is not None:
+        return value
+    lock_key = key + ':lock'
+    if cache.add(lock_key, 1, lock_timeout):
+        try:
+            value = create()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+    deadline = time.time() + lock_timeout
+    while time.time() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        value = cache.get(key)
+        if value is not None:
+            return value
+        if cache.get(lock_key) is None:
+            break
+    return create()
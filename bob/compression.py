@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming compression of downloads.
+
+The functions compress iterables of byte strings as they are consumed, so
+they can wrap the content of a ``StreamingHttpResponse``.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import re
+import struct
+import time
+import zipfile
+import zlib
+
+from django.utils.cache import patch_vary_headers
+
+
+BUFFER_SIZE = 64 * 1024
+
+
+def iter_buffered(chunks, buffer_size=BUFFER_SIZE):
+    """Joins the small byte strings from ``chunks`` into pieces of at least
+    ``buffer_size`` bytes (except the last one)."""
+    buf = []
+    size = 0
+    for chunk in chunks:
+        buf.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            yield b''.join(buf)
+            buf = []
+            size = 0
+    if size:
+        yield b''.join(buf)
+
+
+def _dos_datetime(timestamp):
+    t = time.localtime(timestamp)
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def iter_zip(files, buffer_size=BUFFER_SIZE, compresslevel=6):
+    """
+    Yields a ZIP archive of ``files`` - an iterable of ``(name, chunks)``
+    pairs, where ``chunks`` yields the content of the file. The files are
+    deflated as they are read. The sizes and checksums follow the data
+    (in data descriptors), so nothing needs to be written twice. ZIP64 is
+    not supported, so the archive and its files must be smaller than 4GB.
+    zlib holds back some compressed data, so the chunks can be longer than
+    ``buffer_size`` (but not longer than its internal buffer).
+    """
+    def generate():
+        central_directory = []
+        offset = 0
+        dos_time, dos_date = _dos_datetime(time.time())
+        # the data descriptor follows the data, the name is UTF-8
+        flags = 0x08 | 0x800
+        for name, chunks in files:
+            name = name.encode('utf-8')
+            header = struct.pack(
+                b'<4s5H3L2H', b'PK\x03\x04', 20, flags, zipfile.ZIP_DEFLATED,
+                dos_time, dos_date, 0, 0, 0, len(name), 0,
+            ) + name
+            yield header
+            crc = 0
+            size = 0
+            compressed_size = 0
+            compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+            for chunk in chunks:
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                data = compressor.compress(chunk)
+                compressed_size += len(data)
+                if data:
+                    yield data
+            data = compressor.flush()
+            compressed_size += len(data)
+            yield data
+            crc &= 0xffffffff
+            descriptor = struct.pack(
+                b'<4s3L', b'PK\x07\x08', crc, compressed_size, size,
+            )
+            yield descriptor
+            central_directory.append(struct.pack(
+                b'<4s6H3L5H2L', b'PK\x01\x02', 20, 20, flags,
+                zipfile.ZIP_DEFLATED, dos_time, dos_date, crc,
+                compressed_size, size, len(name), 0, 0, 0, 0, 0, offset,
+            ) + name)
+            offset += len(header) + compressed_size + len(descriptor)
+        directory = b''.join(central_directory)
+        yield directory
+        yield struct.pack(
+            b'<4s4H2LH', b'PK\x05\x06', 0, 0, len(central_directory),
+            len(central_directory), len(directory), offset, 0,
+        )
+    return iter_buffered(generate(), buffer_size)
+
+
+def iter_gzip(chunks, buffer_size=BUFFER_SIZE, compresslevel=6):
+    """Yields the gzip compressed ``chunks``."""
+    def generate():
+        # wbits of 16 + 15 produce the gzip header and trailer
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    return iter_buffered(generate(), buffer_size)
+
+
+accepts_gzip_re = re.compile(r'\bgzip\b')
+
+
+def accepts_gzip(request):
+    """Returns True if the client accepts gzip ``Content-Encoding``."""
+    return bool(accepts_gzip_re.search(
+        request.META.get('HTTP_ACCEPT_ENCODING', ''),
+    ))
+
+
+def compress_streaming_response(response, compression, filename):
+    """
+    Compresses the content of a ``StreamingHttpResponse`` downloading
+    ``filename``.
+
+    :param compression: ``'gzip'`` for the gzip ``Content-Encoding``
+        (decompressed by the browser), ``'gz'`` or ``'zip'`` for a compressed
+        attachment or None
+    """
+    if compression == 'gzip':
+        response.streaming_content = iter_gzip(response.streaming_content)
+        response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+    elif compression == 'gz':
+        response.streaming_content = iter_gzip(response.streaming_content)
+        response['Content-Type'] = 'application/gzip'
+        response['Content-Disposition'] = (
+            'attachment; filename=%s.gz' % filename
+        )
+    elif compression == 'zip':
+        response.streaming_content = iter_zip(
+            [(filename, response.streaming_content)],
+        )
+        response['Content-Type'] = 'application/zip'
+        response['Content-Disposition'] = (
+            'attachment; filename=%s.zip' % filename.rsplit('.', 1)[0]
+        )
+    elif compression is not None:
+        raise ValueError('Unknown compression {}.'.format(compression))
+    return response
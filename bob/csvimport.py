@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk import of CSV files into models.
+
+The rows read by :py:class:`bob.csvutil.UnicodeReader` are split into
+chunks. The chunks are validated by a pool of processes and the valid rows
+are saved with ``bulk_create``, one transaction per chunk. Invalid rows are
+skipped and reported, and an interrupted import can be resumed from the
+last committed chunk, which is stored in the database in the transaction of
+the chunk (the ``bob`` app must be installed).
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import itertools
+import multiprocessing
+
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError, router, transaction
+
+from bob.csvutil import UnicodeReader
+from bob.models import ImportCheckpoint
+
+
+class RowError(object):
+    """An error found in one row of the file.
+
+    :param line: the number of the line of the file the row ends at
+    :param messages: the list of error messages
+    """
+
+    def __init__(self, line, messages):
+        self.line = line
+        self.messages = messages
+
+    def __repr__(self):
+        return 'RowError({!r}, {!r})'.format(self.line, self.messages)
+
+
+class ImportResult(object):
+    """The summary of an import."""
+
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+        self.first_chunk = 0
+        self.last_chunk = None
+
+
+def _clean_chunk(args):
+    # runs in the worker processes, so it must be a module level function
+    importer, rows = args
+    return importer.clean_chunk(rows)
+
+
+class CsvImporter(object):
+    """
+    Imports the rows of a CSV file into ``model``. Subclass it and override
+    :py:meth:`clean_row` for custom conversions. Cleaning runs in worker
+    processes, so it must not use the database and the importer must be
+    picklable.
+
+    :param model: the target model
+    :param fields: the names of the model fields, in the order of the
+        columns. If not given, they are read from the header of the file
+    :param chunk_size: the number of rows validated and saved together
+    :param workers: the number of validating processes. With 0 the rows
+        are validated by the current process
+    :param checkpoint_key: the key under which the number of the last
+        committed chunk is stored, together with the chunk. The next import
+        with the same key starts after that chunk.
+    """
+
+    encoding = 'utf-8'
+    has_header = True
+    chunk_size = 1000
+    workers = 2
+    batch_size = None
+    checkpoint_key = None
+
+    def __init__(self, model, fields=None, **kwargs):
+        self.model = model
+        self.fields = fields
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def clean_value(self, field, value):
+        """Converts ``value`` to the python value of the model field."""
+        if not value and field.null:
+            return None
+        if field.rel:
+            # ForeignKey.validate queries the database, only check the type
+            return field.rel.get_related_field().to_python(value)
+        return field.clean(value, None)
+
+    def clean_row(self, row):
+        """
+        Returns the dict of the values of the fields of a model instance made
+        from ``row``. Raises :py:exc:`ValidationError` if the row is
+        invalid.
+        """
+        if len(row) != len(self.fields):
+            raise ValidationError(
+                'Expected {} columns, got {}.'.format(
+                    len(self.fields), len(row),
+                ),
+            )
+        values = {}
+        errors = []
+        for name, value in zip(self.fields, row):
+            field = self.model._meta.get_field(name)
+            try:
+                values[field.attname] = self.clean_value(field, value)
+            except ValidationError as e:
+                errors.extend(
+                    '{}: {}'.format(name, message) for message in e.messages
+                )
+        if errors:
+            raise ValidationError(errors)
+        return values
+
+    def clean_chunk(self, rows):
+        """
+        Cleans the ``(line, row)`` pairs, returning the list of the cleaned
+        ``(line, values)`` pairs and the list of :py:class:`RowError`.
+        """
+        cleaned = []
+        errors = []
+        for line, row in rows:
+            try:
+                cleaned.append((line, self.clean_row(row)))
+            except ValidationError as e:
+                errors.append(RowError(line, e.messages))
+        return cleaned, errors
+
+    def iter_chunks(self, f):
+        """Yields the lists of ``(line, row)`` pairs read from ``f``."""
+        reader = UnicodeReader(f, encoding=self.encoding)
+        if self.has_header:
+            header = next(reader, None)
+            if self.fields is None:
+                self.fields = [name.strip() for name in header or []]
+        for name in self.fields:
+            self.model._meta.get_field(name)  # fail early on unknown fields
+        rows = ((reader.reader.line_num, row) for row in reader)
+        while True:
+            chunk = list(itertools.islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def iter_cleaned(self, chunks):
+        """Cleans the chunks in the worker processes, yielding the results
+        in order. At most two chunks per worker are pending at a time."""
+        if not self.workers:
+            for chunk in chunks:
+                yield self.clean_chunk(chunk)
+            return
+        pool = multiprocessing.Pool(self.workers)
+        try:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(
+                    pool.apply_async(_clean_chunk, ((self, chunk),)),
+                )
+                if len(pending) >= 2 * self.workers:
+                    yield pending.popleft().get()
+            while pending:
+                yield pending.popleft().get()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def save_chunk(self, cleaned):
+        """
+        Saves the cleaned rows in one transaction, returning the number of
+        created objects and the list of :py:class:`RowError` for the rows
+        rejected by the database.
+        """
+        db = router.db_for_write(self.model)
+        objects = [self.model(**values) for line, values in cleaned]
+        try:
+            with transaction.atomic(using=db):
+                self.model.objects.using(db).bulk_create(
+                    objects, batch_size=self.batch_size,
+                )
+            return len(objects), []
+        except DatabaseError:
+            pass
+        # find the offending rows, saving the others one by one
+        errors = []
+        with transaction.atomic(using=db):
+            for (line, values), obj in zip(cleaned, objects):
+                try:
+                    with transaction.atomic(using=db):
+                        obj.save(using=db, force_insert=True)
+                except DatabaseError as e:
+                    errors.append(RowError(line, ['{}'.format(e)]))
+        return len(objects) - len(errors), errors
+
+    def get_checkpoint(self):
+        """Returns the number of the last committed chunk, or None."""
+        if not self.checkpoint_key:
+            return None
+        checkpoint = ImportCheckpoint.objects.using(
+            router.db_for_write(self.model),
+        ).filter(key=self.checkpoint_key).first()
+        return None if checkpoint is None else checkpoint.chunk
+
+    def set_checkpoint(self, chunk_number):
+        """Stores the number of the last committed chunk. It's called in
+        the transaction saving the chunk."""
+        if not self.checkpoint_key:
+            return
+        db = router.db_for_write(self.model)
+        ImportCheckpoint.objects.using(db).filter(
+            key=self.checkpoint_key,
+        ).delete()
+        ImportCheckpoint(
+            key=self.checkpoint_key, chunk=chunk_number,
+        ).save(using=db)
+
+    def run(self, f, start_chunk=None):
+        """
+        Imports the rows of the file ``f``. Returns an
+        :py:class:`ImportResult`.
+
+        :param start_chunk: the number of the first chunk to import. The
+            default is the chunk after the checkpoint
+        """
+        if start_chunk is None:
+            checkpoint = self.get_checkpoint()
+            start_chunk = 0 if checkpoint is None else checkpoint + 1
+        result = ImportResult()
+        result.first_chunk = start_chunk
+        chunks = itertools.islice(self.iter_chunks(f), start_chunk, None)
+        for number, (cleaned, errors) in enumerate(
+            self.iter_cleaned(chunks), start_chunk,
+        ):
+            # a chunk and its checkpoint are committed together, so
+            # a resumed import never saves a chunk twice
+            with transaction.atomic(using=router.db_for_write(self.model)):
+                created, db_errors = self.save_chunk(cleaned)
+                self.set_checkpoint(number)
+            result.rows += len(cleaned) + len(errors)
+            result.created += created
+            result.errors.extend(errors)
+            result.errors.extend(db_errors)
+            result.last_chunk = number
+        return result
@@ -14,8 +14,12 @@ from __future__ import unicode_literals
 import codecs
 import cStringIO
 import csv
+import itertools
+import mmap
 
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+
+from bob.compression import compress_streaming_response
 
 
 class excel_semicolon(csv.excel):
@@ -54,6 +58,102 @@ class UnicodeReader:
         return self
 
 
+class IndexedCsvReader(object):
+    """
+    A CSV reader giving random access to the rows of the file "f", which is
+    encoded in the given ASCII compatible encoding (e.g. UTF-8 or cp1250).
+    Quotes in the cells must be doubled, as in the ``excel`` dialects.
+
+    The file is memory-mapped and read once to find where every
+    ``index_step``-th row starts, so reading any range of rows parses at most
+    ``index_step`` rows before it. It supports ``len()`` and slicing, so it
+    can be paginated by ``django.core.paginator.Paginator``::
+
+        >>> reader = IndexedCsvReader(open('upload.csv', 'rb'))
+        >>> page = Paginator(reader, 50).page(18000)
+
+    :param f: a file opened in binary mode
+    """
+
+    def __init__(self, f, dialect=excel_semicolon, encoding="utf-8",
+                 index_step=1000):
+        self.dialect = dialect
+        self.encoding = encoding
+        self.index_step = index_step
+        f.seek(0, 2)
+        if f.tell():
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.data = b''  # empty files can't be mapped
+        if codecs.lookup(encoding).name.startswith(('utf-16', 'utf-32')):
+            raise ValueError('{} is not ASCII compatible.'.format(encoding))
+        self.offsets, self.row_count = self._build_index()
+
+    def _build_index(self):
+        quote = self.dialect.quotechar
+        offset = 0
+        if self.data[:3] == codecs.BOM_UTF8:
+            offset = len(codecs.BOM_UTF8)
+        offsets = []
+        row_count = 0
+        in_quotes = False
+        row_start = offset
+        for line in self._iter_lines(offset):
+            # a row continues on the next line while a quote is open
+            if quote in line:
+                in_quotes ^= line.count(quote) % 2 == 1
+            offset += len(line)
+            if not in_quotes:
+                if row_count % self.index_step == 0:
+                    offsets.append(row_start)
+                row_count += 1
+                row_start = offset
+        return offsets, row_count
+
+    def __len__(self):
+        return self.row_count
+
+    def iter_rows(self, start=0):
+        """Yields the rows from the ``start``-th one."""
+        if start >= self.row_count:
+            return
+        chunk, skip = divmod(start, self.index_step)
+        reader = csv.reader(
+            self._iter_lines(self.offsets[chunk]), dialect=self.dialect,
+        )
+        for row in itertools.islice(reader, skip, None):
+            yield [cell.decode(self.encoding) for cell in row]
+
+    def _iter_lines(self, offset):
+        data = self.data
+        while offset < len(data):
+            end = data.find(b'\n', offset)
+            end = len(data) if end == -1 else end + 1
+            yield data[offset:end]
+            offset = end
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.row_count)
+            if step != 1:
+                raise ValueError('Slicing with a step is not supported.')
+            return list(itertools.islice(
+                self.iter_rows(start), max(stop - start, 0),
+            ))
+        if key < 0:
+            key += self.row_count
+        if not 0 <= key < self.row_count:
+            raise IndexError('Row {} is out of range.'.format(key))
+        return next(self.iter_rows(key))
+
+    def __iter__(self):
+        return self.iter_rows()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+
 class UnicodeWriter:
     """
     A CSV writer which will write rows to CSV file "f",
@@ -84,6 +184,52 @@ class UnicodeWriter:
             self.writerow(row)
 
 
+class BufferedUnicodeWriter(object):
+    """
+    A faster variant of :py:class:`UnicodeWriter` producing the same output.
+    Rows are collected as UTF-8 in a buffer, which is transcoded to the
+    target encoding and written to "f" in one go every ``buffer_size``
+    bytes, instead of once per row. UTF-8 output is written as it is.
+
+    Call :py:meth:`flush` after the last row. Cells that can't be encoded
+    raise ``UnicodeEncodeError`` from the write that flushes them.
+    """
+
+    def __init__(self, f, dialect=excel_semicolon, encoding="utf-8",
+                 buffer_size=256 * 1024, **kwds):
+        self.queue = cStringIO.StringIO()
+        self.writer = csv.writer(self.queue, dialect=dialect, **kwds)
+        self.stream = f
+        self.encoding = codecs.lookup(encoding).name
+        self.encoder = codecs.getincrementalencoder(encoding)()
+        self.buffer_size = buffer_size
+
+    def writerow(self, row):
+        self.writer.writerow([s.encode("utf-8") for s in row])
+        if self.queue.tell() >= self.buffer_size:
+            self.flush()
+
+    def writerows(self, rows):
+        queue = self.queue
+        writerow = self.writer.writerow
+        buffer_size = self.buffer_size
+        for row in rows:
+            writerow([s.encode("utf-8") for s in row])
+            if queue.tell() >= buffer_size:
+                self.flush()
+
+    def flush(self):
+        """Writes the buffered rows to the target stream."""
+        if not self.queue.tell():
+            return
+        data = self.queue.getvalue()
+        if self.encoding != 'utf-8':
+            data = self.encoder.encode(data.decode("utf-8"))
+        self.stream.write(data)
+        self.queue.seek(0)
+        self.queue.truncate()
+
+
 def make_csv_response(data=[], filename='export.csv', encoding='cp1250'):
     """
     Create a HTTP response for downloading a CSV file with provided data.
@@ -101,10 +247,54 @@ def make_csv_response(data=[], filename='export.csv', encoding='cp1250'):
     """
 
     f = cStringIO.StringIO()
-    UnicodeWriter(f, encoding=encoding).writerows(
-        (unicode(item) for item in row) for row in data
-    )
+    writer = BufferedUnicodeWriter(f, encoding=encoding)
+    writer.writerows([unicode(item) for item in row] for row in data)
+    writer.flush()
     response = HttpResponse(f.getvalue(), content_type='application/csv')
     disposition = 'attachment; filename=%s' % filename
     response['Content-Disposition'] = disposition
     return response
+
+
+def iter_csv(data, encoding='cp1250', buffer_size=64 * 1024,
+             dialect=excel_semicolon):
+    """
+    Encode rows of data as CSV, yielding the output in chunks of about
+    ``buffer_size`` bytes.
+
+    :param data - iterable of rows of data
+    """
+    f = cStringIO.StringIO()
+    writer = BufferedUnicodeWriter(
+        f, dialect=dialect, encoding=encoding, buffer_size=buffer_size,
+    )
+    for row in data:
+        writer.writerow([unicode(item) for item in row])
+        if f.tell():
+            yield f.getvalue()
+            f.seek(0)
+            f.truncate()
+    writer.flush()
+    if f.tell():
+        yield f.getvalue()
+
+
+def make_csv_streaming_response(data=[], filename='export.csv',
+                                encoding='cp1250', compression=None):
+    """
+    Create a HTTP response streaming a CSV file with provided data. Unlike
+    :py:func:`make_csv_response` the file is never held in memory, so
+    ``data`` may be a generator.
+
+    :param data - iterable of rows of data
+    :param filename - the name of the file to be downloaded
+    :param compression - ``'gzip'``, ``'gz'`` or ``'zip'`` to compress the
+        file as it is written, see
+        :py:func:`bob.compression.compress_streaming_response`
+    """
+    response = StreamingHttpResponse(
+        iter_csv(data, encoding=encoding), content_type='application/csv',
+    )
+    disposition = 'attachment; filename=%s' % filename
+    response['Content-Disposition'] = disposition
+    return compress_streaming_response(response, compression, filename)
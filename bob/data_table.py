@@ -5,10 +5,522 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from django.core.paginator import Paginator, EmptyPage
-from django.db.models import FieldDoesNotExist
+import base64
+import datetime
+import decimal
+import itertools
+import json
+import operator
+import re
+import threading
+import warnings
+from multiprocessing.pool import ThreadPool
+
+from django.core.paginator import (
+    EmptyPage,
+    Page,
+    PageNotAnInteger,
+    Paginator,
+)
+from django.db import close_old_connections, connections
+from django.db.models import FieldDoesNotExist, Model, Q
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import render
+from django.utils.encoding import force_text
+from django.utils.html import conditional_escape
+from django.utils.safestring import mark_safe, SafeData
 
 from bob import csvutil
+from bob.cache import check_model_versions, make_versioned_key
+from bob.compression import accepts_gzip, compress_streaming_response
+from bob.export import registry as export_registry
+from bob.reports import FileReportStorage
+
+
+def _encode_cursor_value(value):
+    """Make a sort key JSON-serializable without losing precision."""
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, decimal.Decimal):
+        return unicode(value)
+    if isinstance(value, Model):
+        return value.pk
+    return value
+
+
+def pack_cursor(items):
+    """Pack a list of values into an opaque, url-safe string."""
+    data = json.dumps([_encode_cursor_value(item) for item in items])
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+
+def unpack_cursor(cursor):
+    """Unpack a string created by :py:func:`pack_cursor`. Returns None
+    if it is malformed."""
+    try:
+        items = json.loads(
+            base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        )
+    except (TypeError, ValueError, UnicodeError):
+        return None
+    return items if isinstance(items, list) else None
+
+
+def encode_cursor(direction, ordering, values, pk):
+    """Pack the position of a row in the sorted queryset into an opaque,
+    url-safe string.
+
+    :param direction: ``'after'`` or ``'before'``
+    :param ordering: the ordering expressions the cursor is valid for
+    :param values: the values of the ordering fields in the boundary row
+    :param pk: the primary key of the boundary row
+    """
+    return pack_cursor([direction, ordering, values, pk])
+
+
+def decode_cursor(cursor):
+    """Unpack a cursor created by :py:func:`encode_cursor`. Returns None
+    if the cursor is malformed."""
+    items = unpack_cursor(cursor)
+    if items is None or len(items) != 4:
+        return None
+    direction, ordering, values, pk = items
+    if direction not in ('after', 'before'):
+        return None
+    if not isinstance(ordering, list) or not isinstance(values, list):
+        return None
+    return direction, ordering, values, pk
+
+
+def follow_field_path(model, field_path):
+    """Returns the list of concrete model fields on the ``__`` separated
+    ``field_path``, as far as it can be followed."""
+    fields = []
+    for part in field_path.split('__'):
+        if model is None:
+            break
+        try:
+            field, __, direct, m2m = model._meta.get_field_by_name(part)
+        except FieldDoesNotExist:
+            break
+        if not direct or m2m:
+            break
+        fields.append(field)
+        model = getattr(getattr(field, 'rel', None), 'to', None)
+    return fields
+
+
+def keyset_condition(field, lookup, value, pk, condition=None):
+    """Returns the condition selecting rows lying after the row with the
+    given ``pk`` and ``value`` of ``field`` (None if ordered by ``pk``
+    only). ``lookup`` is ``'__gt'`` or ``'__lt'``. ``condition`` selects
+    the rows lying after it among those with the same ``value``, by
+    default the ones with ``pk`` beyond the given one."""
+    if condition is None:
+        condition = Q(**{'pk' + lookup: pk})
+    if field:
+        condition = (
+            Q(**{field + lookup: value}) |
+            (Q(**{field: value}) & condition)
+        )
+    return condition
+
+
+def keyset_after(ordering, values, pk, descending=False):
+    """Returns the condition selecting rows lying after the row with the
+    given ``values`` of the ``ordering`` fields (``'field'`` or
+    ``'-field'``) and ``pk``, when sorted by ``ordering`` and then ``pk``
+    (``-pk`` if ``descending``).
+    """
+    condition = Q(**{'pk__lt' if descending else 'pk__gt': pk})
+    for order, value in reversed(zip(ordering, values)):
+        condition = keyset_condition(
+            order.lstrip('-'), '__lt' if order.startswith('-') else '__gt',
+            value, pk, condition,
+        )
+    return condition
+
+
+class KeysetPage(object):
+    """A page of results fetched by keyset (seek) pagination. It mimics
+    the parts of django's ``Page`` used in templates, but instead of page
+    numbers it exposes the cursors pointing to the neighbouring pages.
+    """
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<KeysetPage of {} objects>'.format(len(self.object_list))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class LazyPage(object):
+    """A proxy that creates the page on first use. When the page is only
+    used in a cached fragment, no queries are run."""
+
+    def __init__(self, get_page):
+        self._get_page = get_page
+        self._page = None
+
+    def _setup(self):
+        if self._page is None:
+            self._page = self._get_page()
+        return self._page
+
+    def __getattr__(self, name):
+        return getattr(self._setup(), name)
+
+    def __len__(self):
+        return len(self._setup())
+
+    def __nonzero__(self):
+        return bool(self._setup())
+
+    def __iter__(self):
+        return iter(self._setup())
+
+    def __getitem__(self, index):
+        return self._setup()[index]
+
+
+class ShowAllPage(object):
+    """All the rows on a single page. At most ``limit`` rows are shown,
+    ``truncated`` tells whether there were more. The page is true even
+    when its rows are streamed separately and ``object_list`` is empty.
+    """
+
+    def __init__(self, object_list, limit, truncated=False):
+        self.object_list = object_list
+        self.limit = limit
+        self.truncated = truncated
+
+    def __repr__(self):
+        return '<ShowAllPage of {} objects>'.format(len(self.object_list))
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __nonzero__(self):
+        return True
+    __bool__ = __nonzero__
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return False
+
+    def has_previous(self):
+        return False
+
+    def has_other_pages(self):
+        return False
+
+
+TABLE_BODY_MARKER = '<!-- bob-table-body -->'
+
+_field_getters = {}
+_cell_accessors = {}
+_needs_escaping = re.compile(r'[&<>"\']').search
+
+
+def field_getter(field):
+    """Returns a function following the ``__`` separated ``field`` path on
+    an object. The function raises AttributeError if the path can't be
+    followed. The functions are created once per path."""
+    try:
+        return _field_getters[field]
+    except KeyError:
+        getter = operator.attrgetter(field.replace('__', '.'))
+        _field_getters[field] = getter
+        return getter
+
+
+def cell_accessor(model, field):
+    """Returns a function returning the contents of a ``field`` cell for
+    an instance of ``model``: the choice label of a field with choices or
+    the value at the ``field`` path ('' if it can't be followed). The
+    functions are created once per model and field."""
+    try:
+        return _cell_accessors[model, field]
+    except KeyError:
+        pass
+    try:
+        model_field = model._meta.get_field_by_name(field)[0]
+    except FieldDoesNotExist:
+        model_field = None
+    if getattr(model_field, 'choices', None):
+        attname = model_field.attname
+        choices = dict(model_field.flatchoices)
+
+        def accessor(obj):
+            value = getattr(obj, attname)
+            return force_text(choices.get(value, value), strings_only=True)
+    else:
+        getter = field_getter(field)
+
+        def accessor(obj):
+            try:
+                return getter(obj)
+            except AttributeError:
+                return ''
+    _cell_accessors[model, field] = accessor
+    return accessor
+
+
+def escape_cell(content):
+    """``conditional_escape`` that leaves the content untouched when there
+    is nothing to escape."""
+    if isinstance(content, SafeData):
+        return content
+    content = force_text(content)
+    if _needs_escaping(content) is None:
+        return content
+    return conditional_escape(content)
+
+
+def render_table_body(columns, rows, escape=escape_cell):
+    """Renders the table rows for all the given resources in a single pass.
+    Each column renders its cells for all the rows at once, see
+    :py:meth:`DataTableColumn.render_cells`.
+
+    :param columns: a list of :py:class:`DataTableColumn` objects, the ones
+        whose ``show_conditions`` are not met are skipped
+    :param rows: the resources to render
+    :param escape: the function escaping the cell contents or None
+    """
+    rows = list(rows)
+    cells = [
+        column.render_cells(rows, escape)
+        for column in columns if column.is_shown()
+    ]
+    return mark_safe(''.join(
+        '<tr>{}</tr>'.format(''.join(row)) for row in zip(*cells)
+    ))
+
+
+class ExactCount(object):
+    """Count strategy running a full ``SELECT COUNT(*)``."""
+
+    def __call__(self, queryset):
+        return queryset.count(), 'exact'
+
+
+class CappedCount(object):
+    """Count strategy that stops counting after ``limit`` rows. Returns
+    ``(limit, 'capped')`` if there are more rows."""
+
+    def __init__(self, limit=10000):
+        self.limit = limit
+
+    def __call__(self, queryset):
+        # a count of a sliced query set ignores the slice, so count the
+        # rows of a limited subquery instead
+        limited = queryset.order_by()
+        if not limited.query.distinct:
+            limited = limited.values_list('pk', flat=True)
+        try:
+            sql, params = limited[:self.limit + 1].query.sql_with_params()
+        except EmptyResultSet:
+            return 0, 'exact'
+        cursor = connections[queryset.db].cursor()
+        cursor.execute(
+            'SELECT COUNT(*) FROM ({}) capped_subquery'.format(sql), params,
+        )
+        count = cursor.fetchone()[0]
+        if count > self.limit:
+            return self.limit, 'capped'
+        return count, 'exact'
+
+
+class EstimatedCount(object):
+    """Count strategy that uses the row estimate of the database query
+    planner. Small results (below ``threshold``) are counted exactly.
+    Databases without usable statistics (e.g. sqlite) use the ``fallback``
+    strategy, :py:class:`CappedCount` by default.
+    """
+
+    def __init__(self, threshold=10000, fallback=None):
+        self.threshold = threshold
+        self.fallback = fallback or CappedCount(threshold)
+
+    def __call__(self, queryset):
+        estimate = self.estimate(queryset)
+        if estimate is None:
+            return self.fallback(queryset)
+        if estimate < self.threshold:
+            return queryset.count(), 'exact'
+        return estimate, 'estimated'
+
+    def estimate(self, queryset):
+        """Returns the planner estimate of the number of rows or None if
+        it is not available."""
+        connection = connections[queryset.db]
+        if connection.vendor not in ('postgresql', 'mysql'):
+            return None
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return None
+        cursor = connection.cursor()
+        if connection.vendor == 'postgresql':
+            cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+            plan = cursor.fetchone()[0]
+            if not isinstance(plan, list):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows'])
+        cursor.execute('EXPLAIN ' + sql, params)
+        columns = [column[0] for column in cursor.description]
+        row = cursor.fetchone()
+        if row is None or row[columns.index('rows')] is None:
+            return None
+        return int(row[columns.index('rows')])
+
+
+_count_pools = {}
+_count_pool_lock = threading.Lock()
+
+
+def get_count_pool(size=4):
+    """Returns the thread pool of ``size`` threads used for counting in the
+    background. The pools are shared by the callers asking for the same
+    size."""
+    with _count_pool_lock:
+        if size not in _count_pools:
+            _count_pools[size] = ThreadPool(size)
+        return _count_pools[size]
+
+
+def _in_transaction(db):
+    return connections[db].in_atomic_block
+
+
+def _count_in_thread(count_strategy, queryset):
+    # every thread of the pool uses its own database connection, kept
+    # between the counts only as long as CONN_MAX_AGE allows
+    close_old_connections()
+    try:
+        return count_strategy(queryset)
+    finally:
+        close_old_connections()
+
+
+class CountingPage(Page):
+    """A page of a :py:class:`CountingPaginator`. When the count is not
+    exact, there is a next page as long as this one is full."""
+
+    def has_next(self):
+        if self.paginator.count_kind == 'exact':
+            return super(CountingPage, self).has_next()
+        return len(self.object_list) == self.paginator.per_page
+
+
+class CountingPaginator(Paginator):
+    """A paginator that takes the number of objects from a count strategy
+    (:py:class:`ExactCount`, :py:class:`CappedCount`,
+    :py:class:`EstimatedCount` or any callable returning a tuple of count
+    and one of ``'exact'``, ``'capped'`` or ``'estimated'``).
+    When the count is not exact pages beyond it are still available.
+    """
+
+    def __init__(self, object_list, per_page, count_strategy=None, **kwargs):
+        super(CountingPaginator, self).__init__(
+            object_list, per_page, **kwargs
+        )
+        self.count_strategy = count_strategy or ExactCount()
+        self._count_kind = None
+        self._pending_count = None
+
+    def count_in_background(self, pool):
+        """Starts counting the objects on the given thread pool, so the
+        count runs at the same time as the query fetching the page. In
+        a transaction the objects are counted by the current connection
+        later, as the other connections can't see its uncommitted rows."""
+        if _in_transaction(self.object_list.db):
+            return
+        if self._count is None and self._pending_count is None:
+            self._pending_count = pool.apply_async(
+                _count_in_thread, (self.count_strategy, self.object_list),
+            )
+
+    def _get_count(self):
+        if self._count is None:
+            if self._pending_count is not None:
+                result, self._pending_count = self._pending_count, None
+                self._count, self._count_kind = result.get()
+            else:
+                self._count, self._count_kind = self.count_strategy(
+                    self.object_list
+                )
+        return self._count
+    count = property(_get_count)
+
+    @property
+    def count_kind(self):
+        self._get_count()
+        return self._count_kind
+
+    def validate_number(self, number):
+        if self.count_kind == 'exact':
+            return super(CountingPaginator, self).validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        return number
+
+    def _fetch(self, number):
+        bottom = (number - 1) * self.per_page
+        return list(self.object_list[bottom:bottom + self.per_page])
+
+    def page(self, number):
+        object_list = None
+        if self._pending_count is not None and not self.orphans:
+            # fetch the page while the objects are being counted
+            try:
+                object_list = self._fetch(max(1, int(number)))
+            except (TypeError, ValueError):
+                pass
+        if self.count_kind == 'exact' and object_list is None:
+            return super(CountingPaginator, self).page(number)
+        number = self.validate_number(number)
+        if object_list is None:
+            object_list = self._fetch(number)
+        if (
+            not object_list and number > 1 and
+            self.count_kind != 'exact'
+        ):
+            raise EmptyPage('That page contains no results')
+        return self._get_page(object_list, number, self)
+
+    def _get_page(self, *args, **kwargs):
+        return CountingPage(*args, **kwargs)
 
 
 class DataTableColumn(object):
@@ -22,7 +534,9 @@ class DataTableColumn(object):
      you must include bootstrap/js/bob.js file in your template
     :param bob_tag - set if the column is to be generated by bob tag
     :param sort_expression - example `book__size` (book.size)
-    :param export - set when the column is to be exported
+    :param export - set when the column is to be exported. Columns whose
+     ``field`` leads to a concrete model field are exported from
+     a ``values_list`` query, without creating model instances
     :param show_conditions - set tuple : func and args which determines whether
      the column is to be displayed, invoked in templates tag
     """
@@ -38,14 +552,20 @@ class DataTableColumn(object):
         self.export = export
         self.show_conditions = show_conditions
 
+    def is_shown(self):
+        """Evaluates ``show_conditions``."""
+        if isinstance(self.show_conditions, tuple):
+            func, arg = self.show_conditions
+            return bool(func(arg))
+        return True
+
     def render_cell_content(self, resource):
         """Renders the content of the cell."""
         if self.field:
-            for part in self.field.split('__'):
-                try:
-                    resource = getattr(resource, part)
-                except AttributeError:
-                    return ''
+            try:
+                resource = field_getter(self.field)(resource)
+            except AttributeError:
+                return ''
             return unicode(resource)
         else:
             raise NotImplementedError(
@@ -58,6 +578,46 @@ class DataTableColumn(object):
         this column and the given resource."""
         return '<td>{}</td>'.format(self.render_cell_content(resource))
 
+    def render_cells_content(self, resources):
+        """Renders the contents of the cells of this column for all the given
+        resources. Override to format a whole column of values at once."""
+        if (
+            self.field and
+            self.render_cell_content.__func__ is
+            DataTableColumn.render_cell_content.__func__
+        ):
+            getter = field_getter(self.field)
+            contents = []
+            for resource in resources:
+                try:
+                    contents.append(unicode(getter(resource)))
+                except AttributeError:
+                    contents.append('')
+            return contents
+        return [self.render_cell_content(resource) for resource in resources]
+
+    def render_cells(self, resources, escape=None):
+        """Renders the cells of this column for all the given resources.
+
+        :param escape: the function escaping the values of ``field``. The
+            contents rendered by an overridden ``render_cell_content`` or
+            ``render_cells_content`` are not escaped, like in ``render_cell``
+        """
+        render_cell = self.render_cell.__func__
+        if render_cell is not DataTableColumn.render_cell.__func__:
+            # the cell markup is customized
+            return [self.render_cell(resource) for resource in resources]
+        contents = self.render_cells_content(resources)
+        if escape is not None and self.field and (
+            self.render_cell_content.__func__ is
+            DataTableColumn.render_cell_content.__func__
+        ) and (
+            self.render_cells_content.__func__ is
+            DataTableColumn.render_cells_content.__func__
+        ):
+            contents = [escape(content) for content in contents]
+        return ['<td>{}</td>'.format(content) for content in contents]
+
 
 class DataTableMixin(object):
     """Add this Mixin to your django view to handle page pagination.
@@ -73,6 +633,67 @@ class DataTableMixin(object):
     5. In get() function call
     :py:meth:bob.data_table.DataTableMixin.data_table_query(your_query, columns).
 
+    Set ``keyset_pagination = True`` to replace ``OFFSET`` based pagination
+    with cursors (``cursor_variable_name`` in the url) pointing to the first
+    or last row of the neighbouring page. The rows are ordered by the active
+    sort column (or all the fields of the queryset ordering) with the
+    primary key as a tiebreaker, so every page costs about the same as the
+    first one. The sort columns should not contain NULL values. A random
+    ordering is paginated with offsets. Pass
+    ``cursor_variable_name`` to the ``pagination`` tag as well.
+
+    ``count_strategy`` decides how the total number of rows is obtained:
+    :py:class:`ExactCount` (the default), :py:class:`CappedCount` or
+    :py:class:`EstimatedCount`. The ``pagination`` tag renders approximate
+    totals and an open-ended last page when the count is not exact.
+
+    Showing all items on a single page (``page=0``) is limited to
+    ``show_all_limit`` rows; ``bob_page.truncated`` tells whether some rows
+    were left out. With ``stream_show_all = True`` the rows are
+    not put in the page at all - instead they are fetched with
+    ``iterator()`` and streamed in chunks of ``show_all_chunk_size`` rows
+    in place of ``{{ bob_table_body }}`` in your template. This requires
+    the view to be a ``TemplateResponseMixin``.
+
+    The CSV export is streamed. By default it contains the columns marked
+    with ``export=True``, fetched in chunks of ``export_chunk_size`` rows.
+    Override ``get_csv_data`` to export something else. Add the names of
+    other formats of :py:mod:`bob.export` (e.g. ``'jsonl'`` or ``'xlsx'``)
+    to ``export_formats`` to allow ``export=<name>``. The streamed exports
+    are compressed as they are written when requested with
+    ``export=<name>.gz`` or ``export=<name>.zip``, or - if ``gzip_exports``
+    is True - when the browser accepts the gzip ``Content-Encoding``.
+
+    The relations followed by the ``field`` of the columns
+    (e.g. ``book__author__name``) are fetched with ``select_related``, unless
+    ``select_related_columns`` is False. Set ``only_column_fields = True`` to
+    fetch only the fields displayed in the columns.
+
+    Set ``export_executor`` (e.g. :py:class:`bob.jobs.LocalExecutor` or
+    :py:class:`bob.jobs.RQExecutor`) to build the CSV export in
+    a background job. Then ``export=csv`` starts the job and shows its
+    status, ``export=status`` reports it (as JSON for AJAX requests) and
+    ``export=download`` streams the file from ``export_storage`` (see
+    :py:mod:`bob.reports`) - both with ``job_id``. The job creates the view
+    with the arguments of ``as_view`` (which must be picklable for RQ), but
+    without a request, so ``get_csv_data`` can't use it.
+
+    Set ``concurrent_count = True`` to run the count query on a thread pool
+    (of ``count_pool_size`` threads, each with its own database connection)
+    at the same time as the query fetching the page. This pays off on
+    databases with high latency, with ``CONN_MAX_AGE`` set so that the
+    threads don't connect anew for every count. In a transaction (e.g. with
+    ``ATOMIC_REQUESTS``) the count runs serially, to see the uncommitted
+    rows.
+
+    Set ``fragment_cache = True`` to cache the part of your template between
+    ``{% bob_cache bob_cache_key bob_cache_timeout %}`` and
+    ``{% endbob_cache %}`` for ``fragment_cache_timeout`` seconds. The cache
+    key contains the query string and the versions of the models displayed
+    in the columns (see :py:mod:`bob.cache`, it needs
+    ``BOB_TRACK_MODEL_VERSIONS = True``), and the page is only fetched when
+    the fragment is rendered, so repeated views run no queries.
+
     Result is stored in the
     :py:attr:bob.data_table.DataTableMixin.page_contents
     Data for template can be obtained from
@@ -94,22 +715,46 @@ class DataTableMixin(object):
 
     csv_file_name = 'file.csv'
     query_variable_name = 'page'
+    cursor_variable_name = 'cursor'
+    keyset_pagination = False
     export_variable_name = 'export'
     rows_per_page = 15
+    count_strategy = ExactCount()
+    concurrent_count = False
+    count_pool_size = 4
+    export_chunk_size = 2000
+    export_executor = None
+    export_storage = FileReportStorage()
+    export_formats = ('csv',)
+    export_compressions = ('gz', 'zip')
+    gzip_exports = False
+    job_variable_name = 'job_id'
+    fragment_cache = False
+    fragment_cache_key = None
+    fragment_cache_timeout = 300
+    select_related_columns = True
+    only_column_fields = False
+    show_all_limit = 5000
+    show_all_chunk_size = 200
+    show_all_queryset = None
+    stream_show_all = False
     sort = None
+    view_initkwargs = {}
+
+    def __init__(self, **kwargs):
+        # kept, so that the export jobs can create the same view
+        self.view_initkwargs = kwargs
+        super(DataTableMixin, self).__init__(**kwargs)
 
     def get_csv_header(self):
         """Generate a list of columns used in csv file header"""
         return [col.header_name for col in self.columns if col.export]
 
     def get_nested_field(self, obj, field):
-        nested_fields = field.split('__')
-        for nested_field in nested_fields:
-            try:
-                obj = getattr(obj, nested_field)
-            except AttributeError:
-                return ''
-        return obj
+        try:
+            return field_getter(field)(obj)
+        except AttributeError:
+            return ''
 
     def get_cell(self, obj, field, model):
         """Returns the contents of a cell
@@ -118,25 +763,98 @@ class DataTableMixin(object):
         :param model: object model instance
         :return: contents of the cell
         """
-        cell = ''
-        if obj:
-            try:
-                model._meta.get_field_by_name(field)[0].choices
-                cell = getattr(obj, 'get_' + field + '_display')()
-            except (FieldDoesNotExist, AttributeError):
-                cell = self.get_nested_field(obj, field)
-        return cell
+        if not obj:
+            return ''
+        return cell_accessor(model, field)(obj)
 
     def get_context_data_paginator(self, **kwargs):
         """Returns paginator data dict, crafted for usage in template."""
         return {
             'bob_page': self.page_contents,
+            'bob_cache_key': self.fragment_cache_key,
+            'bob_cache_timeout': self.fragment_cache_timeout,
         }
 
+    def get_cache_models(self, model):
+        """Returns the models the displayed data depends on."""
+        models = [model]
+        for column in self.columns:
+            if column.field:
+                for field in follow_field_path(model, column.field):
+                    related = getattr(getattr(field, 'rel', None), 'to', None)
+                    if related is not None and related not in models:
+                        models.append(related)
+        return models
+
+    def get_fragment_cache_key(self, queryset):
+        """Returns the cache key of the table fragment. It's built from the
+        view, the query string (filters, sort and page), the SQL of
+        ``queryset`` (so the querysets limited e.g. to the rows of the user
+        get their own fragments) and the versions of the displayed models.
+        """
+        check_model_versions('fragment_cache')
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            sql, params = '', ()
+        return make_versioned_key(
+            'bob:data_table',
+            self.get_cache_models(queryset.model),
+            '{}.{}'.format(type(self).__module__, type(self).__name__),
+            self.request.path,
+            sorted(self.request.GET.lists()),
+            sql, params,
+        )
+
+    def get_query_plan(self, model):
+        """Returns a tuple of the relations to be passed to
+        ``select_related`` and the fields to be passed to ``only``, as
+        followed by the ``field`` paths of the columns. The fields are None
+        if some column needs a field that is not known."""
+        related = set()
+        only = set()
+        for column in self.columns:
+            if not column.field:
+                only = None
+                continue
+            fields = follow_field_path(model, column.field)
+            names = [field.name for field in fields]
+            for depth, field in enumerate(fields, 1):
+                if getattr(field, 'rel', None) is not None:
+                    related.add('__'.join(names[:depth]))
+            if only is None:
+                continue
+            if len(fields) == len(column.field.split('__')):
+                only.update(
+                    '__'.join(names[:depth])
+                    for depth in range(1, len(names) + 1)
+                )
+            else:
+                only = None
+        return sorted(related), only and sorted(only)
+
+    def plan_queryset(self, queryset):
+        """Applies ``select_related`` for all the relations followed by the
+        columns and - if ``only_column_fields`` is set - ``only`` for the
+        fields they touch. This avoids a query for every related object.
+        """
+        related, only = self.get_query_plan(queryset.model)
+        if self.select_related_columns and related:
+            queryset = queryset.select_related(*related)
+        if self.only_column_fields and only:
+            if not self.select_related_columns:
+                only = [field for field in only if '__' not in field]
+            queryset = queryset.only(*only)
+        return queryset
+
     def data_table_query(self, queryset):
+        queryset = self.plan_queryset(queryset)
         queryset = self.sort_queryset(queryset)
         if self.export_requested():
             self.response = self.do_csv_export(queryset)
+        elif self.fragment_cache and not self.show_all_requested():
+            self.fragment_cache_key = self.get_fragment_cache_key(queryset)
+            self.page_contents = LazyPage(lambda: self._paginate(queryset))
         else:
             self.page_contents = self._paginate(queryset)
 
@@ -163,6 +881,10 @@ class DataTableMixin(object):
     def _paginate(self, queryset):
         """Internal pagination function"""
         page = self.request.GET.get(self.query_variable_name) or 1
+        if self.keyset_pagination and page != '0' and (
+            self.get_keyset_ordering(queryset) is not None
+        ):
+            return self._paginate_keyset(queryset)
         try:
             self.page_number = int(page)
         except ValueError:
@@ -170,30 +892,415 @@ class DataTableMixin(object):
         if self.page_number == 0:
             # show all items on a single page
             self.page_number = 1
-            self.paginator = Paginator(queryset, len(queryset))
-        else:
-            self.paginator = Paginator(queryset, self.rows_per_page)
+            limit = self.show_all_limit
+            if self.stream_show_all:
+                self.show_all_queryset = queryset[:limit]
+                return ShowAllPage(
+                    [], limit, queryset[limit:limit + 1].exists(),
+                )
+            rows = list(queryset[:limit + 1])
+            return ShowAllPage(rows[:limit], limit, len(rows) > limit)
+        self.paginator = CountingPaginator(
+            queryset, self.rows_per_page, self.count_strategy,
+        )
+        if self.concurrent_count:
+            self.paginator.count_in_background(
+                get_count_pool(self.count_pool_size)
+            )
         try:
             page_contents = self.paginator.page(self.page_number)
         except EmptyPage:
             page_contents = self.paginator.page(1)
         return page_contents
 
+    def get_keyset_ordering(self, queryset):
+        """Returns the ordering the keyset cursors are built on: the active
+        sort, the queryset ordering or the model ordering, ending with
+        ``'pk'`` or ``'-pk'`` as the tiebreaker (in the direction of the
+        first field). Returns None for a random ordering."""
+        if self.sort:
+            ordering = [self.sort]
+        else:
+            ordering = list(
+                queryset.query.order_by or
+                queryset.model._meta.ordering or
+                ['pk']
+            )
+        if '?' in ordering:
+            return None
+        for index, order in enumerate(ordering):
+            if order.lstrip('-') in ('pk', queryset.model._meta.pk.name):
+                # the rest of the ordering is never used
+                return ordering[:index] + [
+                    '-pk' if order.startswith('-') else 'pk'
+                ]
+        return ordering + ['-pk' if ordering[0].startswith('-') else 'pk']
+
+    def _paginate_keyset(self, queryset):
+        """Keyset pagination: instead of skipping ``OFFSET`` rows, select
+        the rows that lie after (or before) the row stored in the cursor."""
+        ordering = self.get_keyset_ordering(queryset)
+        fields = [order.lstrip('-') for order in ordering[:-1]]
+        cursor = decode_cursor(
+            self.request.GET.get(self.cursor_variable_name) or ''
+        )
+        if cursor is not None and (
+            cursor[1] != ordering or len(cursor[2]) != len(fields)
+        ):
+            # the cursor was created for a different ordering
+            cursor = None
+        backwards = cursor is not None and cursor[0] == 'before'
+        if backwards:
+            order_by = [
+                o[1:] if o.startswith('-') else '-' + o for o in ordering
+            ]
+        else:
+            order_by = ordering
+        queryset = queryset.order_by(*order_by)
+        if cursor is not None:
+            __, __, values, pk = cursor
+            queryset = queryset.filter(keyset_after(
+                order_by[:-1], values, pk, order_by[-1].startswith('-'),
+            ))
+        self.page_number = 1
+        object_list = list(queryset[:self.rows_per_page + 1])
+        more = len(object_list) > self.rows_per_page
+        object_list = object_list[:self.rows_per_page]
+        if backwards:
+            object_list.reverse()
+
+        def make_cursor(direction, obj):
+            values = [self.get_nested_field(obj, field) for field in fields]
+            return encode_cursor(direction, ordering, values, obj.pk)
+
+        next_cursor = previous_cursor = None
+        if object_list:
+            if more or backwards:
+                next_cursor = make_cursor('after', object_list[-1])
+            if (more and backwards) or (cursor is not None and not backwards):
+                previous_cursor = make_cursor('before', object_list[0])
+        return KeysetPage(object_list, next_cursor, previous_cursor)
+
+    def iter_table_body(self, queryset):
+        """Yields the rendered table rows in chunks."""
+        rows = queryset.iterator()
+        while True:
+            chunk = list(itertools.islice(rows, self.show_all_chunk_size))
+            if not chunk:
+                break
+            yield render_table_body(self.columns, chunk)
+
+    def render_to_response(self, context, **response_kwargs):
+        """Streams the table body if all the items were requested with
+        ``stream_show_all`` enabled."""
+        if self.show_all_queryset is None:
+            return super(DataTableMixin, self).render_to_response(
+                context, **response_kwargs
+            )
+        context['bob_table_body'] = mark_safe(TABLE_BODY_MARKER)
+        response = super(DataTableMixin, self).render_to_response(
+            context, **response_kwargs
+        )
+        head, __, tail = response.rendered_content.partition(
+            TABLE_BODY_MARKER
+        )
+        return StreamingHttpResponse(
+            itertools.chain(
+                [head], self.iter_table_body(self.show_all_queryset), [tail],
+            ),
+            content_type=response['Content-Type'],
+            status=response.status_code,
+        )
+
+    def show_all_requested(self):
+        """Returns True if all the items were requested on a single page."""
+        return self.request.GET.get(self.query_variable_name) == '0'
+
     def export_requested(self, *args, **kwargs):
         """Returns True if csv export was requested by the user or
         False in other case
         """
         export = self.request.GET.get(self.export_variable_name)
-        return export == 'csv'
+        if self.export_executor is not None and export in (
+            'status', 'download',
+        ):
+            return True
+        return self.get_export_name()[0] in self.export_formats
+
+    def get_export_name(self):
+        """Returns the name of the requested format and the compression
+        requested with its suffix (``'gz'``, ``'zip'`` or None)."""
+        export = self.request.GET.get(self.export_variable_name) or ''
+        name, __, suffix = export.partition('.')
+        if suffix in self.export_compressions:
+            return name, suffix
+        return export, None
+
+    def get_export_format(self):
+        """Returns the requested :py:class:`bob.export.ExportFormat`."""
+        return export_registry.get(self.get_export_name()[0])
+
+    def get_export_compression(self):
+        """Returns the compression of the streamed export, see
+        :py:func:`bob.compression.compress_streaming_response`."""
+        compression = self.get_export_name()[1]
+        if compression is None and self.gzip_exports and accepts_gzip(
+            self.request,
+        ):
+            return 'gzip'
+        return compression
+
+    def get_export_columns(self):
+        return [column for column in self.columns if column.export]
+
+    def resolve_field_path(self, model, field_path):
+        """Returns the list of model fields followed by ``field_path`` or
+        None if it does not lead to a concrete field."""
+        fields = follow_field_path(model, field_path)
+        if len(fields) != len(field_path.split('__')):
+            return None
+        return fields
+
+    def get_export_converter(self, model, field_path):
+        """Returns a function converting a value of ``field_path`` fetched
+        with ``values_list`` to its export form, or None if the path does not
+        lead to a concrete, non-relational field."""
+        fields = self.resolve_field_path(model, field_path)
+        if not fields or getattr(fields[-1], 'rel', None) is not None:
+            return None
+        if fields[-1].choices:
+            choices = dict(fields[-1].flatchoices)
+            return lambda value: choices.get(value, value)
+        return lambda value: value
+
+    def can_seek(self, model, ordering):
+        """Returns True if the rows can be sought by the values of the
+        ``ordering`` fields - when they are concrete, not nullable and not
+        foreign keys themselves."""
+        for order in ordering:
+            path = self.resolve_field_path(model, order.lstrip('-'))
+            if not path or path[-1].rel or any(f.null for f in path):
+                return False
+        return True
+
+    def iter_chunks(self, queryset, fields=None):
+        """Iterates over the whole queryset in chunks of
+        ``export_chunk_size`` rows using keyset pagination, so no chunk needs
+        an ``OFFSET``. Yields lists of model instances or - if ``fields`` are
+        given - lists of ``values_list`` tuples.
+
+        Rows with NULL values can't be compared, so when sorted by
+        a nullable or relational field or randomly the queryset is read with
+        a single ``iterator()``.
+        """
+        ordering = self.get_keyset_ordering(queryset)
+        if ordering is None or not self.can_seek(
+            queryset.model, ordering[:-1],
+        ):
+            if fields is not None:
+                queryset = queryset.values_list(*fields)
+            rows = queryset.iterator()
+            while True:
+                chunk = list(itertools.islice(rows, self.export_chunk_size))
+                if not chunk:
+                    return
+                yield chunk
+        keys = [order.lstrip('-') for order in ordering[:-1]]
+        queryset = queryset.order_by(*ordering)
+        if fields is not None:
+            # the keyset is appended to the requested fields
+            queryset = queryset.values_list(*(list(fields) + keys + ['pk']))
+        size = len(keys) + 1
+        descending = ordering[-1].startswith('-')
+        chunk = list(queryset[:self.export_chunk_size])
+        while chunk:
+            last = chunk[-1]
+            if fields is not None:
+                values, pk = list(last[-size:-1]), last[-1]
+                yield [row[:-size] for row in chunk]
+            else:
+                values = [self.get_nested_field(last, key) for key in keys]
+                pk = last.pk
+                yield chunk
+            if len(chunk) < self.export_chunk_size:
+                break
+            chunk = list(queryset.filter(
+                keyset_after(ordering[:-1], values, pk, descending)
+            )[:self.export_chunk_size])
 
     def get_csv_data(self, queryset):
-        """Should returns generic rows.
-        Override this method in inherited class
+        """Returns generic rows. By default these are the header and the
+        values of the columns marked with ``export=True``. Override this
+        method in inherited class for a custom export.
         """
+        columns = self.get_export_columns()
+        yield self.get_csv_header()
+        converters = [
+            column.field and self.get_export_converter(
+                queryset.model, column.field,
+            )
+            for column in columns
+        ]
+        if all(converters):
+            chunks = self.iter_chunks(
+                queryset, [column.field for column in columns],
+            )
+            for chunk in chunks:
+                for row in chunk:
+                    yield [
+                        '' if value is None else convert(value)
+                        for convert, value in zip(converters, row)
+                    ]
+        else:
+            getters = [
+                self.get_export_getter(queryset.model, column)
+                for column in columns
+            ]
+            for chunk in self.iter_chunks(queryset):
+                for obj in chunk:
+                    yield [getter(obj) for getter in getters]
+
+    def get_export_getter(self, model, column):
+        """Returns a function returning the exported value of ``column`` for
+        an instance of ``model``. The fields are exported like from
+        ``values_list`` (NULL as ``''``), the columns with a custom
+        ``render_cell_content`` as it renders them."""
+        if not column.field or (
+            column.render_cell_content.__func__ is not
+            DataTableColumn.render_cell_content.__func__
+        ):
+            return column.render_cell_content
+        accessor = cell_accessor(model, column.field)
+
+        def getter(obj):
+            value = accessor(obj)
+            if value is None:
+                return ''
+            if isinstance(value, Model):
+                return unicode(value)
+            return value
+        return getter
 
     def make_csv_response(self, data):
         return csvutil.make_csv_response(
             data=data, filename=self.csv_file_name)
 
+    def make_csv_streaming_response(self, data, compression=None):
+        return csvutil.make_csv_streaming_response(
+            data=data, filename=self.csv_file_name, compression=compression)
+
+    def make_export_streaming_response(self, data, export_format,
+                                       compression=None):
+        filename = export_format.get_file_name(self.csv_file_name)
+        response = StreamingHttpResponse(
+            export_format.write(data), content_type=export_format.content_type,
+        )
+        response['Content-Disposition'] = 'attachment; filename=%s' % filename
+        return compress_streaming_response(response, compression, filename)
+
     def do_csv_export(self, queryset):
-        return self.make_csv_response(self.get_csv_data(queryset))
+        if self.export_executor is not None:
+            return self.do_background_export(queryset)
+        export_format = self.get_export_format()
+        compression = self.get_export_compression()
+        if self.make_csv_response.__func__ is not (
+            DataTableMixin.make_csv_response.__func__
+        ):
+            warnings.warn(
+                'Overriding make_csv_response is deprecated, the CSV exports '
+                'are streamed by make_csv_streaming_response.',
+                DeprecationWarning,
+            )
+            return self.make_csv_response(self.get_csv_data(queryset))
+        if export_format.name == 'csv':
+            return self.make_csv_streaming_response(
+                self.get_csv_data(queryset), compression,
+            )
+        return self.make_export_streaming_response(
+            self.get_csv_data(queryset), export_format, compression,
+        )
+
+    def do_background_export(self, queryset):
+        """Starts the export job or reports on it."""
+        export = self.request.GET.get(self.export_variable_name)
+        format_name, compression = self.get_export_name()
+        if format_name in self.export_formats:
+            initkwargs = dict(self.view_initkwargs)
+            # the executor is not needed by the job and may not pickle
+            initkwargs.pop('export_executor', None)
+            job_id = self.export_executor.submit(
+                make_data_table_export, type(self), queryset.model,
+                queryset.query, self.sort, format_name, compression,
+                initkwargs,
+            )
+        else:
+            job_id = self.request.GET.get(self.job_variable_name)
+        job = job_id and self.export_executor.fetch(job_id)
+        if not job:
+            raise Http404('No such export job.')
+        if export == 'download':
+            if not job.finished:
+                raise Http404('The export is not ready.')
+            format_name, compression, handle = job.result
+            return self.make_export_file_response(
+                handle, export_registry.get(format_name), compression,
+            )
+        return self.get_export_status_response(job)
+
+    def make_export_file_response(self, handle, export_format,
+                                  compression=None):
+        """Streams the export stored in ``export_storage``, compressed as
+        requested when the export was started."""
+        filename = export_format.get_file_name(self.csv_file_name)
+        response = self.export_storage.make_response(
+            self.request, handle, export_format.content_type, filename,
+        )
+        if compression is None and self.gzip_exports and (
+            accepts_gzip(self.request)
+        ):
+            compression = 'gzip'
+        if compression is not None and response.has_header('Content-Length'):
+            del response['Content-Length']
+        return compress_streaming_response(response, compression, filename)
+
+    def get_export_status_response(self, job):
+        """Reports the state of the export job - as JSON for AJAX requests
+        or as a page refreshing itself until the file can be downloaded."""
+        query = self.request.GET.copy()
+        query[self.job_variable_name] = job.id
+        query[self.export_variable_name] = 'status'
+        status_query = query.urlencode()
+        query[self.export_variable_name] = 'download'
+        download_query = query.urlencode()
+        if self.request.is_ajax():
+            return HttpResponse(json.dumps({
+                'job_id': job.id,
+                'finished': job.finished,
+                'failed': job.failed,
+                'download_url': '?' + download_query if job.finished else None,
+            }), content_type='application/json')
+        return render(self.request, 'bob/export_status.html', {
+            'job': job,
+            'status_query': status_query,
+            'download_query': download_query,
+        })
+
+
+def make_data_table_export(view_class, model, query, sort,
+                           format_name='csv', compression=None,
+                           initkwargs=None):
+    """Builds the export of a :py:class:`DataTableMixin` view created with
+    ``initkwargs`` and writes it to its ``export_storage``. Meant to be
+    called by the export job. Returns the name of the format, the requested
+    compression and the handle of the file.
+    """
+    view = view_class(**(initkwargs or {}))
+    view.sort = sort
+    queryset = model._default_manager.all()
+    queryset.query = query
+    export_format = export_registry.get(format_name)
+    handle = view.export_storage.save(
+        export_format.write(view.get_csv_data(queryset)),
+        export_format.extension,
+    )
+    return format_name, compression, handle
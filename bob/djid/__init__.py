@@ -6,19 +6,40 @@ from __future__ import print_function
 from __future__ import unicode_literals
 
 import collections
+import cPickle
 import csv
-import io
+import itertools
 import json
 import types
+import warnings
 
-import django_rq
-import rq
 from django.conf.urls import patterns, url
+from django.core.cache import cache
+from django.core.exceptions import SuspiciousOperation
 from django.core.paginator import Paginator
-from django.http import HttpResponse
+from django.db.models import Max, Min
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.http import Http404, HttpResponse
 from django.conf import settings
-
+from django.utils.encoding import force_text
+from django.utils.importlib import import_module
+from django.utils.module_loading import module_has_submodule
+
+from bob.cache import (
+    check_model_versions,
+    get_or_create,
+    make_versioned_key,
+)
+from bob.data_table import (
+    follow_field_path,
+    keyset_after,
+    pack_cursor,
+    unpack_cursor,
+)
 from bob.djid.column import Column, registry
+from bob.export import registry as export_registry
+from bob.jobs import Progress, RQExecutor, estimate, get_current_progress
+from bob.reports import FileReportStorage
 from bob.djid.util import PEP3115
 
 
@@ -30,11 +51,15 @@ class DjidMeta(type):
     """A djid metaclass."""
 
     __registry__ = {}
-    queue_name = (
-        'djid_reports' if 'djid_reports' in settings.RQ_QUEUES else 'default'
-    )
-    queue = django_rq.get_queue(queue_name)
-    connection = django_rq.get_connection(queue_name)
+
+    @property
+    def queue(cls):
+        """The RQ queue of the reports, connected on the first use."""
+        return cls.get_report_executor().get_queue()
+
+    @property
+    def connection(cls):
+        return cls.queue.connection
 
     def __init__(cls, clsname, bases, dict_):
         column_dict = collections.OrderedDict()
@@ -44,6 +69,14 @@ class DjidMeta(type):
 
         def mount_column(k, v):
             v.name = k
+            v.model = getattr(meta, 'Model', None)
+            # Meta.url_fields are the fields of the grid's model, columns
+            # linking other models need their own
+            if (
+                v.url_fields is None and
+                v.get_link_model.__func__ is Column.get_link_model.__func__
+            ):
+                v.url_fields = getattr(meta, 'url_fields', None)
             column_dict[k] = v
 
         # I add getattr very reluctantly here, as this is prone to The Great
@@ -99,6 +132,32 @@ class Djid(object):
 
     __metaclass__ = DjidMeta
     page_size = 20
+    # fetch the AJAX rows with values_list when all the columns allow it
+    values_fast_path = True
+    # cache the AJAX responses, see get_ajax_cache_key
+    ajax_cache = False
+    ajax_cache_timeout = 300
+    # the parameters not affecting the data, e.g. jqGrid's cache busters
+    ignored_params = ('nd', '_')
+    # continue the infinite scroll from a cursor instead of a page number
+    cursor_pagination = False
+    # runs the background exports, see get_report_executor
+    report_executor = None
+    # the RQ queue of the default executor
+    queue_name = None
+    # where the background exports are written to
+    report_storage = FileReportStorage()
+    # the maximum number of jobs an export is split into (by pk ranges)
+    export_shards = 1
+    # the minimum number of rows exported by one of these jobs
+    export_shard_rows = 10000
+    # for how many seconds identical exports share the job, see
+    # get_report_fingerprint
+    report_reuse_timeout = 0
+    # the options passed to the writers of the export formats
+    export_options = {
+        'csv': {'encoding': 'utf-8', 'dialect': csv.excel},
+    }
 
     @classmethod
     def view_decorator(cls, view):
@@ -158,90 +217,588 @@ class Djid(object):
             cell.append(field.format_ajax_value(model))
         return {'id': model.id, 'cell': cell}
 
+    @classmethod
+    def get_values_plan(cls):
+        """Returns the list of the fields fetched with ``values_list`` by the
+        fast path and the list of ``(column, start, end)`` telling which of
+        them each column uses, or None if some column needs model instances.
+        """
+        if not cls.values_fast_path:
+            return None
+        fields = ['pk']
+        columns = []
+        for column in cls._meta.column_dict.values():
+            column_fields = column.get_db_fields()
+            if column_fields is None:
+                return None
+            columns.append(
+                (column, len(fields), len(fields) + len(column_fields)),
+            )
+            fields.extend(column_fields)
+        return fields, columns
+
+    @classmethod
+    def format_values_row(cls, values, columns):
+        """Returns a row formatted for AJAX response made of a tuple fetched
+        with ``values_list``."""
+        return {
+            'id': values[0],
+            'cell': [
+                column.format_ajax_values(values[start:end])
+                for column, start, end in columns
+            ],
+        }
+
+    @classmethod
+    def get_cache_models(cls):
+        """Returns the models the data of the grid depends on - the ones in
+        ``Meta.cache_models`` or the grid model and the models displayed by
+        the columns."""
+        models = getattr(cls._meta, 'cache_models', None)
+        if models is not None:
+            return list(models)
+        models = [cls._meta.Model]
+        for column in cls._meta.column_dict.values():
+            for model in column.get_cache_models():
+                if model not in models:
+                    models.append(model)
+        return models
+
+    @classmethod
+    def get_ajax_cache_key(cls, request, exclude=(), prefix='bob:djid'):
+        """Returns the cache key of the data requested by ``request``. It's
+        built from the grid id, the normalized parameters (except the ones in
+        ``exclude``) and the versions of the models from
+        :py:meth:`get_cache_models` (see :py:mod:`bob.cache`, it needs
+        ``BOB_TRACK_MODEL_VERSIONS = True``)."""
+        check_model_versions('ajax_cache')
+        ignored = set(cls.ignored_params) | set(exclude)
+        params = sorted(
+            (key, sorted(values))
+            for key, values in request.GET.lists()
+            if key not in ignored
+        )
+        return make_versioned_key(
+            prefix, cls.get_cache_models(), cls.get_cache_id(), params,
+        )
+
+    @classmethod
+    def get_cache_id(cls):
+        """The id of the grid used in the cache keys."""
+        return getattr(
+            cls._meta, 'djid_id', '{}.{}'.format(cls.__module__, cls.__name__),
+        )
+
     @classmethod
     def get_ajax_data(cls, request):
-        """The AJAX view for this djid."""
+        """The AJAX view for this djid. With ``ajax_cache`` the responses and
+        the counts are cached and concurrent identical requests wait for the
+        first one instead of running the same queries."""
+        if not cls.ajax_cache:
+            content = cls.get_ajax_content(request)
+        else:
+            content = get_or_create(
+                cls.get_ajax_cache_key(request),
+                lambda: cls.get_ajax_content(request),
+                cls.ajax_cache_timeout,
+            )
+        return HttpResponse(content, content_type='application/json')
+
+    @classmethod
+    def cache_count(cls, request, paginator):
+        """Fills the count of ``paginator`` from the cache. The count
+        doesn't depend on the page and the sort order, so it's shared by all
+        of them."""
+        paginator._count = get_or_create(
+            cls.get_ajax_cache_key(
+                request, ('page', 'sidx', 'sord'), 'bob:djid:count',
+            ),
+            lambda: paginator.count,
+            cls.ajax_cache_timeout,
+        )
+
+    @classmethod
+    def format_rows(cls, object_list, plan):
+        """Returns the rows formatted for AJAX response."""
+        if plan is None:
+            return [cls.format_ajax_row(model) for model in object_list]
+        fields, columns = plan
+        return [
+            cls.format_values_row(values, columns) for values in object_list
+        ]
+
+    @classmethod
+    def get_ajax_content(cls, request):
+        """Returns the JSON with the requested page."""
         filtered_query_set = cls.get_filtered_query_set(request)
+        plan = cls.get_values_plan()
+        if cls.cursor_pagination:
+            return cls.get_cursor_content(request, filtered_query_set, plan)
         page = request.GET['page']
+        if plan is not None:
+            filtered_query_set = filtered_query_set.values_list(*plan[0])
         paginator = cls.get_paginator(filtered_query_set)
-        rows = []
-        for model in paginator.page(page).object_list:
-            rows.append(cls.format_ajax_row(model))
-        return HttpResponse(
-            json.dumps({
-                'total': paginator.num_pages,
-                'page': page,
-                'records': paginator.count,
-                'rows': rows,
-            }),
-            content_type='application/json',
+        if cls.ajax_cache:
+            cls.cache_count(request, paginator)
+        rows = cls.format_rows(paginator.page(page).object_list, plan)
+        return json.dumps({
+            'total': paginator.num_pages,
+            'page': page,
+            'records': paginator.count,
+            'rows': rows,
+        })
+
+    @classmethod
+    def can_seek(cls, ordering):
+        """Returns True if the rows can be sought by the values of the
+        ``ordering`` fields - when they are concrete, not nullable and not
+        foreign keys themselves."""
+        for order in ordering:
+            path = order.lstrip('-')
+            fields = follow_field_path(cls._meta.Model, path)
+            if len(fields) != len(path.split('__')) or (
+                fields[-1].rel or any(field.null for field in fields)
+            ):
+                return False
+        return True
+
+    @classmethod
+    def get_cursor_content(cls, request, query_set, plan):
+        """
+        Returns the JSON with the rows following the ``cursor`` parameter
+        (or the first rows if there is none) and the cursor pointing after
+        them. The rows are sought by the values of the sort fields and the
+        pk, so deep pages cost the same as the first one. Sorting by
+        nullable, relational or computed fields falls back to offsets.
+        Instead of the count of the records, ``has_more`` tells whether more
+        rows follow, and ``total`` is one page more than loaded.
+        """
+        try:
+            page = int(request.GET.get('page', 1))
+        except ValueError:
+            raise SuspiciousOperation('Invalid page.')
+        model = cls._meta.Model
+        ordering = list(query_set.query.order_by)
+        if not ordering and query_set.query.default_ordering:
+            ordering = list(model._meta.ordering)
+        # the pk is the tiebreaker, the fields after it don't matter
+        tiebreaker = 'pk'
+        for index, order in enumerate(ordering):
+            if order.lstrip('-') in ('pk', model._meta.pk.name):
+                tiebreaker = '-pk' if order.startswith('-') else 'pk'
+                ordering = ordering[:index]
+                break
+        keyset = tiebreaker == 'pk' and cls.can_seek(ordering)
+        query_set = query_set.order_by(*(ordering + [tiebreaker]))
+        offset = 0
+        cursor = request.GET.get('cursor')
+        if cursor:
+            position = unpack_cursor(cursor)
+            expected = 2 + len(ordering) if keyset else 2
+            if not position or position[0] != ordering or (
+                len(position) != expected
+            ):
+                raise SuspiciousOperation('Invalid cursor.')
+            if keyset:
+                query_set = query_set.filter(
+                    keyset_after(ordering, position[2:], position[1]),
+                )
+            elif isinstance(position[1], int) and position[1] >= 0:
+                offset = position[1]
+            else:
+                raise SuspiciousOperation('Invalid cursor.')
+        if plan is not None:
+            fields = plan[0] + [order.lstrip('-') for order in ordering]
+            query_set = query_set.values_list(*fields)
+        object_list = list(query_set[offset:offset + cls.page_size + 1])
+        has_more = len(object_list) > cls.page_size
+        object_list = object_list[:cls.page_size]
+        next_cursor = None
+        if has_more and keyset:
+            last = object_list[-1]
+            if plan is None:
+                values = [
+                    reduce(getattr, order.lstrip('-').split('__'), last)
+                    for order in ordering
+                ]
+                next_cursor = pack_cursor([ordering, last.pk] + values)
+            else:
+                values = list(last[len(plan[0]):])
+                next_cursor = pack_cursor([ordering, last[0]] + values)
+        elif has_more:
+            next_cursor = pack_cursor([ordering, offset + cls.page_size])
+        return json.dumps({
+            'total': page + 1 if has_more else page,
+            'page': page,
+            'records': (page - 1) * cls.page_size + len(object_list),
+            'has_more': has_more,
+            'cursor': next_cursor,
+            'rows': cls.format_rows(object_list, plan),
+        })
+
+    @classmethod
+    def get_export_header(cls):
+        return [column.label for column in cls._meta.column_dict.values()]
+
+    @classmethod
+    def get_export_rows(cls, query_set, progress=None):
+        """Yields the header and the rows of the export, counting them in
+        ``progress`` (a :py:class:`bob.jobs.Progress`) if given."""
+        getters = [
+            cls.get_export_getter(column)
+            for column in cls._meta.column_dict.values()
+        ]
+        yield cls.get_export_header()
+        models = query_set.iterator()
+        if progress is not None:
+            progress.total = query_set.count()
+            models = progress.iterate(models)
+        for model in models:
+            yield [getter(model) for getter in getters]
+
+    @classmethod
+    def get_export_getter(cls, column):
+        """Returns the function returning the exported value of ``column``
+        for a model: its ``get_export_value``, or the deprecated
+        ``get_csv_value`` if the column overrides it."""
+        if column.get_csv_value.__func__ is Column.get_csv_value.__func__:
+            return column.get_export_value
+        warnings.warn(
+            'Overriding get_csv_value is deprecated, override '
+            'get_export_value instead.',
+            DeprecationWarning,
+        )
+        return lambda model: force_text(column.get_csv_value(model))
+
+    @classmethod
+    def iter_export_data(cls, query_set, export_format, progress=None):
+        """Yields the chunks of the exported file in the given format (see
+        :py:mod:`bob.export`)."""
+        return export_format.write(
+            cls.get_export_rows(query_set, progress),
+            **cls.export_options.get(export_format.name, {})
         )
 
     @classmethod
     def get_export_data(cls, djid, query_set, content_type):
         """Returns a tuple of content_type, result. Meant to be called by the
         enqueued function."""
+        export_format = export_registry.get(content_type)
         return (
             content_type,
-            {
-                'text/csv': cls.get_export_data_csv,
-            }[content_type](query_set)
+            b''.join(cls.iter_export_data(query_set, export_format)),
+        )
+
+    @classmethod
+    def save_report(cls, query_set, content_type, progress=None):
+        """Writes the export to the ``report_storage``. Returns a tuple of
+        content_type, handle of the report. Meant to be called by the
+        enqueued function."""
+        export_format = export_registry.get(content_type)
+        handle = cls.report_storage.save(
+            cls.iter_export_data(query_set, export_format, progress),
+            export_format.extension,
         )
+        return content_type, handle
 
     @classmethod
     def get_export_data_csv(cls, filtered_query_set):
-        buf = io.BytesIO()
-        writer = csv.writer(buf)
-        writer.writerow([
-            column.label.encode('utf-8')
-            for column in cls._meta.column_dict.values()
-        ])
-        for model in filtered_query_set:
-            writer.writerow([
-                column.get_csv_value(model)
-                for column in cls._meta.column_dict.values()
-            ])
-        return buf.getvalue()
+        return b''.join(cls.iter_export_data(
+            filtered_query_set, export_registry.get('csv'),
+        ))
+
+    @classmethod
+    def get_shards(cls, query_set):
+        """
+        Returns the list of ``(start, stop)`` pk ranges splitting
+        ``query_set`` into at most ``export_shards`` equal parts of the range
+        of its integer pks, each spanning at least ``export_shard_rows`` pks.
+        The ends of the first and the last range are None. Returns None if
+        the pks are too few, not integers or the rows are sorted by other
+        fields than pk, as the parts are merged in the order of pks.
+
+        It's called in the request starting the export, so it only asks the
+        database for the lowest and the highest pk, which the pk index
+        serves. With sparse pks the shards have fewer rows.
+        """
+        model = query_set.model
+        query = query_set.query
+        if query.low_mark or query.high_mark is not None:
+            return None
+        ordering = list(query.order_by)
+        if not ordering and query.default_ordering:
+            ordering = list(model._meta.ordering)
+        if ordering not in ([], ['pk'], [model._meta.pk.name]):
+            return None
+        pks = query_set.order_by().aggregate(low=Min('pk'), high=Max('pk'))
+        low, high = pks['low'], pks['high']
+        if not isinstance(low, (int, long)) or not isinstance(
+            high, (int, long),
+        ):
+            return None
+        span = high - low + 1
+        shards = min(cls.export_shards, span // cls.export_shard_rows)
+        if shards < 2:
+            return None
+        bounds = [None] + [
+            low + span * shard // shards for shard in range(1, shards)
+        ] + [None]
+        return zip(bounds[:-1], bounds[1:])
+
+    @classmethod
+    def save_report_shard(cls, query_set, pk_range, progress=None):
+        """Writes the rows of ``query_set`` in ``pk_range`` (without the
+        header) to the ``report_storage``, pickled. Returns the handle."""
+        start, stop = pk_range
+        if start is not None:
+            query_set = query_set.filter(pk__gte=start)
+        if stop is not None:
+            query_set = query_set.filter(pk__lt=stop)
+        rows = itertools.islice(
+            cls.get_export_rows(query_set.order_by('pk'), progress), 1, None,
+        )
+        return cls.report_storage.save(
+            (cPickle.dumps(row, cPickle.HIGHEST_PROTOCOL) for row in rows),
+            'rows',
+        )
+
+    @classmethod
+    def iter_shard_rows(cls, handle):
+        """Yields the rows saved by :py:meth:`save_report_shard`."""
+        with cls.report_storage.open(handle) as f:
+            while True:
+                try:
+                    yield cPickle.load(f)
+                except EOFError:
+                    return
+
+    @classmethod
+    def merge_report_shards(cls, handles, content_type):
+        """Writes the rows of the shards, in order, to one report in the
+        ``report_storage`` and removes the shards. Returns a tuple of
+        content_type, handle of the report."""
+        export_format = export_registry.get(content_type)
+        rows = itertools.chain(
+            [cls.get_export_header()],
+            *[cls.iter_shard_rows(handle) for handle in handles]
+        )
+        handle = cls.report_storage.save(
+            export_format.write(
+                rows, **cls.export_options.get(export_format.name, {})
+            ),
+            export_format.extension,
+        )
+        for shard_handle in handles:
+            cls.report_storage.delete(shard_handle)
+        return content_type, handle
+
+    @classmethod
+    def get_report_executor(cls):
+        """Returns the ``report_executor`` (see :py:mod:`bob.jobs`). By
+        default the reports run on the ``queue_name`` RQ queue, or on
+        ``djid_reports`` if it is configured, or on ``default``. Redis is
+        connected to when the first job is queued or fetched."""
+        if cls.report_executor is None:
+            queue_name = cls.queue_name
+            if queue_name is None:
+                queue_name = (
+                    'djid_reports'
+                    if 'djid_reports' in getattr(settings, 'RQ_QUEUES', {})
+                    else 'default'
+                )
+            cls.report_executor = RQExecutor(
+                queue_name, timeout=3000,
+                # the result is just a handle, keep it as long as the report
+                result_ttl=cls.report_storage.max_age,
+            )
+        return cls.report_executor
+
+    @classmethod
+    def fetch_job(cls, job_id):
+        job = cls.get_report_executor().fetch(job_id)
+        if job is None:
+            raise Http404('No such report job.')
+        return job
 
     @classmethod
     def start_report(cls, request):
         filtered_query_set = cls.get_filtered_query_set(request)
         content_type = request.META['HTTP_ACCEPT']
-        job = cls.queue.enqueue_call(
-            func=make_report,
-            args=(cls, filtered_query_set.query, content_type),
-            timeout=3000,
-        )
+        if cls.report_reuse_timeout:
+            job = cls.get_shared_report_job(filtered_query_set, content_type)
+        else:
+            job = cls.fetch_job(
+                cls.enqueue_report(filtered_query_set, content_type),
+            )
         return cls.get_status_response(job)
 
+    @classmethod
+    def enqueue_report(cls, query_set, content_type):
+        """Queues the export of ``query_set`` and returns the id of its
+        job."""
+        executor = cls.get_report_executor()
+        shards = None
+        if cls.export_shards > 1 and isinstance(executor, RQExecutor):
+            shards = cls.get_shards(query_set)
+        if shards:
+            return cls.start_sharded_report(
+                executor, query_set.query, content_type, shards,
+            )
+        return executor.submit(make_report, cls, query_set.query, content_type)
+
+    @classmethod
+    def get_report_fingerprint(cls, query_set, content_type):
+        """
+        Returns the key identifying the export of ``query_set`` in
+        ``content_type``. It's built from the grid id, the SQL of the query
+        (the filters and the sort normalized by the ORM, without the
+        parameters not affecting the data, like the page), the content type
+        and the versions of the models from :py:meth:`get_cache_models`.
+        """
+        check_model_versions('report_reuse_timeout')
+        try:
+            sql, params = query_set.query.sql_with_params()
+        except EmptyResultSet:
+            sql, params = '', ()
+        return make_versioned_key(
+            'bob:djid:report', cls.get_cache_models(), cls.get_cache_id(),
+            sql, params, content_type,
+        )
+
+    @classmethod
+    def get_shared_report_job(cls, query_set, content_type):
+        """
+        Returns the job of an identical export started in the last
+        ``report_reuse_timeout`` seconds, if it hasn't failed and its report
+        hasn't expired. Otherwise queues a new one.
+        """
+        key = cls.get_report_fingerprint(query_set, content_type)
+        job_id = get_or_create(
+            key, lambda: cls.enqueue_report(query_set, content_type),
+            cls.report_reuse_timeout,
+        )
+        job = cls.get_report_executor().fetch(job_id)
+        if job is not None and not cls.get_job_progress(job)[1] and (
+            not job.finished or cls.report_storage.exists(job.result[1])
+        ):
+            return job
+        job_id = cls.enqueue_report(query_set, content_type)
+        cache.set(key, job_id, cls.report_reuse_timeout)
+        return cls.fetch_job(job_id)
+
+    @classmethod
+    def start_sharded_report(cls, executor, query, content_type, shards):
+        """
+        Queues an RQ job exporting every shard and returns the id of the job
+        merging their outputs into the report. The merging job is queued by
+        the shard finished last. The ids of the shard jobs are stored in the
+        ``meta`` of the merging job, so that their progress can be summed.
+        The merging job expires after ``report_storage.max_age`` seconds
+        without a finished shard, so it doesn't stay when a shard fails.
+        """
+        import rq
+        queue = executor.get_queue()
+        merge_job = rq.job.Job.create(
+            func=merge_report, args=(cls, content_type, len(shards)),
+            connection=queue.connection, timeout=executor.timeout,
+            result_ttl=cls.report_storage.max_age,
+        )
+        shard_jobs = [
+            rq.job.Job.create(
+                func=make_report_shard,
+                args=(cls, query, index, pk_range, merge_job.id, len(shards)),
+                connection=queue.connection, timeout=executor.timeout,
+                # keep the progress until the report is downloaded
+                result_ttl=cls.report_storage.max_age,
+            )
+            for index, pk_range in enumerate(shards)
+        ]
+        merge_job.meta['shards'] = [shard_job.id for shard_job in shard_jobs]
+        merge_job.save()
+        # a failed shard never queues the merging job
+        queue.connection.expire(merge_job.key, cls.report_storage.max_age)
+        for shard_job in shard_jobs:
+            queue.enqueue_job(shard_job)
+        return merge_job.id
+
     @classmethod
     def update_status(cls, request):
-        job = rq.job.Job.fetch(
-            request.GET['job_id'], connection=cls.connection
+        return cls.get_status_response(cls.fetch_job(request.GET['job_id']))
+
+    @classmethod
+    def get_job_progress(cls, job):
+        """Returns the progress stored in the ``meta`` of the job (summed
+        over the shards of a sharded report) and whether the job (or any of
+        its shards) has failed."""
+        shard_ids = job.meta.get('shards')
+        if not shard_ids:
+            return job.meta, job.failed
+        executor = cls.get_report_executor()
+        shard_jobs = filter(None, [
+            executor.fetch(shard_id) for shard_id in shard_ids
+        ])
+        metas = [shard_job.meta for shard_job in shard_jobs]
+        started = [meta['started'] for meta in metas if 'started' in meta]
+        meta = {
+            'done': sum(meta.get('done', 0) for meta in metas),
+            'total': None,
+            'started': min(started) if started else None,
+        }
+        if len(metas) == len(shard_ids) and all(
+            meta.get('total') is not None for meta in metas
+        ):
+            meta['total'] = sum(meta['total'] for meta in metas)
+        failed = job.failed or any(
+            shard_job.failed for shard_job in shard_jobs
         )
-        return cls.get_status_response(job)
+        return meta, failed
 
     @classmethod
     def get_status_response(cls, job):
+        """Returns the state of the job (a :py:class:`bob.jobs.Job`), with
+        the percent of the exported rows and the estimated number of seconds
+        left (None until known)."""
+        meta, failed = cls.get_job_progress(job)
+        progress, eta = estimate(meta)
         return HttpResponse(json.dumps({
             'job_id': job.id,
-            'finished': job.result is not None,
+            'finished': job.finished,
+            'failed': failed,
             'exc_info': job.exc_info,
+            'done': meta.get('done'),
+            'total': meta.get('total'),
+            'progress': progress,
+            'eta': eta,
         }), mimetype='application/json')
 
     @classmethod
     def get_report(cls, request):
-        job = rq.job.Job.fetch(
-            request.GET['job_id'], connection=cls.connection
+        job = cls.fetch_job(request.GET['job_id'])
+        if not job.finished:
+            raise Http404('The report is not ready.')
+        content_type, handle = job.result
+        return cls.report_storage.make_response(
+            request, handle, content_type,
+            export_registry.get(content_type).get_file_name(cls._meta.djid_id),
         )
-        content_type, result = job.result
-        return HttpResponse(result, content_type=content_type)
+
+    @classmethod
+    def get_by_id(cls, djid_id):
+        """Returns the grid with the given ``djid_id``. The grids not
+        registered yet are looked for by :py:func:`autodiscover`. Raises
+        ``KeyError`` if there is no such grid."""
+        if djid_id not in cls.__registry__:
+            autodiscover()
+        return cls.__registry__[djid_id]
 
     @classmethod
     def dispatcher(cls, request, djid_id, action):
         """Dispatching view that passes control to appropriate method in
         an appropriate djid"""
-        djid = cls.__registry__[djid_id]
+        try:
+            djid = cls.get_by_id(djid_id)
+        except KeyError:
+            raise Http404('No such grid.')
         # No. Removing the dictionary below is not a good idea, as it will
         # allow user to call any method of djid
         method = getattr(djid, {
@@ -298,11 +855,61 @@ class Djid(object):
             'colModel': cls.col_model(),
             'rowNum': cls.page_size
         }
-        ret.update(cls.additional_params())
+        if cls.cursor_pagination:
+            ret['djidCursor'] = True
+        ret.update(cls.additional_params() or {})
         return json.dumps(ret)
 
 
+def autodiscover():
+    """
+    Registers the grids defined in the ``djids`` modules of the installed
+    apps and in the modules listed in the ``BOB_DJID_MODULES`` setting, by
+    importing them. It's called when a grid that is not registered yet is
+    requested, so the grids don't have to be imported at startup.
+    """
+    for app in settings.INSTALLED_APPS:
+        app_module = import_module(app)
+        try:
+            import_module('{}.djids'.format(app))
+        except ImportError:
+            # reraise the errors of the existing modules
+            if module_has_submodule(app_module, 'djids'):
+                raise
+    for module_name in getattr(settings, 'BOB_DJID_MODULES', ()):
+        import_module(module_name)
+
+
 def make_report(djid, query, content_type):
     queryset = djid._meta.Model.objects.all()
     queryset.query = query
-    return djid.get_export_data(djid, queryset, content_type)
+    return djid.save_report(queryset, content_type, get_current_progress())
+
+
+def make_report_shard(djid, query, index, pk_range, merge_job_id,
+                      shard_count):
+    import rq
+    queryset = djid._meta.Model.objects.all()
+    queryset.query = query
+    job = rq.get_current_job()
+    handle = djid.save_report_shard(
+        queryset, pk_range, Progress.for_rq_job(job),
+    )
+    # the handles are kept in the hash of the merging job
+    key = rq.job.Job.key_for(merge_job_id)
+    job.connection.hset(key, 'shard:{}'.format(index), handle)
+    job.connection.expire(key, djid.report_storage.max_age)
+    if job.connection.hincrby(key, 'shards_done', 1) == shard_count:
+        merge_job = rq.job.Job.fetch(merge_job_id, connection=job.connection)
+        rq.Queue(job.origin, connection=job.connection).enqueue_job(merge_job)
+    return handle
+
+
+def merge_report(djid, content_type, shard_count):
+    import rq
+    job = rq.get_current_job()
+    handles = [
+        job.connection.hget(job.key, 'shard:{}'.format(index)).decode('utf-8')
+        for index in range(shard_count)
+    ]
+    return djid.merge_report_shards(handles, content_type)
@@ -6,6 +6,7 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
+from django.db import connections
 from django.db.models import (
     Count,
     Field,
@@ -28,23 +29,33 @@ class Column(object):
     """A column object.
         :param as_link: True or False to force creating links to related object
         If None, the links will be present if ``get_absolute_url`` is defined
+        :param url_fields: The fields of the linked object used by its
+        ``get_absolute_url``. When given, links don't need model instances,
+        see :py:meth:`get_db_fields`
     """
 
     filtered = False
     linking_available = True
+    model = None
 
-    def __init__(self, label, as_link=False):
+    def __init__(self, label, as_link=False, url_fields=None):
         global _counter
         self.label = label
         self.as_link = as_link and self.linking_available
+        self.url_fields = url_fields
         if not PEP3115:
             self.counter = _counter
             _counter += 1
 
     def get_csv_value(self, model):
-        """Returns a 8-bit-safe value for csv."""
+        """Returns a 8-bit-safe value for csv. Deprecated, the exports use
+        :py:meth:`get_export_value`."""
         return self.format_label(model).encode('utf-8')
 
+    def get_export_value(self, model):
+        """Returns the value written to the exported files."""
+        return self.format_label(model)
+
     def format_ajax_value(self, model):
         """Returns a value to be sent via AJAX. It should be an object dumpable
         to JSON."""
@@ -65,6 +76,71 @@ class Column(object):
         """Return the text to be displayed in the cell. To be implemented in
         subclasses"""
 
+    def get_label_fields(self):
+        """Return the list of the field paths the label is made of, or None
+        if the label needs the model instance."""
+        return None
+
+    def format_label_values(self, values):
+        """Return the text to be displayed in the cell made of the values of
+        :py:meth:`get_label_fields`."""
+        raise NotImplementedError
+
+    def get_link_model(self):
+        """Return the model class of the linked objects."""
+        return self.model
+
+    def get_url_prefix(self):
+        """Return the path to the linked object prepended to ``url_fields``.
+        """
+        return ''
+
+    def get_db_fields(self):
+        """Return the list of the field paths fetched with ``values_list`` to
+        format the cell (see :py:meth:`format_ajax_values`), or None if the
+        cell needs the model instance."""
+        if not self.formats_values():
+            return None
+        label_fields = self.get_label_fields()
+        if label_fields is None or not self.as_link:
+            return label_fields
+        if not hasattr(self.get_link_model(), 'get_absolute_url'):
+            return label_fields
+        if not self.url_fields:
+            return None
+        prefix = self.get_url_prefix()
+        return label_fields + [prefix + field for field in self.url_fields]
+
+    def formats_values(self):
+        """Return True if :py:meth:`format_label_values` formats the cells
+        like :py:meth:`format_label`, i.e. none of ``format_label`` or
+        ``format_ajax_value`` is overridden below the class that defines
+        how the cells are made of the values."""
+        def defined_in(name):
+            for cls in type(self).__mro__:
+                if name in vars(cls):
+                    return cls
+        values_classes = [
+            defined_in('get_label_fields'),
+            defined_in('format_label_values'),
+        ]
+        return all(
+            issubclass(values_class, defined_in(name))
+            for values_class in values_classes
+            for name in ('format_label', 'format_ajax_value')
+        )
+
+    def format_ajax_values(self, values):
+        """Return the value to be sent via AJAX made of the values of
+        :py:meth:`get_db_fields`."""
+        label_count = len(self.get_label_fields())
+        label = self.format_label_values(values[:label_count])
+        url_values = values[label_count:]
+        if not url_values or None in url_values:
+            return label
+        obj = self.get_link_model()(**dict(zip(self.url_fields, url_values)))
+        return (obj.get_absolute_url(), label)
+
     @classmethod
     def from_field(cls, field, Model, *args, **kwargs_override):
         call_kwargs = {
@@ -81,6 +157,11 @@ class Column(object):
         """
         return qs
 
+    def get_cache_models(self):
+        """Return the models other than the grid model that the column
+        displays. The cached data is invalidated when they change."""
+        return []
+
     def handle_filters(self, qs, get_dict):
         raise NotImplementedError
 
@@ -135,19 +216,53 @@ registry = _ColumnRegistry()
 
 
 class CharColumn(Column):
-    """A simple column that handles character data from a single field."""
+    """A simple column that handles character data from a single field.
+        :param lookup: How the filter matches the values: ``'contains'``
+        (the default, which no B-tree index can serve), ``'exact'``,
+        ``'prefix'`` (case-insensitive ``startswith``) or ``'trigram'``
+        (case-insensitive ``contains`` served by a trigram index on
+        PostgreSQL, ``prefix`` on the databases without them)
+        :param min_length: The filters shorter than that are ignored
+    """
 
     filtered = True
+    lookups = {
+        'contains': '__icontains',
+        'exact': '__exact',
+        'prefix': '__istartswith',
+    }
+    # the databases whose trigram indexes serve the ``icontains`` lookup
+    trigram_vendors = ('postgresql',)
+
+    def __init__(self, *args, **kwargs):
+        self.lookup = kwargs.pop('lookup', 'contains')
+        self.min_length = kwargs.pop('min_length', 0)
+        if self.lookup != 'trigram' and self.lookup not in self.lookups:
+            raise ValueError('Unknown lookup {}.'.format(self.lookup))
+        super(CharColumn, self).__init__(*args, **kwargs)
+
+    def get_lookup(self, qs):
+        """Return the suffix of the filter lookup used on ``qs``."""
+        if self.lookup != 'trigram':
+            return self.lookups[self.lookup]
+        if connections[qs.db].vendor in self.trigram_vendors:
+            return self.lookups['contains']
+        return self.lookups['prefix']
 
     def format_label(self, model):
         return getattr(model, self.name, '')
 
+    def get_label_fields(self):
+        return [self.name]
+
+    def format_label_values(self, values):
+        return values[0]
+
     def handle_filters(self, qs, get_dict):
         value = get_dict.get(self.name)
-        if value is not None:
-            return qs.filter(**{self.name + '__icontains': value})
-        else:
+        if value is None or len(value) < self.min_length:
             return qs
+        return qs.filter(**{self.name + self.get_lookup(qs): value})
 
 registry.register(CharField, CharColumn)
 
@@ -161,6 +276,13 @@ class DateTimeColumn(Column):
         result = getattr(model, self.name, '') or ''
         return result and result.strftime('%Y-%m-%d %H:%M:%S')
 
+    def get_label_fields(self):
+        return [self.name]
+
+    def format_label_values(self, values):
+        result = values[0] or ''
+        return result and result.strftime('%Y-%m-%d %H:%M:%S')
+
     def get_model(self):
         result = super(DateTimeColumn, self).get_model()
         result.update({'formatter': 'date', 'formatoptions': {
@@ -199,6 +321,23 @@ class ForeignColumn(Column):
             getattr(model, self.name)
         )
 
+    def get_label_fields(self):
+        if self.label_function is not None or self.label_field is None:
+            return None
+        return [self.name + '__' + self.label_field]
+
+    def format_label_values(self, values):
+        return values[0]
+
+    def get_link_model(self):
+        return self.model._meta.get_field(self.name).rel.to
+
+    def get_url_prefix(self):
+        return self.name + '__'
+
+    def get_cache_models(self):
+        return [self.get_link_model()]
+
     def process_queryset(self, qs):
         return qs.select_related(self.name)
 
@@ -214,6 +353,15 @@ class NumberColumn(Column):
     def format_label(self, model):
         return str(getattr(model, self.name))
 
+    def get_export_value(self, model):
+        return getattr(model, self.name)
+
+    def get_label_fields(self):
+        return [self.name]
+
+    def format_label_values(self, values):
+        return str(values[0])
+
     def handle_filters(self, qs, get_dict):
         value = get_dict.get(self.name)
         if value is None:
@@ -250,3 +398,6 @@ class CountColumn(NumberColumn):
 
     def process_queryset(self, qs):
         return qs.annotate(**{self.name: Count(self.relation)})
+
+    def get_cache_models(self):
+        return [self.model._meta.get_field_by_name(self.relation)[0].model]
@@ -32,6 +32,9 @@ define([
         this.pager_id = '#' + id + '-pager';
         new_params.pager = this.pager_id;
         new_params.url = '/djid/' + id + '/';
+        if (new_params.djidCursor) {
+            this.use_cursor(new_params);
+        }
         this.jqgrid = $('#' + id).jqGrid(new_params);
         this.jqgrid.navGrid(this.pager_id, {
             'edit': false,
@@ -66,6 +69,35 @@ define([
         scroll: true,
     };
 
+    Djid.prototype.use_cursor = function (params) {
+        /* Send the cursor returned with a page when asking for the next one.
+           The callbacks given in params are still called. */
+        var cursors = {},
+            serializeGridData = params.serializeGridData,
+            loadComplete = params.loadComplete;
+        params.serializeGridData = function (data) {
+            var page = parseInt(data.page, 10);
+            if (page > 1 && cursors[page]) {
+                data.cursor = cursors[page];
+            } else {
+                cursors = {};
+                delete data.cursor;
+            }
+            if (serializeGridData) {
+                return serializeGridData.apply(this, arguments);
+            }
+            return data;
+        };
+        params.loadComplete = function (data) {
+            if (data && data.cursor) {
+                cursors[parseInt(data.page, 10) + 1] = data.cursor;
+            }
+            if (loadComplete) {
+                return loadComplete.apply(this, arguments);
+            }
+        };
+    };
+
     Djid.prototype.get_report = function () {
         this.add_progress();
         this.initial_request();
@@ -93,6 +125,12 @@ define([
         that = this;
         this.job_id = result.job_id;
         data = {'job_id': this.job_id};
+        this.short_interval_handle = window.setInterval(function () {
+            if (that.eta && that.eta.asSeconds() >= 1) {
+                that.eta.subtract(1, 'seconds');
+            }
+            that.update_eta_display();
+        }, 1000);
         this.long_interval_handle = window.setInterval(function () {
             $.ajax({
                 url:that.get_url('update_status'),
@@ -108,16 +146,17 @@ define([
         if (value === null) {
             this.eta = null;
         } else {
-            this.eta = moment.Duration(value, 'seconds');
+            this.eta = moment.duration(Math.round(value), 'seconds');
         }
     };
 
     Djid.prototype.update_eta_display = function () {
         if (!this.eta) {
+            $(this.eta_el).html('');
             return;
         }
         $(this.eta_el).html(Mustache.render('ETA: {{hours}}:{{minutes}}:{{seconds}}', {
-            hours: this.pad(this.eta.hours()),
+            hours: this.pad(Math.floor(this.eta.asHours())),
             minutes: this.pad(this.eta.minutes()),
             seconds: this.pad(this.eta.seconds())
         }));
@@ -134,6 +173,13 @@ define([
              bootbox.alert('Failed to generate the report');
              return;
         }
+        if (result.progress !== null && result.progress !== undefined) {
+            this.set_progress(result.progress);
+        }
+        if (result.eta !== null && result.eta !== undefined) {
+            this.set_eta(result.eta);
+            this.update_eta_display();
+        }
         if (result.finished) {
             clearInterval(this.long_interval_handle);
             clearInterval(this.short_interval_handle);
@@ -148,11 +194,11 @@ define([
     };
 
     Djid.prototype.set_progress = function (value) {
-        $(this.progress).removeClass('progress-striped active');
-        $(this.progress).children('.bar').css(
-            'width',
-            value.toString() + '%'
-        );
+        this.progress.progressbar('option', 'value', Math.round(value));
+    };
+
+    Djid.prototype.pad = function (value) {
+        return value < 10 ? '0' + value.toString() : value.toString();
     };
 
     Djid.prototype.get_url = function (action) {
@@ -170,10 +216,16 @@ define([
         $(this.get_id('pager_right')).append(this.progress);
         this.progress.progressbar();
         this.progress.progressbar('option', 'value', false);
+        this.eta_el = $('<span></span>').attr(
+            'id',
+            this.get_id('eta', true)
+        );
+        $(this.get_id('pager_right')).append(this.eta_el);
     };
 
     Djid.prototype.remove_progress = function () {
         this.progress.remove();
+        this.eta_el.remove();
     };
 
     Djid.prototype.get_id = function (suffix, drop_hash) {
@@ -8,7 +8,7 @@ register = template.Library()
 
 @register.inclusion_tag('djid.html')
 def djid(djid_id):
-    djid = Djid.__registry__[djid_id]
+    djid = Djid.get_by_id(djid_id)
     return {
         'djid': djid,
         'meta': djid._meta,
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming export formats.
+
+A format writer takes an iterable of rows and yields the encoded file in
+chunks of about ``buffer_size`` bytes, so the whole file is never held in
+memory. The first row is the header. The formats are looked up in the
+``registry`` by name or by content type::
+
+    >>> export_format = registry.get('text/csv')
+    >>> chunks = export_format.write(rows, encoding='utf-8')
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import collections
+import datetime
+import decimal
+import json
+import re
+
+from django.utils.html import escape
+
+from bob import csvutil
+from bob.compression import BUFFER_SIZE, iter_buffered, iter_zip
+
+
+def write_csv(rows, encoding='cp1250', dialect=csvutil.excel_semicolon,
+              buffer_size=BUFFER_SIZE):
+    """Writes the rows as CSV, see :py:func:`bob.csvutil.iter_csv`."""
+    return csvutil.iter_csv(
+        rows, encoding=encoding, dialect=dialect, buffer_size=buffer_size,
+    )
+
+
+def _json_default(value):
+    return '{}'.format(value)
+
+
+def write_jsonl(rows, buffer_size=BUFFER_SIZE):
+    """Writes every row as a JSON array on a separate line (JSON Lines).
+    The values that are not JSON types are converted to strings."""
+    return iter_buffered((
+        json.dumps(
+            list(row), ensure_ascii=False, default=_json_default,
+        ).encode('utf-8') + b'\n'
+        for row in rows
+    ), buffer_size)
+
+
+XLSX_FILES = [
+    ('[Content_Types].xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'content-types">'
+        '<Default Extension="rels" ContentType="application/'
+        'vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType='
+        '"application/vnd.openxmlformats-officedocument.spreadsheetml.'
+        'worksheet+xml"/>'
+        '</Types>'
+    )),
+    ('_rels/.rels', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )),
+    ('xl/workbook.xml', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+        '2006/main" xmlns:r="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet_name}" sheetId="1" r:id="rId1"/>'
+        '</sheets></workbook>'
+    )),
+    ('xl/_rels/workbook.xml.rels', (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+        '2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+        'officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    )),
+]
+
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/'
+    'main"><sheetData>'
+)
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+# characters not allowed in XML 1.0
+_xml_invalid = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, (int, long, float, decimal.Decimal)) and (
+        not isinstance(value, bool)
+    ):
+        return '<c><v>{}</v></c>'.format(value)
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (datetime.date, datetime.time)):
+        value = value.isoformat()
+    return (
+        '<c t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>'.format(
+            _xml_invalid.sub('', escape('{}'.format(value))),
+        )
+    )
+
+
+def write_xlsx(rows, sheet_name='Sheet1', buffer_size=BUFFER_SIZE):
+    """Writes the rows as a single sheet of an Office Open XML workbook.
+    The strings are stored inline, so the sheet is written as the rows come.
+    Numbers are stored as numbers, dates as ISO 8601 strings."""
+    def sheet():
+        yield XLSX_SHEET_START.encode('utf-8')
+        for row in rows:
+            yield '<row>{}</row>'.format(
+                ''.join(_xlsx_cell(value) for value in row),
+            ).encode('utf-8')
+        yield XLSX_SHEET_END.encode('utf-8')
+
+    sheet_name = escape(sheet_name)
+    files = [
+        (name, [content.format(sheet_name=sheet_name).encode('utf-8')])
+        for name, content in XLSX_FILES
+    ]
+    files.append(
+        ('xl/worksheets/sheet1.xml', iter_buffered(sheet(), buffer_size)),
+    )
+    return iter_zip(files, buffer_size=buffer_size)
+
+
+class ExportFormat(object):
+    """An export format.
+
+    :param name: the short name, e.g. used in query strings
+    :param content_type: the MIME type of the files
+    :param extension: the extension of the file names
+    :param writer: the function taking the rows (and options) and yielding
+        chunks of the file
+    """
+
+    def __init__(self, name, content_type, extension, writer):
+        self.name = name
+        self.content_type = content_type
+        self.extension = extension
+        self.writer = writer
+
+    def write(self, rows, **options):
+        """Yields the chunks of the file containing ``rows``."""
+        return self.writer(rows, **options)
+
+    def get_file_name(self, base_name):
+        """Replaces the extension of ``base_name`` with the one of this
+        format."""
+        return '{}.{}'.format(base_name.rsplit('.', 1)[0], self.extension)
+
+
+class _FormatRegistry(object):
+    """A singleton registry of export formats."""
+
+    def __init__(self):
+        self._formats = collections.OrderedDict()
+
+    def register(self, name, content_type, extension, writer):
+        """Adds a format, replacing the one with the same name."""
+        self._formats[name] = ExportFormat(
+            name, content_type, extension, writer,
+        )
+
+    def get(self, key):
+        """Returns the format with the given name or content type."""
+        if key in self._formats:
+            return self._formats[key]
+        for export_format in self._formats.values():
+            if export_format.content_type == key:
+                return export_format
+        raise ValueError("No export format matched {}.".format(key))
+
+    def __iter__(self):
+        return iter(self._formats.values())
+
+registry = _FormatRegistry()
+
+registry.register('csv', 'text/csv', 'csv', write_csv)
+registry.register('jsonl', 'application/x-jsonlines', 'jsonl', write_jsonl)
+registry.register(
+    'xlsx',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'xlsx',
+    write_xlsx,
+)
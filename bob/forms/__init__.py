@@ -4,5 +4,31 @@ from __future__ import division
 from __future__ import print_function
 from __future__ import unicode_literals
 
-from bob.forms.widgets import *  # noqa
-from bob.forms.dependency import *  # noqa
+from bob.forms.widgets import (
+    AutocompleteWidget,
+    DateTimeWidget,
+    DateWidget,
+)
+from bob.forms.dependency import (
+    AJAX_UPDATE,
+    CLONE,
+    REQUIRE,
+    SHOW,
+    Dependency,
+    DependencyCondition,
+    DependencyForm,
+)
+
+
+__all__ = [
+    'AJAX_UPDATE',
+    'CLONE',
+    'REQUIRE',
+    'SHOW',
+    'AutocompleteWidget',
+    'DateTimeWidget',
+    'DateWidget',
+    'Dependency',
+    'DependencyCondition',
+    'DependencyForm',
+]
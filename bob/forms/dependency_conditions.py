@@ -1,11 +1,11 @@
 # -*- coding: utf-8 -*-
 from collections import Container
 
-from django.db.models import Model
-
 
 def format_single_val_for_js(val):
     """Return the appropriate js representation of a single value."""
+    # imported here, so that importing the forms doesn't load the ORM
+    from django.db.models import Model
     # null, true and false are correct json values
     if not (val is None or isinstance(val, bool)):
         if isinstance(val, Model):
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Executors running long jobs (e.g. exports) outside of the request.
+
+An executor exposes two methods: ``submit(func, *args, **kwargs)`` queues
+a call and returns the id of the job, ``fetch(job_id)`` returns
+a :py:class:`Job` describing its state, or None if there is no such job.
+
+A job reports its progress through a :py:class:`Progress`, which stores the
+number of the processed items in the ``meta`` of the job. The running job
+gets it from :py:func:`get_current_progress`.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import multiprocessing
+import sys
+import threading
+import time
+import traceback
+import uuid
+from multiprocessing.pool import ThreadPool
+
+from django.db import close_old_connections, connections
+
+
+# the job run by the current thread of a LocalExecutor
+_current = threading.local()
+
+
+class Job(object):
+    """The state of a job.
+
+    :param status: one of ``'queued'``, ``'started'``, ``'finished'`` or
+        ``'failed'``
+    :param result: the value returned by the job, once it has finished
+    :param exc_info: the formatted traceback, if the job has failed
+    :param meta: the dict of the data reported by the running job
+    """
+
+    def __init__(self, id, status='queued', result=None, exc_info=None,
+                 meta=None):
+        self.id = id
+        self.status = status
+        self.result = result
+        self.exc_info = exc_info
+        self.meta = meta if meta is not None else {}
+        self.updated = time.time()
+
+    @property
+    def finished(self):
+        return self.status == 'finished'
+
+    @property
+    def failed(self):
+        return self.status == 'failed'
+
+
+def _format_exc_info():
+    return ''.join(traceback.format_exception(*sys.exc_info()))
+
+
+def _forget_connections():
+    # the database connections inherited from the parent process can't be
+    # shared, so the pool processes open their own ones
+    for connection in connections.all():
+        connection.connection = None
+
+
+def _run_in_process(func, args, kwargs):
+    try:
+        return 'finished', func(*args, **kwargs), None
+    except Exception:
+        return 'failed', None, _format_exc_info()
+
+
+class LocalExecutor(object):
+    """Runs the jobs on a pool of ``workers`` threads of the current process.
+    With ``workers=0`` the jobs are run synchronously by ``submit``, which
+    is useful in tests and for tiny jobs. The jobs are forgotten ``ttl``
+    seconds after they are done. No Redis is needed, but the jobs are only
+    visible to the process that runs them.
+
+    With ``processes=True`` the jobs are run on a pool of processes instead,
+    so the functions and their arguments must be picklable. These jobs don't
+    report their progress.
+    """
+
+    def __init__(self, workers=2, ttl=3600, processes=False):
+        self.workers = workers
+        self.ttl = ttl
+        self.processes = processes
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                if self.processes:
+                    self._pool = multiprocessing.Pool(
+                        self.workers, initializer=_forget_connections,
+                    )
+                else:
+                    self._pool = ThreadPool(self.workers)
+        return self._pool
+
+    def _run(self, job, func, args, kwargs):
+        job.status = 'started'
+        _current.job = job
+        if self.workers:
+            # every thread of the pool uses its own database connection
+            close_old_connections()
+        try:
+            job.result = func(*args, **kwargs)
+        except Exception:
+            job.exc_info = _format_exc_info()
+            job.status = 'failed'
+        else:
+            job.status = 'finished'
+        finally:
+            _current.job = None
+            if self.workers:
+                close_old_connections()
+        job.updated = time.time()
+
+    def _finish(self, job, outcome):
+        job.status, job.result, job.exc_info = outcome
+        job.updated = time.time()
+
+    def _forget_old_jobs(self):
+        deadline = time.time() - self.ttl
+        with self._lock:
+            for job_id, job in list(self._jobs.items()):
+                if job.status in ('finished', 'failed') and (
+                    job.updated < deadline
+                ):
+                    del self._jobs[job_id]
+
+    def submit(self, func, *args, **kwargs):
+        self._forget_old_jobs()
+        job = Job(uuid.uuid4().hex)
+        with self._lock:
+            self._jobs[job.id] = job
+        if self.workers and self.processes:
+            self._get_pool().apply_async(
+                _run_in_process, (func, args, kwargs),
+                callback=lambda outcome: self._finish(job, outcome),
+            )
+        elif self.workers:
+            self._get_pool().apply_async(
+                self._run, (job, func, args, kwargs),
+            )
+        else:
+            self._run(job, func, args, kwargs)
+        return job.id
+
+    def fetch(self, job_id):
+        return self._jobs.get(job_id)
+
+
+class RQExecutor(object):
+    """Runs the jobs on RQ workers. Requires ``django_rq``.
+
+    :param queue_name: the name of the queue in ``settings.RQ_QUEUES``
+    :param timeout: the timeout of the jobs in seconds
+    :param result_ttl: for how many seconds the results are kept, by
+        default for the RQ default of 500 seconds
+    """
+
+    def __init__(self, queue_name='default', timeout=3000, result_ttl=None):
+        self.queue_name = queue_name
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self._queue = None
+
+    def get_queue(self):
+        """Returns the queue, connecting on the first call."""
+        if self._queue is None:
+            import django_rq
+            self._queue = django_rq.get_queue(self.queue_name)
+        return self._queue
+
+    def submit(self, func, *args, **kwargs):
+        job = self.get_queue().enqueue_call(
+            func=func, args=args, kwargs=kwargs, timeout=self.timeout,
+            result_ttl=self.result_ttl,
+        )
+        return job.id
+
+    def fetch(self, job_id):
+        from rq.exceptions import NoSuchJobError
+        from rq.job import Job as RQJob
+        queue = self.get_queue()
+        try:
+            rq_job = RQJob.fetch(job_id, connection=queue.connection)
+        except NoSuchJobError:
+            return None
+        if rq_job.is_failed:
+            status = 'failed'
+        elif rq_job.is_finished:
+            status = 'finished'
+        elif rq_job.is_started:
+            status = 'started'
+        else:
+            status = 'queued'
+        return Job(
+            rq_job.id, status, rq_job.result, rq_job.exc_info, rq_job.meta,
+        )
+
+
+class Progress(object):
+    """
+    Counts the items processed by a job and stores their number in
+    ``meta``, at most once every ``interval`` seconds::
+
+        >>> progress = Progress(job.meta, total=query_set.count())
+        >>> for item in progress.iterate(query_set):
+        ...     process(item)
+
+    :param meta: the dict updated with ``done``, ``total`` and ``started``
+    :param save: the function called after ``meta`` is updated, e.g. to
+        store it in Redis
+    """
+
+    def __init__(self, meta, total=None, save=None, interval=2):
+        self.meta = meta
+        self.total = total
+        self.save = save
+        self.interval = interval
+        self.done = 0
+        self.started = time.time()
+        self.saved = None
+
+    def update(self, count=1):
+        """Adds ``count`` processed items."""
+        self.done += count
+        if self.saved is None or time.time() - self.saved >= self.interval:
+            self.flush()
+
+    def flush(self):
+        """Stores the progress right away."""
+        self.meta.update(
+            done=self.done, total=self.total, started=self.started,
+        )
+        self.saved = time.time()
+        if self.save is not None:
+            self.save()
+
+    def iterate(self, items):
+        """Yields the ``items``, counting them."""
+        for item in items:
+            yield item
+            self.update()
+        self.flush()
+
+    @classmethod
+    def for_rq_job(cls, rq_job, **kwargs):
+        """Returns a :py:class:`Progress` stored in the ``meta`` of an RQ
+        job. Only the ``meta`` is written, so the status of the job set by
+        the worker is not overwritten."""
+        from rq.job import dumps
+
+        def save():
+            rq_job.connection.hset(rq_job.key, 'meta', dumps(rq_job.meta))
+        return cls(rq_job.meta, save=save, **kwargs)
+
+
+def get_current_progress(**kwargs):
+    """Returns a :py:class:`Progress` stored in the ``meta`` of the job
+    running in the current thread of a :py:class:`LocalExecutor` or in the
+    current RQ worker, or None if there is no such job."""
+    job = getattr(_current, 'job', None)
+    if job is not None:
+        return Progress(job.meta, **kwargs)
+    try:
+        import rq
+    except ImportError:
+        return None
+    rq_job = rq.get_current_job()
+    if rq_job is not None:
+        return Progress.for_rq_job(rq_job, **kwargs)
+    return None
+
+
+def estimate(meta, now=None):
+    """
+    Returns the percent of the work done and the estimated number of
+    seconds left, based on the progress stored in ``meta`` by
+    :py:class:`Progress`. Any of them can be None if unknown.
+    """
+    done = meta.get('done')
+    total = meta.get('total')
+    if done is None or not total:
+        return None, None
+    percent = min(100 * done / total, 100)
+    if not done:
+        return percent, None
+    elapsed = (now or time.time()) - meta['started']
+    return percent, max(elapsed * (total - done) / done, 0)
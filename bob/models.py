@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from django.db import models
+
+from bob import cache  # noqa - connects the model version receivers
+
+
+class ImportCheckpoint(models.Model):
+    """The number of the last chunk committed by the CSV imports using
+    ``key``, see :py:class:`bob.csvimport.CsvImporter`."""
+
+    key = models.CharField(max_length=255, unique=True)
+    chunk = models.IntegerField()
+    updated = models.DateTimeField(auto_now=True)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Storage of generated reports.
+
+A report is written to a file as it is generated and only a short handle
+(the name of the file) is passed from the worker that generated it to the
+view downloading it, so the report is never held in memory or in the job
+queue::
+
+    >>> storage = FileReportStorage(compression='gzip')
+    >>> handle = storage.save(chunks, 'csv')
+    >>> response = storage.make_response(
+    ...     request, handle, 'text/csv', 'report.csv',
+    ... )
+
+The workers and the web servers must share the ``location`` directory.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import errno
+import gzip
+import os
+import re
+import tempfile
+import time
+import uuid
+from wsgiref.util import FileWrapper
+
+from django.conf import settings
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+
+from bob.compression import BUFFER_SIZE, accepts_gzip, iter_gzip
+
+
+handle_re = re.compile(r'^[0-9a-f]{32}\.[a-z0-9]+(\.gz)?$')
+
+
+class FileReportStorage(object):
+    """Stores the reports as files in a directory.
+
+    :param location: the directory, by default the ``BOB_REPORTS_ROOT``
+        setting or ``bob-reports`` in the temporary directory
+    :param compression: ``'gzip'`` to store the reports compressed, or None
+    :param max_age: the number of seconds after which the reports are
+        removed (when a new one is saved)
+    """
+
+    def __init__(self, location=None, compression=None, max_age=24 * 3600):
+        if compression not in ('gzip', None):
+            raise ValueError('Unknown compression {}.'.format(compression))
+        self._location = location
+        self.compression = compression
+        self.max_age = max_age
+
+    @property
+    def location(self):
+        # read lazily, so that the storage can be created at import time
+        return self._location or getattr(
+            settings, 'BOB_REPORTS_ROOT',
+            os.path.join(tempfile.gettempdir(), 'bob-reports'),
+        )
+
+    def path(self, handle):
+        """Returns the path of the file of the report, raising
+        ``Http404`` if the handle is invalid or the file is gone."""
+        if not handle_re.match(handle):
+            raise Http404('Invalid report handle.')
+        path = os.path.join(self.location, handle)
+        if not os.path.exists(path):
+            raise Http404('The report has expired.')
+        return path
+
+    def save(self, chunks, extension):
+        """Writes the byte strings from ``chunks`` to a new file. Returns
+        the handle of the report."""
+        self.clean()
+        try:
+            os.makedirs(self.location)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        handle = '{}.{}'.format(uuid.uuid4().hex, extension)
+        if self.compression == 'gzip':
+            chunks = iter_gzip(chunks)
+            handle += '.gz'
+        # write to a temporary file, so that only complete reports are seen
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', dir=self.location)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.rename(temp_path, os.path.join(self.location, handle))
+        except:
+            os.remove(temp_path)
+            raise
+        return handle
+
+    def exists(self, handle):
+        """Returns True if the report is still stored."""
+        return bool(handle_re.match(handle)) and os.path.exists(
+            os.path.join(self.location, handle),
+        )
+
+    def open(self, handle):
+        """Returns the report opened for reading, decompressed."""
+        path = self.path(handle)
+        if handle.endswith('.gz'):
+            return gzip.open(path, 'rb')
+        return open(path, 'rb')
+
+    def delete(self, handle):
+        os.remove(self.path(handle))
+
+    def clean(self):
+        """Removes the reports older than ``max_age`` seconds."""
+        try:
+            names = os.listdir(self.location)
+        except OSError:
+            return
+        limit = time.time() - self.max_age
+        for name in names:
+            if not (handle_re.match(name) or name.endswith('.tmp')):
+                continue
+            path = os.path.join(self.location, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                pass  # removed by another process
+
+    def make_response(self, request, handle, content_type, filename):
+        """Returns a response streaming the report from the disk. Compressed
+        reports are sent with the gzip ``Content-Encoding`` to the clients
+        accepting it and decompressed on the fly for the others."""
+        path = self.path(handle)
+        compressed = handle.endswith('.gz')
+        as_stored = not compressed or accepts_gzip(request)
+        f = open(path, 'rb') if as_stored else self.open(handle)
+        response = StreamingHttpResponse(
+            FileWrapper(f, BUFFER_SIZE), content_type=content_type,
+        )
+        response['Content-Disposition'] = 'attachment; filename=%s' % filename
+        if as_stored:
+            response['Content-Length'] = os.path.getsize(path)
+        if compressed:
+            if as_stored:
+                response['Content-Encoding'] = 'gzip'
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
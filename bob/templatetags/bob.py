@@ -12,7 +12,6 @@ from django import template
 from django.utils.safestring import mark_safe
 from django.utils.html import conditional_escape as esc
 from django.utils.timesince import timesince
-from bob.forms.dependency import DependencyForm
 
 
 register = template.Library()
@@ -90,6 +89,71 @@ def render_cell(column, row):
     return column.render_cell(row)
 
 
+@register.simple_tag(takes_context=True)
+def table_body(context, columns, rows):
+    """
+    Render all the rows of a table in a single pass. This is much faster than
+    calling ``render_cell`` for every cell. Under autoescape the values of
+    the column fields are escaped, the contents rendered by the columns
+    themselves are output as they are, like by ``render_cell``.
+
+    :param columns: The list of :class:`bob.data_table.DataTableColumn`
+        objects.
+    :param rows: The objects to display, e.g. the page.
+    """
+    # imported here, so that loading the tags doesn't import the data tables
+    from bob.data_table import escape_cell, render_table_body
+    escape = escape_cell if context.autoescape else None
+    return render_table_body(columns, rows, escape)
+
+
+class CacheNode(template.Node):
+    def __init__(self, nodelist, key, timeout):
+        self.nodelist = nodelist
+        self.key = key
+        self.timeout = timeout
+
+    def render(self, context):
+        # imported here, so that loading the tags doesn't import the ORM
+        from bob.cache import get_or_create
+        key = self.key.resolve(context)
+        if not key:
+            return self.nodelist.render(context)
+        kwargs = {}
+        if self.timeout is not None:
+            kwargs['timeout'] = self.timeout.resolve(context)
+        return get_or_create(
+            key, lambda: self.nodelist.render(context), **kwargs
+        )
+
+
+@register.tag
+def bob_cache(parser, token):
+    """
+    Cache the enclosed fragment of the template under the given key,
+    e.g. the ``bob_cache_key`` provided by
+    :py:class:`bob.data_table.DataTableMixin`. Concurrent requests for
+    a missing fragment wait for the first one to render it. Without a key
+    nothing is cached::
+
+        {% bob_cache bob_cache_key bob_cache_timeout %}
+            ...
+        {% endbob_cache %}
+    """
+    bits = token.split_contents()
+    if len(bits) not in (2, 3):
+        raise template.TemplateSyntaxError(
+            "'{}' tag requires a key and an optional timeout".format(bits[0])
+        )
+    nodelist = parser.parse(('endbob_cache',))
+    parser.delete_first_token()
+    return CacheNode(
+        nodelist,
+        parser.compile_filter(bits[1]),
+        parser.compile_filter(bits[2]) if len(bits) == 3 else None,
+    )
+
+
 def tab_menu(items, selected, side=None):
     """
     Show a menu in form of tabs.
@@ -142,7 +206,8 @@ def sidebar_menu_subitems(item, selected):
 @register.inclusion_tag('bob/pagination.html')
 def pagination(page, show_all=False, show_csv=False,
                fugue_icons=False, url_query=None, neighbors=1,
-               query_variable_name='page', export_variable_name='export'):
+               query_variable_name='page', export_variable_name='export',
+               cursor_variable_name='cursor'):
     """
     Display pagination for a list of items.
 
@@ -152,6 +217,8 @@ def pagination(page, show_all=False, show_csv=False,
     :param fugue_icons: Whether to use Fugue icons or Bootstrap icons.
     :param url_query: The query parameters to add to all page links.
     :param neighbors: How many neighboring pages to show in paginator.
+    :param cursor_variable_name: The query parameter carrying the cursor
+        when the page is a :py:class:`bob.data_table.KeysetPage`.
     """
 
     if not page:
@@ -162,19 +229,48 @@ def pagination(page, show_all=False, show_csv=False,
             'url_query': url_query,
             'export_variable_name': export_variable_name,
         }
+    if hasattr(page, 'next_cursor'):
+        return keyset_pagination(
+            page, show_all, show_csv, fugue_icons, url_query,
+            query_variable_name, export_variable_name, cursor_variable_name,
+        )
+    if not hasattr(page, 'paginator'):
+        # all the items are on a single page
+        return {
+            'page': page,
+            'show_all': show_all,
+            'show_csv': show_csv,
+            'fugue_icons': fugue_icons,
+            'url_query': url_query,
+            'url_pages': [],
+            'url_all': changed_url(url_query, query_variable_name, 0),
+            'export_variable_name': export_variable_name,
+        }
     paginator = page.paginator
     page_no = page.number
-    pages = paginator.page_range[
-        max(0, page_no - 1 - neighbors):
-        min(paginator.num_pages, page_no + neighbors)
-    ]
+    if getattr(paginator, 'count_kind', 'exact') == 'exact':
+        pages = paginator.page_range[
+            max(0, page_no - 1 - neighbors):
+            min(paginator.num_pages, page_no + neighbors)
+        ]
+        last_page = paginator.num_pages
+    else:
+        # the count is approximate, so the last page is unknown
+        pages = range(
+            max(1, page_no - neighbors),
+            page_no + (neighbors if page.has_next() else 0) + 1,
+        )
+        last_page = None
 
     if 1 not in pages:
         pages.insert(0, 1)
         pages.insert(1, '...')
-    if paginator.num_pages not in pages:
+    if last_page is None:
+        if page.has_next():
+            pages.append('...')
+    elif last_page not in pages:
         pages.append('...')
-        pages.append(paginator.num_pages)
+        pages.append(last_page)
     urls = []
     for item in pages:
         if item == '...':
@@ -207,9 +303,42 @@ def pagination(page, show_all=False, show_csv=False,
     }
 
 
-def changed_url(query, name, value):
-    if not query:
-        return '%s=%s' % (name, value)
+def keyset_pagination(page, show_all, show_csv, fugue_icons, url_query,
+                      query_variable_name, export_variable_name,
+                      cursor_variable_name):
+    """Context for pagination of a keyset page - only the links to the
+    previous and the next page are available."""
+    if url_query:
+        url_query = changed_query(url_query, query_variable_name, None)
+    return {
+        'page': page,
+        'show_all': show_all,
+        'show_csv': show_csv,
+        'fugue_icons': fugue_icons,
+        'url_query': url_query,
+        'url_previous_page': changed_url(
+            url_query,
+            cursor_variable_name,
+            page.previous_cursor,
+        ),
+        'url_next_page': changed_url(
+            url_query,
+            cursor_variable_name,
+            page.next_cursor,
+        ),
+        'url_pages': [],
+        'url_all': changed_url(
+            url_query and changed_query(
+                url_query, cursor_variable_name, None
+            ),
+            query_variable_name,
+            0,
+        ),
+        'export_variable_name': export_variable_name,
+    }
+
+
+def changed_query(query, name, value):
     query = query.copy()
     if value is not None and value not in ('1', 1):
         query[name] = value
@@ -218,7 +347,13 @@ def changed_url(query, name, value):
             del query[name]
         except KeyError:
             pass
-    return query.urlencode()
+    return query
+
+
+def changed_url(query, name, value):
+    if not query:
+        return '%s=%s' % (name, value)
+    return changed_query(query, name, value).urlencode()
 
 
 @register.filter
@@ -319,16 +454,8 @@ def table_header(columns=None, url_query=None, sort=None, fugue_icons=False,
     show_conditions field on column item - func and args which determines
     whether the column is to be displayed.
     """
-    new_columns = []
-    for column in columns:
-        if isinstance(column.show_conditions, tuple):
-            func, arg = column.show_conditions
-            if func(arg):
-                new_columns.append(column)
-        else:
-            new_columns.append(column)
     return {
-        'columns': new_columns,
+        'columns': [column for column in columns if column.is_shown()],
         'sort': sort,
         'url_query': url_query,
         'fugue_icons': fugue_icons,
@@ -371,7 +498,8 @@ def bob_export_url(query, value, export_variable_name='export'):
 def dependency_data(form):
     """Render the data-bob-dependencies tag if this is a DependencyForm"""
 
-    if not isinstance(form, DependencyForm):
+    # duck typing spares importing the dependency machinery with the tags
+    if not hasattr(form, 'get_dependencies_for_js'):
         return ''
     return 'data-bob-dependencies="{0}"'.format(
         esc(json.dumps(form.get_dependencies_for_js())))
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+from bob.djid import Djid
+from bob.djid.column import CountColumn
+from bob.test_djid.models import Person, Company
+
+
+class PersonsGrid(Djid):
+    """A grid displaying persons."""
+
+    class Meta:
+        djid_id = 'persons'
+        Model = Person
+        columns = [
+            'first_name',
+            'last_name',
+            'registered',
+            'score',
+            'company',
+        ]
+
+
+class CompanyGrid(Djid):
+    class Meta:
+        djid_id = 'companies'
+        Model = Company
+        columns = ['name', 'phone', 'person_count']
+
+    person_count = CountColumn(relation='person', label='Persons')
@@ -1,3 +1,6 @@
 from bob.test_djid.tests.test_class import *
 from bob.test_djid.tests.test_ajax import *
 from bob.test_djid.tests.test_column import *
+from bob.test_djid.tests.test_data_table import *
+from bob.test_djid.tests.test_csvimport import *
+from bob.test_djid.tests.test_export import *
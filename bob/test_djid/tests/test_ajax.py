@@ -1,9 +1,24 @@
 """Tests for ajax data."""
 import json
 
+import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured, SuspiciousOperation
+from django.db.models.signals import pre_init
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
 
-from bob.test_djid.models import Person
+from bob.djid import Djid
+from bob.djid.column import (
+    CharColumn,
+    CountColumn,
+    DateTimeColumn,
+    ForeignColumn,
+    NumberColumn,
+)
+from bob.test_djid.models import Company, Person
 
 
 class TestAjaxData(TestCase):
@@ -35,3 +50,321 @@ class TestAjaxData(TestCase):
             '/djid/persons/?page=2'
         ).content)
         self.assertEqual(data['rows'][0]['cell'][0][1], person21.first_name)
+
+
+class TestValuesFastPath(TestCase):
+
+    def get_grids(self):
+        class PersonsGrid(Djid):
+            class Meta:
+                Model = Person
+                columns = [
+                    'first_name', 'registered', 'score', 'company',
+                ]
+                url_fields = ['pk']
+
+            company = ForeignColumn(
+                label='Company', label_field='name', as_link=True,
+                url_fields=['pk'],
+            )
+
+        class CompanyGrid(Djid):
+            class Meta:
+                Model = Company
+                columns = ['name', 'phone', 'person_count']
+                url_fields = ['pk']
+
+            person_count = CountColumn(relation='person', label='Persons')
+
+        return PersonsGrid, CompanyGrid
+
+    def get_data(self, grid, query_string, fast):
+        grid.values_fast_path = fast
+        created = []
+
+        def count(sender, **kwargs):
+            created.append(sender)
+        pre_init.connect(count)
+        try:
+            response = grid.get_ajax_data(
+                RequestFactory().get('/?' + query_string),
+            )
+        finally:
+            pre_init.disconnect(count)
+        return json.loads(response.content), created
+
+    def test_same_data(self):
+        """The fast path returns the same data."""
+        PersonsGrid, CompanyGrid = self.get_grids()
+        for grid, query_strings in [
+            (PersonsGrid, [
+                'page=1', 'page=3&sidx=last_name+&sord=desc',
+                'page=2&sidx=score+&sord=asc', 'page=1&first_name=an',
+            ]),
+            (CompanyGrid, [
+                'page=2', 'page=1&sidx=person_count+&sord=desc',
+                'page=1&name=a&person_count=>8',
+            ]),
+        ]:
+            for query_string in query_strings:
+                data, created = self.get_data(grid, query_string, False)
+                fast_data, fast_created = self.get_data(
+                    grid, query_string, True,
+                )
+                self.assertEqual(fast_data, data)
+
+    def test_no_instances(self):
+        """Without links the fast path creates no model instances."""
+        class Grid(Djid):
+            first_name = CharColumn(label='First name')
+            registered = DateTimeColumn(label='Registered')
+            score = NumberColumn(label='Score')
+            company = ForeignColumn(label='Company', label_field='name')
+
+            class Meta:
+                Model = Person
+
+        data, created = self.get_data(Grid, 'page=2', False)
+        fast_data, fast_created = self.get_data(Grid, 'page=2', True)
+        self.assertEqual(fast_data, data)
+        self.assertEqual(len(created), 40)
+        self.assertEqual(fast_created, [])
+
+    def test_links(self):
+        """Links need url_fields."""
+        PersonsGrid, __ = self.get_grids()
+        data, __ = self.get_data(PersonsGrid, 'page=1', True)
+        person = Person.objects.all()[0]
+        self.assertEqual(data['rows'][0]['cell'][0], [
+            person.get_absolute_url(), person.first_name,
+        ])
+        self.assertEqual(data['rows'][0]['cell'][3], [
+            person.company.get_absolute_url(), person.company.name,
+        ])
+        self.assertEqual(
+            PersonsGrid.get_values_plan()[0],
+            [
+                'pk', 'first_name', 'pk', 'registered', 'score',
+                'company__name', 'company__pk',
+            ],
+        )
+        PersonsGrid._meta.column_dict['first_name'].url_fields = None
+        self.assertIsNone(PersonsGrid.get_values_plan())
+
+    def test_foreign_url_fields(self):
+        """Meta.url_fields are not used for the links to other models."""
+        class Grid(Djid):
+            class Meta:
+                Model = Person
+                columns = ['first_name', 'company']
+                url_fields = ['pk']
+
+            company = ForeignColumn(
+                label='Company', label_field='name', as_link=True,
+            )
+
+        column_dict = Grid._meta.column_dict
+        self.assertEqual(column_dict['first_name'].url_fields, ['pk'])
+        self.assertIsNone(column_dict['company'].url_fields)
+        self.assertIsNone(Grid.get_values_plan())
+
+    def test_unsupported_columns(self):
+        """Columns needing model instances disable the fast path."""
+        class Grid(Djid):
+            class Meta:
+                Model = Person
+                columns = ['first_name', 'company']
+                url_fields = ['pk']
+
+        self.assertIsNone(Grid.get_values_plan())
+        data, created = self.get_data(Grid, 'page=1', True)
+        self.assertTrue(created)
+
+    def test_overridden_label(self):
+        """Columns formatting the labels their own way disable the fast
+        path."""
+        class UpperColumn(CharColumn):
+            def format_label(self, model):
+                return super(UpperColumn, self).format_label(model).upper()
+
+        class Grid(Djid):
+            last_name = UpperColumn(label='Last name')
+
+            class Meta:
+                Model = Person
+
+        self.assertIsNone(Grid.get_values_plan())
+        data, __ = self.get_data(Grid, 'page=1', True)
+        self.assertEqual(
+            data['rows'][0]['cell'][0],
+            Person.objects.all()[0].last_name.upper(),
+        )
+
+
+@override_settings(BOB_TRACK_MODEL_VERSIONS=True)
+class TestAjaxCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+        class Grid(Djid):
+            ajax_cache = True
+            first_name = CharColumn(label='First name')
+            company = ForeignColumn(label='Company', label_field='name')
+
+            class Meta:
+                djid_id = 'cached-persons'
+                Model = Person
+        self.Grid = Grid
+
+    def get(self, query_string):
+        return json.loads(self.Grid.get_ajax_data(
+            RequestFactory().get('/?' + query_string),
+        ).content)
+
+    def test_cached(self):
+        """Identical requests don't query the database."""
+        data = self.get('page=2&first_name=a&nd=1')
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                self.get('first_name=a&page=2&nd=2'), data,
+            )
+        with self.assertNumQueries(2):
+            self.get('page=2&first_name=b')
+
+    def test_count_shared(self):
+        """The count is shared by the pages and sort orders."""
+        self.get('page=1&first_name=a')
+        with self.assertNumQueries(1):
+            data = self.get('page=3&first_name=a&sidx=last_name+&sord=desc')
+        self.assertEqual(
+            data['records'],
+            Person.objects.filter(first_name__icontains='a').count(),
+        )
+
+    def test_invalidated(self):
+        """Changes of the displayed models invalidate the cache."""
+        self.assertEqual(
+            self.Grid.get_cache_models(), [Person, Company],
+        )
+        person = Person.objects.get(pk=1)
+        self.get('page=1')
+        company = person.company
+        company.name = 'Renamed'
+        company.save()
+        with self.assertNumQueries(2):
+            data = self.get('page=1')
+        self.assertEqual(data['rows'][0]['cell'][1], 'Renamed')
+        with self.assertNumQueries(0):
+            self.get('page=1')
+
+    def test_untracked(self):
+        with override_settings(BOB_TRACK_MODEL_VERSIONS=False):
+            self.assertRaises(ImproperlyConfigured, self.get, 'page=1')
+
+    def test_declared_models(self):
+        self.Grid._meta.cache_models = [Person]
+        self.assertEqual(self.Grid.get_cache_models(), [Person])
+
+
+class TestCursorPagination(TestCase):
+
+    def setUp(self):
+        class Grid(Djid):
+            cursor_pagination = True
+            page_size = 50
+            first_name = CharColumn(label='First name')
+            registered = DateTimeColumn(label='Registered')
+            score = NumberColumn(label='Score')
+            company = ForeignColumn(label='Company', label_field='name')
+
+            class Meta:
+                Model = Person
+        self.Grid = Grid
+
+    def get(self, query_string):
+        return json.loads(self.Grid.get_ajax_data(
+            RequestFactory().get('/?' + query_string),
+        ).content)
+
+    def scroll(self, query_string):
+        """Returns the rows of all the pages loaded one after another."""
+        rows = []
+        page = 1
+        cursor = ''
+        while True:
+            data = self.get('{}&page={}&cursor={}'.format(
+                query_string, page, cursor,
+            ))
+            self.assertEqual(data['page'], page)
+            rows.extend(data['rows'])
+            if not data['has_more']:
+                self.assertEqual(data['total'], page)
+                self.assertIsNone(data['cursor'])
+                return rows
+            self.assertEqual(data['total'], page + 1)
+            page += 1
+            cursor = data['cursor']
+
+    def test_same_rows(self):
+        """Scrolling returns the same rows as the offset pagination."""
+        for fast in (True, False):
+            self.Grid.values_fast_path = fast
+            for query_string, ordering in [
+                ('sidx=first_name+&sord=desc', ['-first_name', 'pk']),
+                ('sidx=registered+&sord=asc', ['registered', 'pk']),
+                ('sidx=company__name+&sord=asc', ['company__name', 'pk']),
+                ('sidx=score+&sord=asc', ['score', 'pk']),
+                ('first_name=an', ['pk']),
+            ]:
+                query_set = self.Grid.get_filtered_query_set(
+                    RequestFactory().get('/?' + query_string),
+                ).order_by(*ordering)
+                rows = self.scroll(query_string)
+                self.assertEqual(
+                    [row['id'] for row in rows],
+                    list(query_set.values_list('pk', flat=True)),
+                )
+                self.assertEqual(
+                    rows, [self.Grid.format_ajax_row(p) for p in query_set],
+                )
+
+    def test_model_ordering(self):
+        """Without a sort the rows follow the ordering of the model."""
+        for ordering in (['-last_name'], ['-pk'], ['last_name', 'pk']):
+            with mock.patch.object(Person._meta, 'ordering', ordering):
+                self.assertEqual(
+                    [row['id'] for row in self.scroll('')],
+                    list(Person.objects.values_list('pk', flat=True)),
+                )
+
+    def test_keyset(self):
+        """Deep pages seek by the sort values instead of an offset."""
+        data = self.get('page=1&sidx=first_name+&sord=asc')
+        with self.assertNumQueries(1) as context:
+            self.get('page=2&sidx=first_name+&sord=asc&cursor={}'.format(
+                data['cursor'],
+            ))
+        self.assertNotIn('OFFSET', context.captured_queries[0]['sql'])
+        self.assertTrue(self.Grid.can_seek(['-first_name', 'company__name']))
+        self.assertFalse(self.Grid.can_seek(['score']))
+        self.assertFalse(self.Grid.can_seek(['company']))
+        self.assertFalse(self.Grid.can_seek(['person_count']))
+
+    def test_invalid_cursor(self):
+        data = self.get('page=1&sidx=first_name+&sord=asc')
+        for query_string in [
+            'page=2&cursor=garbage',
+            'page=2&sidx=last_name+&sord=asc&cursor=' + data['cursor'],
+        ]:
+            with self.assertRaises(SuspiciousOperation):
+                self.get(query_string)
+
+    def test_invalid_page(self):
+        with self.assertRaises(SuspiciousOperation):
+            self.get('page=first')
+
+    def test_params(self):
+        self.assertTrue(json.loads(self.Grid.get_params())['djidCursor'])
+        self.Grid.cursor_pagination = False
+        self.assertNotIn('djidCursor', json.loads(self.Grid.get_params()))
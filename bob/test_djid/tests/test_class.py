@@ -2,6 +2,7 @@
 """Tests for Djid class."""
 
 import json
+import sys
 import unittest
 
 from bob.djid import Djid
@@ -77,3 +78,26 @@ class TestReflectedClass(unittest.TestCase):
             self.PersonsGrid.col_names(),
             ['First name', 'Last name', 'Registered Date'],
         )
+
+
+class TestDiscovery(unittest.TestCase):
+    """Grids are imported when they are first requested."""
+
+    def setUp(self):
+        import bob.test_djid.djids  # noqa
+        self.registered = Djid.__registry__.pop('persons')
+        self.module = sys.modules.pop('bob.test_djid.djids')
+
+    def tearDown(self):
+        Djid.__registry__['persons'] = self.registered
+        sys.modules['bob.test_djid.djids'] = self.module
+
+    def test_autodiscover(self):
+        """The djids module of the app is imported."""
+        grid = Djid.get_by_id('persons')
+        self.assertEqual(grid._meta.djid_id, 'persons')
+        self.assertIn('bob.test_djid.djids', sys.modules)
+
+    def test_unknown(self):
+        self.assertRaises(KeyError, Djid.get_by_id, 'unknown')
+
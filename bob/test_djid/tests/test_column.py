@@ -1,8 +1,11 @@
 """Tests for column objects."""
 import unittest
 
+import mock
+from django.test import TestCase
+
 from bob.djid import Djid
-from bob.djid.column import DateTimeColumn
+from bob.djid.column import CharColumn, DateTimeColumn
 from bob.test_djid.models import Person
 
 
@@ -30,3 +33,61 @@ class TestCharColumn(unittest.TestCase):
             self.PersonsGrid._meta.column_dict['first_name'].
             get_model()['search']
         )
+
+
+class TestCharColumnLookups(TestCase):
+    """The filter lookups of CharColumn."""
+
+    def filter(self, value, **kwargs):
+        column = CharColumn(label='Last name', **kwargs)
+        column.name = 'last_name'
+        return column.handle_filters(
+            Person.objects.all(), {'last_name': value},
+        )
+
+    def test_contains(self):
+        """By default the values containing the filter are found."""
+        self.assertEqual(
+            set(self.filter('omkiew')),
+            set(Person.objects.filter(last_name__icontains='omkiew')),
+        )
+        self.assertTrue(self.filter('omkiew').exists())
+
+    def test_exact(self):
+        self.assertEqual(
+            list(self.filter('Tomkiewicz', lookup='exact')),
+            list(Person.objects.filter(last_name='Tomkiewicz')),
+        )
+        self.assertFalse(self.filter('Tomkiew', lookup='exact').exists())
+
+    def test_prefix(self):
+        self.assertTrue(self.filter('tomkiew', lookup='prefix').exists())
+        self.assertFalse(self.filter('omkiew', lookup='prefix').exists())
+
+    def test_trigram(self):
+        """Trigrams are used where the database supports them, prefixes
+        elsewhere."""
+        column = CharColumn(label='Last name', lookup='trigram')
+        query_set = Person.objects.all()
+        self.assertEqual(column.get_lookup(query_set), '__istartswith')
+        with mock.patch.object(
+            CharColumn, 'trigram_vendors', ('sqlite',),
+        ):
+            self.assertEqual(column.get_lookup(query_set), '__icontains')
+
+    def test_min_length(self):
+        """The filters that are too short are ignored."""
+        self.assertEqual(
+            self.filter('to', lookup='prefix', min_length=3).count(),
+            Person.objects.count(),
+        )
+        self.assertTrue(
+            self.filter('tom', lookup='prefix', min_length=3).count() <
+            Person.objects.count(),
+        )
+
+    def test_unknown(self):
+        self.assertRaises(
+            ValueError, CharColumn, label='Last name', lookup='regex',
+        )
+
@@ -0,0 +1,191 @@
+"""Tests for the bulk CSV import."""
+import io
+
+import mock
+
+from django.db import transaction
+from django.test import TestCase
+
+from bob.csvimport import CsvImporter
+from bob.models import ImportCheckpoint
+from bob.test_djid.models import Person
+
+
+FIELDS = [
+    'first_name', 'last_name', 'address', 'city', 'county', 'postal',
+    'phone', 'email', 'web', 'registered', 'company', 'score',
+]
+
+
+def make_row(i, **kwargs):
+    row = dict(
+        first_name='Imported', last_name='Person {:04}'.format(i),
+        address='Street', city='City', county='County', postal='00-000',
+        phone='123', email='p@example.com', web='http://example.com',
+        registered='2014-01-01T12:00:00Z', company='1', score=str(i),
+    )
+    row.update(kwargs)
+    return [row[name] for name in FIELDS]
+
+
+def make_file(rows, header=FIELDS):
+    header = header and list(header)
+    lines = [header] + rows if header else rows
+    return io.BytesIO('\n'.join(
+        ';'.join(cell for cell in line) for line in lines
+    ).encode('utf-8'))
+
+
+class FailingImporter(CsvImporter):
+    """Fails after saving ``fail_after`` chunks."""
+
+    fail_after = None
+
+    def save_chunk(self, cleaned):
+        if self.fail_after == 0:
+            raise RuntimeError('interrupted')
+        if self.fail_after:
+            self.fail_after -= 1
+        return super(FailingImporter, self).save_chunk(cleaned)
+
+
+class TestCsvImport(TestCase):
+
+    def setUp(self):
+        self.before = Person.objects.count()
+
+    def imported(self):
+        return list(Person.objects.filter(
+            first_name='Imported',
+        ).order_by('id').values_list('last_name', 'score', 'company_id'))
+
+    def test_import(self):
+        rows = [make_row(i) for i in range(25)]
+        for workers in (0, 2):
+            Person.objects.filter(first_name='Imported').update(
+                first_name='Imported before',
+            )
+            result = CsvImporter(
+                Person, chunk_size=10, workers=workers,
+            ).run(make_file(rows))
+            self.assertEqual(result.rows, 25)
+            self.assertEqual(result.created, 25)
+            self.assertEqual(result.errors, [])
+            self.assertEqual(result.last_chunk, 2)
+            self.assertEqual(
+                self.imported(),
+                [('Person {:04}'.format(i), i, 1) for i in range(25)],
+            )
+
+    def test_fields_without_header(self):
+        importer = CsvImporter(
+            Person, fields=FIELDS, has_header=False, workers=0,
+        )
+        result = importer.run(make_file([make_row(1)], header=None))
+        self.assertEqual(result.created, 1)
+
+    def test_errors(self):
+        rows = [make_row(i) for i in range(10)]
+        rows[2] = make_row(2, score='many')
+        rows[5] = make_row(5, registered='yesterday', last_name='')
+        rows[7] = rows[7][:3]
+        result = CsvImporter(
+            Person, chunk_size=4, workers=2,
+        ).run(make_file(rows))
+        self.assertEqual(result.rows, 10)
+        self.assertEqual(result.created, 7)
+        errors = dict((error.line, error.messages) for error in result.errors)
+        self.assertEqual(sorted(errors), [4, 7, 9])
+        self.assertTrue(errors[4][0].startswith('score:'))
+        self.assertEqual(
+            [message.split(':')[0] for message in errors[7]],
+            ['last_name', 'registered'],
+        )
+        self.assertEqual(errors[9], ['Expected 12 columns, got 3.'])
+        self.assertEqual(
+            [name for name, score, company in self.imported()],
+            ['Person {:04}'.format(i) for i in (0, 1, 3, 4, 6, 8, 9)],
+        )
+
+    def test_database_errors(self):
+        """The rows rejected by the database don't stop the chunk."""
+        rows = [
+            [pk] + make_row(i)
+            for i, pk in enumerate(['1000', '1001', '1', '1002'])
+        ]
+        result = CsvImporter(Person, workers=0).run(
+            make_file(rows, header=['id'] + FIELDS),
+        )
+        self.assertEqual(result.created, 3)
+        self.assertEqual([error.line for error in result.errors], [4])
+        self.assertEqual(
+            [name for name, score, company in self.imported()],
+            ['Person {:04}'.format(i) for i in (0, 1, 3)],
+        )
+        self.assertNotEqual(Person.objects.get(pk=1).first_name, 'Imported')
+
+    def test_resume(self):
+        rows = [make_row(i) for i in range(25)]
+        importer = FailingImporter(
+            Person, chunk_size=10, workers=0, checkpoint_key='import',
+            fail_after=2,
+        )
+        with self.assertRaises(RuntimeError):
+            importer.run(make_file(rows))
+        self.assertEqual(len(self.imported()), 20)
+        importer = CsvImporter(
+            Person, chunk_size=10, workers=0, checkpoint_key='import',
+        )
+        result = importer.run(make_file(rows))
+        self.assertEqual(result.first_chunk, 2)
+        self.assertEqual(result.created, 5)
+        self.assertEqual(
+            [name for name, score, company in self.imported()],
+            ['Person {:04}'.format(i) for i in range(25)],
+        )
+        self.assertEqual(Person.objects.count(), self.before + 25)
+
+    def test_checkpoint_in_transaction(self):
+        """A chunk is not committed without its checkpoint."""
+        class CheckpointFailingImporter(CsvImporter):
+            def set_checkpoint(self, chunk_number):
+                if chunk_number == 1:
+                    raise RuntimeError('interrupted')
+                super(CheckpointFailingImporter, self).set_checkpoint(
+                    chunk_number,
+                )
+
+        rows = [make_row(i) for i in range(25)]
+        importer = CheckpointFailingImporter(
+            Person, chunk_size=10, workers=0, checkpoint_key='import',
+        )
+        with self.assertRaises(RuntimeError):
+            importer.run(make_file(rows))
+        self.assertEqual(len(self.imported()), 10)
+        self.assertEqual(ImportCheckpoint.objects.get(key='import').chunk, 0)
+        result = CsvImporter(
+            Person, chunk_size=10, workers=0, checkpoint_key='import',
+        ).run(make_file(rows))
+        self.assertEqual(result.first_chunk, 1)
+        self.assertEqual(Person.objects.count(), self.before + 25)
+
+    def test_database_routing(self):
+        """All the transactions use the database the model is written to."""
+        rows = [
+            [pk] + make_row(i)
+            for i, pk in enumerate(['1000', '1', '1001'])
+        ]
+        with mock.patch(
+            'bob.csvimport.router.db_for_write', return_value='default',
+        ) as db_for_write, mock.patch(
+            'bob.csvimport.transaction.atomic', wraps=transaction.atomic,
+        ) as atomic:
+            result = CsvImporter(
+                Person, workers=0, checkpoint_key='import',
+            ).run(make_file(rows, header=['id'] + FIELDS))
+        self.assertEqual(result.created, 2)
+        db_for_write.assert_called_with(Person)
+        self.assertTrue(atomic.call_count > 3)
+        for args, kwargs in atomic.call_args_list:
+            # django's own calls pass the database positionally
+            self.assertEqual(kwargs.get('using', args and args[0]), 'default')
@@ -0,0 +1,984 @@
+"""Tests for the DataTableMixin."""
+import gzip
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import warnings
+import zipfile
+
+import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, models, transaction
+from django.db.models.query import QuerySet
+from django.http import Http404, HttpResponse, QueryDict
+from django.template import Context, Template
+from django.template.loader import render_to_string
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.test.client import RequestFactory
+from django.utils.html import escape
+from django.views.generic import TemplateView
+
+from bob.cache import get_or_create
+from bob.csvutil import UnicodeReader
+from bob.data_table import (
+    CappedCount,
+    DataTableColumn,
+    DataTableMixin,
+    EstimatedCount,
+    _count_in_thread,
+    get_count_pool,
+)
+from bob.export import registry
+from bob.jobs import LocalExecutor
+from bob.reports import FileReportStorage
+from bob.templatetags.bob import pagination
+from bob.test_djid.models import Person
+
+
+LATENCY = 0.2
+
+
+class PersonTable(DataTableMixin):
+    sort_variable_name = 'sort'
+    columns = [
+        DataTableColumn('First name', field='first_name', export=True),
+        DataTableColumn(
+            'Last name', field='last_name', sort_expression='last_name',
+            export=True,
+        ),
+        DataTableColumn(
+            'Score', field='score', sort_expression='score', export=True,
+        ),
+        DataTableColumn(
+            'Company', field='company__name',
+            sort_expression='company__name', export=True,
+        ),
+    ]
+
+    def __init__(self, query_string='', **kwargs):
+        self.request = RequestFactory().get('/?' + query_string)
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+
+class PersonTableView(DataTableMixin, TemplateView):
+    template_name = 'person_table.html'
+    sort_variable_name = 'sort'
+    columns = PersonTable.columns
+
+    def get(self, *args, **kwargs):
+        self.data_table_query(Person.objects.all())
+        if self.export_requested():
+            return self.response
+        return super(PersonTableView, self).get(*args, **kwargs)
+
+    def get_context_data(self, **kwargs):
+        context = super(PersonTableView, self).get_context_data(**kwargs)
+        context.update(self.get_context_data_paginator())
+        context.update({
+            'columns': self.columns,
+            'sort': self.sort,
+            'url_query': self.request.GET,
+        })
+        return context
+
+
+def get_page(query_string='', **kwargs):
+    table = PersonTable(query_string, **kwargs)
+    table.data_table_query(Person.objects.all())
+    return table.page_contents
+
+
+class TestKeysetPagination(TestCase):
+
+    def walk(self, sort, queryset=None):
+        """Follows the next page links and returns all visited rows."""
+        query = QueryDict('sort={}'.format(sort)).copy()
+        rows = []
+        while True:
+            table = PersonTable(query.urlencode(), keyset_pagination=True)
+            table.data_table_query(
+                Person.objects.all() if queryset is None else queryset
+            )
+            page = table.page_contents
+            rows.extend(page.object_list)
+            if not page.has_next():
+                return rows
+            query['cursor'] = page.next_cursor
+
+    def test_same_rows_as_offset_pagination(self):
+        """Keyset pages contain the same rows as the offset pages."""
+        sorts = ['', 'last_name', '-last_name', 'company__name', '-score']
+        for sort in sorts:
+            table = PersonTable('sort=' + sort)
+            queryset = table.sort_queryset(Person.objects.all())
+            tiebreaker = '-pk' if sort.startswith('-') else 'pk'
+            expected = list(
+                queryset.order_by(table.sort or 'pk', tiebreaker)
+            )
+            self.assertEqual(self.walk(sort), expected)
+
+    def test_multi_field_ordering(self):
+        """All the fields of the queryset ordering are used."""
+        queryset = Person.objects.order_by('company__name', '-first_name')
+        self.assertEqual(
+            self.walk('', queryset),
+            list(queryset.order_by('company__name', '-first_name', 'pk')),
+        )
+        table = PersonTable(keyset_pagination=True)
+        self.assertEqual(
+            table.get_keyset_ordering(queryset.order_by('-score', 'id', 'x')),
+            ['-score', 'pk'],
+        )
+
+    def test_random_ordering(self):
+        """A random ordering is paginated with offsets."""
+        table = PersonTable('page=2', keyset_pagination=True)
+        table.data_table_query(Person.objects.order_by('?'))
+        page = table.page_contents
+        self.assertEqual(page.number, 2)
+        self.assertEqual(len(page), table.rows_per_page)
+
+    def test_previous_page(self):
+        """The previous cursor points to the preceding rows."""
+        first = get_page('sort=last_name', keyset_pagination=True)
+        second = get_page(
+            'sort=last_name&cursor=' + first.next_cursor,
+            keyset_pagination=True,
+        )
+        self.assertFalse(first.has_previous())
+        self.assertTrue(second.has_previous())
+        back = get_page(
+            'sort=last_name&cursor=' + second.previous_cursor,
+            keyset_pagination=True,
+        )
+        self.assertEqual(back.object_list, first.object_list)
+        self.assertFalse(back.has_previous())
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+    def test_cursor_for_other_sort_ignored(self):
+        """Changing the sort order starts from the first page."""
+        first = get_page('sort=last_name', keyset_pagination=True)
+        page = get_page(
+            'sort=-score&cursor=' + first.next_cursor,
+            keyset_pagination=True,
+        )
+        self.assertEqual(
+            page.object_list, get_page(
+                'sort=-score', keyset_pagination=True,
+            ).object_list,
+        )
+        self.assertFalse(page.has_previous())
+
+    def test_pagination_tag(self):
+        """The pagination tag links to cursors instead of page numbers."""
+        page = get_page('sort=last_name', keyset_pagination=True)
+        context = pagination(
+            page, url_query=QueryDict('sort=last_name&page=3'),
+        )
+        self.assertEqual(context['url_pages'], [])
+        next_query = QueryDict(context['url_next_page'])
+        self.assertEqual(next_query['cursor'], page.next_cursor)
+        self.assertNotIn('page', next_query)
+
+
+class TestCountStrategies(TestCase):
+
+    def test_capped(self):
+        """The capped count stops at the limit."""
+        queryset = Person.objects.all()
+        self.assertEqual(CappedCount(100)(queryset), (100, 'capped'))
+        self.assertEqual(CappedCount(1000)(queryset), (500, 'exact'))
+
+    def test_capped_sql(self):
+        """The database stops counting at the limit."""
+        with CaptureQueriesContext(connection) as queries:
+            CappedCount(5)(Person.objects.filter(score__gt=10))
+        self.assertEqual(len(queries), 1)
+        self.assertRegexpMatches(
+            queries[0]['sql'],
+            r'SELECT COUNT\(\*\) FROM \(SELECT .* LIMIT 6\)',
+        )
+        self.assertEqual(
+            CappedCount(5)(Person.objects.filter(pk__in=[])), (0, 'exact'),
+        )
+
+    def test_estimated_fallback(self):
+        """Sqlite has no planner statistics, so the fallback is used."""
+        count = EstimatedCount(threshold=100)
+        self.assertEqual(count(Person.objects.all()), (100, 'capped'))
+
+    def test_pages_beyond_capped_count(self):
+        """Pages beyond the capped count are still available."""
+        page = get_page('page=20', count_strategy=CappedCount(100))
+        self.assertEqual(page.number, 20)
+        self.assertEqual(
+            list(page.object_list), list(Person.objects.all()[285:300]),
+        )
+        self.assertTrue(page.has_next())
+        last = get_page('page=34', count_strategy=CappedCount(100))
+        self.assertEqual(len(last), 5)
+        self.assertFalse(last.has_next())
+        self.assertEqual(
+            get_page('page=40', count_strategy=CappedCount(100)).number, 1,
+        )
+
+    def test_pagination_open_ended(self):
+        """The last page is not rendered when the count is not exact."""
+        page = get_page('page=3', count_strategy=CappedCount(100))
+        context = pagination(page, url_query=QueryDict(''))
+        self.assertEqual(context['pages'], [1, '...', 2, 3, 4, '...'])
+        html = render_to_string('bob/pagination.html', {
+            'page': page, 'show_all': True,
+        })
+        self.assertIn('100+ items', html)
+
+    def test_pagination_exact(self):
+        """The exact count behaves like the django paginator."""
+        page = get_page('page=3')
+        context = pagination(page, url_query=QueryDict(''))
+        self.assertEqual(context['pages'], [1, '...', 2, 3, 4, '...', 34])
+
+
+class TestShowAll(TestCase):
+
+    def get(self, query_string='page=0', **kwargs):
+        view = PersonTableView.as_view(**kwargs)
+        return view(RequestFactory().get('/?' + query_string))
+
+    def test_limit(self):
+        """At most show_all_limit rows are shown."""
+        page = get_page('page=0', show_all_limit=42)
+        self.assertEqual(len(page), 42)
+        self.assertFalse(page.has_other_pages())
+        self.assertTrue(page.truncated)
+        self.assertFalse(get_page('page=0', show_all_limit=500).truncated)
+
+    def test_pagination(self):
+        """The pagination tells when not all the items are shown."""
+        for kwargs in ({}, {'stream_show_all': True}):
+            page = get_page('page=0', show_all_limit=42, **kwargs)
+            self.assertTrue(page)
+            context = pagination(page, show_all=True, url_query=QueryDict(''))
+            self.assertEqual(context['page'], page)
+            html = render_to_string('bob/pagination.html', context)
+            self.assertIn('First 42 items', html)
+        page = get_page('page=0', stream_show_all=True)
+        self.assertFalse(page.truncated)
+        html = render_to_string('bob/pagination.html', pagination(
+            page, show_all=True, url_query=QueryDict(''),
+        ))
+        self.assertIn('All items', html)
+
+    def test_stream(self):
+        """The streamed body contains the same rows as the rendered one."""
+        response = self.get(stream_show_all=True, show_all_chunk_size=7)
+        self.assertTrue(response.streaming)
+        chunks = list(response.streaming_content)
+        self.assertTrue(len(chunks) > 50)
+        rendered = self.get()
+        rendered.render()
+        streamed_rows = re.findall(b'<tr><td>.*?</tr>', b''.join(chunks))
+        self.assertEqual(len(streamed_rows), 500)
+        self.assertEqual(
+            streamed_rows, re.findall(b'<tr><td>.*?</tr>', rendered.content),
+        )
+
+    def test_stream_only_show_all(self):
+        """Paginated pages are not streamed."""
+        response = self.get('page=2', stream_show_all=True)
+        self.assertFalse(response.streaming)
+
+
+class UrlColumn(DataTableColumn):
+
+    def render_cell_content(self, resource):
+        return resource.get_absolute_url()
+
+
+class TestCsvExport(TestCase):
+
+    def export(self, query_string='', queryset=None, **kwargs):
+        table = PersonTable('export=csv&' + query_string, **kwargs)
+        table.data_table_query(
+            Person.objects.all() if queryset is None else queryset
+        )
+        self.assertTrue(table.response.streaming)
+        content = b''.join(table.response.streaming_content)
+        return list(UnicodeReader(
+            io.BytesIO(content), encoding='cp1250',
+        ))
+
+    def expected(self, queryset):
+        return [['First name', 'Last name', 'Score', 'Company']] + [
+            [
+                person.first_name, person.last_name,
+                '' if person.score is None else unicode(person.score),
+                person.company.name,
+            ] for person in queryset
+        ]
+
+    def test_columns_exported(self):
+        """The columns marked for export are exported in the sort order."""
+        Person.objects.filter(pk__in=[3, 7]).update(score=None)
+        for sort, ordering in [
+            ('', ['pk']),
+            ('last_name', ['last_name', 'pk']),
+            ('-company__name', ['-company__name', '-pk']),
+        ]:
+            self.assertEqual(
+                self.export('sort=' + sort, export_chunk_size=7),
+                self.expected(Person.objects.order_by(*ordering)),
+            )
+
+    def test_multi_field_ordering(self):
+        """The chunks follow all the fields of the queryset ordering."""
+        queryset = Person.objects.order_by('company__name', '-first_name')
+        expected = self.expected(
+            queryset.order_by('company__name', '-first_name', 'pk'),
+        )
+        self.assertEqual(
+            self.export(queryset=queryset, export_chunk_size=7), expected,
+        )
+        # the rendered columns need the model instances
+        rows = self.export(
+            queryset=queryset, export_chunk_size=7,
+            columns=PersonTable.columns + [UrlColumn('Url', export=True)],
+        )
+        self.assertEqual([row[:-1] for row in rows], expected)
+
+    def test_random_ordering(self):
+        """A random ordering exports all the rows."""
+        rows = self.export(
+            queryset=Person.objects.order_by('?'), export_chunk_size=7,
+        )
+        self.assertEqual(
+            sorted(rows[1:]), sorted(self.expected(Person.objects.all())[1:]),
+        )
+
+    def test_nullable_sort(self):
+        """Sorting by a nullable column exports all the rows."""
+        Person.objects.filter(pk__in=[3, 7]).update(score=None)
+        rows = self.export('sort=score', export_chunk_size=7)
+        self.assertEqual(len(rows), 501)
+        self.assertEqual(
+            rows, self.expected(Person.objects.order_by('score')),
+        )
+
+    def test_rendered_columns(self):
+        """Columns without a concrete field are rendered per object."""
+        columns = [
+            DataTableColumn('Last name', field='last_name', export=True),
+            UrlColumn('Url', export=True),
+            DataTableColumn('Score', field='score'),
+        ]
+        rows = self.export(columns=columns, export_chunk_size=50)
+        self.assertEqual(rows[0], ['Last name', 'Url'])
+        self.assertEqual(rows[1:], [
+            [person.last_name, person.get_absolute_url()]
+            for person in Person.objects.order_by('pk')
+        ])
+
+    def test_rendered_columns_null(self):
+        """NULLs are exported the same way with the rendered columns."""
+        Person.objects.filter(pk__in=[3, 7]).update(score=None)
+        columns = PersonTable.columns + [UrlColumn('Url', export=True)]
+        rows = self.export(columns=columns, export_chunk_size=50)
+        self.assertEqual(
+            [row[:-1] for row in rows],
+            self.expected(Person.objects.order_by('pk')),
+        )
+
+    def test_make_csv_response_overridden(self):
+        """The deprecated make_csv_response hook is still used."""
+        class OldTable(PersonTable):
+            def make_csv_response(self, data):
+                return HttpResponse('old', content_type='text/csv')
+
+        table = OldTable('export=csv')
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            table.data_table_query(Person.objects.all())
+        self.assertEqual(table.response.content, b'old')
+        self.assertEqual(caught[0].category, DeprecationWarning)
+
+    def test_other_formats(self):
+        """The formats listed in export_formats can be requested."""
+        table = PersonTable(
+            'export=jsonl&sort=last_name', export_formats=('csv', 'jsonl'),
+        )
+        table.data_table_query(Person.objects.all())
+        self.assertEqual(
+            table.response['Content-Disposition'],
+            'attachment; filename=file.jsonl',
+        )
+        rows = [
+            [unicode(value) for value in json.loads(line)] for line in
+            b''.join(table.response.streaming_content).splitlines()
+        ]
+        self.assertEqual(rows, self.export('sort=last_name'))
+        table = PersonTable('export=jsonl')
+        self.assertFalse(table.export_requested())
+
+    def test_compressed(self):
+        """The export is compressed when requested."""
+        expected = self.export('sort=last_name')
+        for export, filename, decompress in [
+            ('csv.gz', 'file.csv.gz', lambda data: gzip.GzipFile(
+                fileobj=io.BytesIO(data),
+            ).read()),
+            ('csv.zip', 'file.zip', lambda data: zipfile.ZipFile(
+                io.BytesIO(data),
+            ).read('file.csv')),
+        ]:
+            table = PersonTable('export={}&sort=last_name'.format(export))
+            table.data_table_query(Person.objects.all())
+            self.assertEqual(
+                table.response['Content-Disposition'],
+                'attachment; filename=' + filename,
+            )
+            data = decompress(b''.join(table.response.streaming_content))
+            self.assertEqual(
+                list(UnicodeReader(io.BytesIO(data), encoding='cp1250')),
+                expected,
+            )
+
+    def test_content_encoding(self):
+        """With gzip_exports the browsers accepting gzip get it."""
+        for gzip_exports, accept, encoding in [
+            (True, 'gzip, deflate', 'gzip'),
+            (True, 'deflate', None),
+            (False, 'gzip, deflate', None),
+        ]:
+            table = PersonTable('export=csv', gzip_exports=gzip_exports)
+            table.request.META['HTTP_ACCEPT_ENCODING'] = accept
+            table.data_table_query(Person.objects.all())
+            self.assertEqual(
+                table.response.get('Content-Encoding'), encoding,
+            )
+
+
+class TestQueryPlan(TestCase):
+
+    def render(self, query_string='', **kwargs):
+        view = PersonTableView.as_view(**kwargs)
+        response = view(RequestFactory().get('/?' + query_string))
+        return response.render().content
+
+    def test_query_plan(self):
+        """The related objects and the displayed fields are planned."""
+        related, only = PersonTable().get_query_plan(Person)
+        self.assertEqual(related, ['company'])
+        self.assertEqual(
+            only, ['company', 'company__name', 'first_name', 'last_name',
+                   'score'],
+        )
+
+    def test_unknown_field(self):
+        """Columns without a concrete field disable only()."""
+        columns = PersonTable.columns + [UrlColumn('Url')]
+        related, only = PersonTable(columns=columns).get_query_plan(Person)
+        self.assertEqual(related, ['company'])
+        self.assertIsNone(only)
+
+    def test_number_of_queries(self):
+        """The related columns don't cause a query per row."""
+        with self.assertNumQueries(2):
+            content = self.render('page=3', only_column_fields=True)
+        self.assertEqual(content.count(b'<tr><td>'), 15)
+        with self.assertNumQueries(17):
+            self.render('page=3', select_related_columns=False)
+
+    def test_only_without_select_related(self):
+        """The foreign keys are loaded lazily without select_related."""
+        with self.assertNumQueries(17):
+            content = self.render(
+                'page=3', select_related_columns=False,
+                only_column_fields=True,
+            )
+        self.assertIn(
+            b'<td>{}</td>'.format(
+                escape(Person.objects.all()[30].company.name)
+            ),
+            content,
+        )
+
+
+class Ticket(models.Model):
+    STATUS_CHOICES = (
+        (1, 'Open'),
+        ('Closed', ((2, 'Fixed'), (3, 'Rejected'))),
+    )
+    status = models.IntegerField(choices=STATUS_CHOICES)
+    person = models.ForeignKey(Person, null=True)
+
+    class Meta:
+        app_label = 'test_djid'
+        managed = False
+
+
+class TestCellAccessors(TestCase):
+
+    def test_choices(self):
+        """Fields with choices display their labels."""
+        table = PersonTable()
+        for status, label in [(1, 'Open'), (3, 'Rejected'), (7, 7)]:
+            ticket = Ticket(status=status)
+            self.assertEqual(table.get_cell(ticket, 'status', Ticket), label)
+            self.assertEqual(ticket.get_status_display(), label)
+
+    def test_nested(self):
+        """Related fields are followed, missing ones are empty."""
+        table = PersonTable()
+        person = Person.objects.get(pk=1)
+        ticket = Ticket(status=1, person=person)
+        self.assertEqual(
+            table.get_cell(ticket, 'person__company__name', Ticket),
+            person.company.name,
+        )
+        self.assertEqual(table.get_cell(ticket, 'person__missing', Ticket), '')
+        self.assertIsNone(table.get_cell(Ticket(status=1), 'person', Ticket))
+        self.assertEqual(
+            table.get_cell(Ticket(status=1), 'person__company', Ticket), '',
+        )
+        self.assertEqual(table.get_cell(None, 'status', Ticket), '')
+
+    def test_render_cell_content(self):
+        """Columns follow their field path."""
+        person = Person.objects.get(pk=1)
+        column = DataTableColumn('Company', field='company__name')
+        self.assertEqual(
+            column.render_cell_content(person), person.company.name,
+        )
+        column = DataTableColumn('Missing', field='company__missing')
+        self.assertEqual(column.render_cell_content(person), '')
+
+
+class HtmlColumn(DataTableColumn):
+
+    def render_cell(self, resource):
+        return '<td class="html">{}</td>'.format(resource.first_name)
+
+
+class UpperColumn(DataTableColumn):
+
+    def render_cells_content(self, resources):
+        return [resource.last_name.upper() for resource in resources]
+
+
+class TestTableBody(TestCase):
+
+    def render(self, template, **context):
+        return Template('{% load bob %}' + template).render(Context(context))
+
+    def test_same_as_render_cell(self):
+        """Without escaping the table body is the same as the one rendered
+        cell by cell."""
+        people = Person.objects.all()[:30]
+        columns = PersonTable.columns
+        self.assertEqual(
+            self.render(
+                '{% for row in rows %}<tr>{% for column in columns %}'
+                '{% render_cell column row %}{% endfor %}</tr>{% endfor %}',
+                rows=people, columns=columns,
+            ),
+            self.render(
+                '{% autoescape off %}{% table_body columns rows %}'
+                '{% endautoescape %}', rows=people, columns=columns,
+            ),
+        )
+
+    def test_escaping(self):
+        """The cell contents are escaped unless autoescape is off."""
+        person = Person(first_name='<b>Tom</b>', last_name='Smith & Co')
+        columns = [
+            DataTableColumn('First name', field='first_name'),
+            DataTableColumn('Last name', field='last_name'),
+        ]
+        self.assertEqual(
+            self.render(
+                '{% table_body columns rows %}',
+                rows=[person], columns=columns,
+            ),
+            '<tr><td>&lt;b&gt;Tom&lt;/b&gt;</td><td>Smith &amp; Co</td></tr>',
+        )
+        self.assertEqual(
+            self.render(
+                '{% autoescape off %}{% table_body columns rows %}'
+                '{% endautoescape %}', rows=[person], columns=columns,
+            ),
+            '<tr><td><b>Tom</b></td><td>Smith & Co</td></tr>',
+        )
+
+    def test_markup_columns(self):
+        """The contents rendered by the columns are not escaped, like by
+        render_cell."""
+        class LinkColumn(DataTableColumn):
+            def render_cell_content(self, resource):
+                return '<a href="{}">{}</a>'.format(
+                    resource.get_absolute_url(), resource.last_name,
+                )
+
+        people = Person.objects.all()[:5]
+        columns = [
+            DataTableColumn('First name', field='first_name'),
+            LinkColumn('Last name'),
+        ]
+        rendered = self.render(
+            '{% table_body columns rows %}', rows=people, columns=columns,
+        )
+        self.assertEqual(rendered, self.render(
+            '{% for row in rows %}<tr>{% for column in columns %}'
+            '{% render_cell column row %}{% endfor %}</tr>{% endfor %}',
+            rows=people, columns=columns,
+        ))
+        self.assertIn('<a href="', rendered)
+
+    def test_custom_columns(self):
+        """Columns can render whole columns or customize the cell markup."""
+        people = Person.objects.order_by('pk')[:2]
+        columns = [
+            HtmlColumn('First name'),
+            UpperColumn('Last name'),
+            DataTableColumn('Hidden', show_conditions=(bool, False)),
+        ]
+        self.assertEqual(
+            self.render(
+                '{% table_body columns rows %}', rows=people, columns=columns,
+            ),
+            ''.join(
+                '<tr><td class="html">{}</td><td>{}</td></tr>'.format(
+                    person.first_name, person.last_name.upper(),
+                ) for person in people
+            ),
+        )
+
+
+@override_settings(BOB_TRACK_MODEL_VERSIONS=True)
+class TestFragmentCache(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self, query_string='', **kwargs):
+        kwargs.setdefault('fragment_cache', True)
+        view = PersonTableView.as_view(**kwargs)
+        response = view(RequestFactory().get('/?' + query_string))
+        return response.render().content
+
+    def test_cached(self):
+        """Repeated views run no queries."""
+        content = self.render('page=2&sort=last_name')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.render('page=2&sort=last_name'), content)
+        with self.assertNumQueries(2):
+            self.assertNotEqual(self.render('page=3&sort=last_name'), content)
+        with self.assertNumQueries(2):
+            self.render('page=2&sort=-last_name')
+
+    def test_invalidated(self):
+        """Saving the displayed models invalidates the cache."""
+        self.render('page=1')
+        person = Person.objects.order_by('pk')[0]
+        person.last_name = 'Changed'
+        person.save()
+        with self.assertNumQueries(2):
+            self.assertIn(b'<td>Changed</td>', self.render('page=1'))
+        company = person.company
+        company.name = 'Changed Inc'
+        company.save()
+        with self.assertNumQueries(2):
+            self.assertIn(b'<td>Changed Inc</td>', self.render('page=1'))
+        with self.assertNumQueries(0):
+            self.render('page=1')
+
+    def test_show_all_not_cached(self):
+        """Showing all the items is never cached."""
+        self.render('page=0', show_all_limit=20)
+        with self.assertNumQueries(1):
+            self.render('page=0', show_all_limit=20)
+
+    def test_queryset(self):
+        """Views limiting the rows differently don't share the fragments."""
+        class CompanyTableView(PersonTableView):
+            company_id = None
+
+            def get(self, *args, **kwargs):
+                self.data_table_query(
+                    Person.objects.filter(company_id=self.company_id),
+                )
+                return super(PersonTableView, self).get(*args, **kwargs)
+
+        def render(company_id):
+            view = CompanyTableView.as_view(
+                fragment_cache=True, company_id=company_id,
+            )
+            return view(RequestFactory().get('/?page=1')).render().content
+
+        first = render(1)
+        second = render(2)
+        self.assertNotEqual(first, second)
+        for person in Person.objects.filter(company_id=2)[:5]:
+            self.assertIn(person.last_name.encode('utf-8'), second)
+
+    def test_untracked(self):
+        """The cache refuses to serve stale pages without the versions."""
+        with override_settings(BOB_TRACK_MODEL_VERSIONS=False):
+            self.assertRaises(ImproperlyConfigured, self.render, 'page=1')
+
+
+class TestGetOrCreate(TestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_create_once(self):
+        """The value is created once."""
+        create = mock.Mock(return_value='value')
+        self.assertEqual(get_or_create('key', create), 'value')
+        self.assertEqual(get_or_create('key', create), 'value')
+        self.assertEqual(create.call_count, 1)
+
+    def test_wait_for_lock(self):
+        """Callers wait for the value being created by someone else."""
+        cache.add('key:lock', 1)
+        timer = threading.Timer(0.2, cache.set, ['key', 'theirs'])
+        timer.start()
+        create = mock.Mock(return_value='ours')
+        self.assertEqual(get_or_create('key', create), 'theirs')
+        self.assertFalse(create.called)
+
+    def test_lock_timeout(self):
+        """Callers create the value themselves after lock_timeout."""
+        cache.add('key:lock', 1)
+        create = mock.Mock(return_value='ours')
+        self.assertEqual(
+            get_or_create('key', create, lock_timeout=0.2), 'ours',
+        )
+        self.assertTrue(create.called)
+
+
+class SlowQuerySet(QuerySet):
+    """Simulates a database with high latency."""
+
+    def iterator(self):
+        time.sleep(LATENCY)
+        return super(SlowQuerySet, self).iterator()
+
+
+class SlowCount(object):
+    """Counts without the database, so it can run in another thread of the
+    in-memory test database."""
+
+    def __init__(self, count, kind='exact'):
+        self.result = count, kind
+        self.threads = []
+
+    def __call__(self, queryset):
+        self.threads.append(threading.current_thread())
+        time.sleep(LATENCY)
+        return self.result
+
+
+class TestConcurrentCount(TestCase):
+
+    def setUp(self):
+        # the test case runs in a transaction
+        patcher = mock.patch(
+            'bob.data_table._in_transaction', return_value=False,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def paginate(self, query_string, concurrent, count):
+        table = PersonTable(
+            query_string, concurrent_count=concurrent, count_strategy=count,
+        )
+        queryset = SlowQuerySet(Person).order_by('last_name', 'pk')
+        start = time.time()
+        page = table._paginate(queryset)
+        rows = list(page.object_list)
+        return page, rows, time.time() - start
+
+    def test_same_results(self):
+        """The results are the same as in the serial path."""
+        total = Person.objects.count()
+        for query_string, kind in [
+            ('page=3', 'exact'),
+            ('page=34', 'exact'),
+            ('page=99', 'exact'),
+            ('page=20', 'capped'),
+        ]:
+            serial, serial_rows, __ = self.paginate(
+                query_string, False, SlowCount(total, kind),
+            )
+            count = SlowCount(total, kind)
+            concurrent, rows, __ = self.paginate(query_string, True, count)
+            self.assertEqual(rows, serial_rows)
+            self.assertEqual(concurrent.number, serial.number)
+            self.assertEqual(concurrent.paginator.count, total)
+            self.assertEqual(concurrent.has_next(), serial.has_next())
+            self.assertNotEqual(count.threads[0], threading.current_thread())
+
+    @unittest.skipUnless(
+        os.environ.get('BOB_BENCHMARKS'), 'depends on the wall-clock time',
+    )
+    def test_benchmark(self):
+        """The latencies of the count and the page don't add up."""
+        total = Person.objects.count()
+        __, __, serial = self.paginate('page=2', False, SlowCount(total))
+        __, __, concurrent = self.paginate('page=2', True, SlowCount(total))
+        self.assertTrue(serial >= 2 * LATENCY)
+        self.assertTrue(concurrent < 1.5 * LATENCY)
+
+
+class TestCountConnections(TestCase):
+
+    def test_closed(self):
+        """The counting threads close their connections as CONN_MAX_AGE
+        tells, also when the count fails."""
+        with mock.patch('bob.data_table.close_old_connections') as close:
+            self.assertEqual(
+                _count_in_thread(SlowCount(5), Person.objects.all()),
+                (5, 'exact'),
+            )
+            self.assertEqual(close.call_count, 2)
+            failing = mock.Mock(side_effect=RuntimeError)
+            self.assertRaises(
+                RuntimeError, _count_in_thread, failing, Person.objects.all(),
+            )
+            self.assertEqual(close.call_count, 4)
+
+    def test_pool_sizes(self):
+        """Each size gets its own pool."""
+        self.assertIs(get_count_pool(2), get_count_pool(2))
+        self.assertIsNot(get_count_pool(2), get_count_pool(3))
+        self.assertEqual(get_count_pool(3)._processes, 3)
+
+    def test_transaction(self):
+        """In a transaction the rows are counted by its connection."""
+        count = SlowCount(Person.objects.count())
+        table = PersonTable(
+            'page=2', concurrent_count=True, count_strategy=count,
+        )
+        with transaction.atomic():
+            page = table._paginate(Person.objects.all())
+            self.assertEqual(page.paginator.count, Person.objects.count())
+        self.assertEqual(count.threads, [threading.current_thread()])
+
+
+class TestBackgroundExport(TestCase):
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = FileReportStorage(location)
+
+    def get(self, query_string, ajax=True, **kwargs):
+        kwargs.setdefault('export_storage', self.storage)
+        view = PersonTableView.as_view(**kwargs)
+        headers = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if ajax else {}
+        return view(RequestFactory().get('/?' + query_string, **headers))
+
+    def test_export(self):
+        """The export is built by the job and downloaded."""
+        executor = LocalExecutor(workers=0)
+        status = json.loads(self.get(
+            'sort=last_name&export=csv', export_executor=executor,
+        ).content)
+        self.assertTrue(status['finished'])
+        self.assertFalse(status['failed'])
+        status = json.loads(self.get(
+            'sort=last_name&export=status&job_id=' + status['job_id'],
+            export_executor=executor,
+        ).content)
+        self.assertTrue(status['finished'])
+        response = self.get(
+            status['download_url'][1:], export_executor=executor,
+        )
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename=file.csv',
+        )
+        streamed = self.get('sort=last_name&export=csv')
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            b''.join(streamed.streaming_content),
+        )
+        self.assertEqual(len(os.listdir(self.storage.location)), 1)
+
+    def download(self, query_string, **kwargs):
+        executor = LocalExecutor(workers=0)
+        status = json.loads(self.get(
+            query_string, export_executor=executor, **kwargs
+        ).content)
+        return self.get(
+            status['download_url'][1:], export_executor=executor, **kwargs
+        )
+
+    def test_view_arguments(self):
+        """The job exports the columns the view was created with."""
+        columns = [
+            DataTableColumn('Last name', field='last_name', export=True),
+        ]
+        response = self.download('export=csv', columns=columns)
+        rows = list(UnicodeReader(
+            io.BytesIO(b''.join(response.streaming_content)),
+            encoding='cp1250',
+        ))
+        self.assertEqual(rows[0], ['Last name'])
+        self.assertEqual(len(rows[1]), 1)
+
+    def test_compressed(self):
+        """The compression suffix is applied to the download."""
+        response = self.download('export=csv.gz')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertFalse(response.has_header('Content-Length'))
+        content = gzip.GzipFile(
+            fileobj=io.BytesIO(b''.join(response.streaming_content)),
+        ).read()
+        self.assertEqual(content, b''.join(
+            self.get('export=csv').streaming_content,
+        ))
+        response = self.download('export=csv.zip')
+        self.assertEqual(response['Content-Type'], 'application/zip')
+
+    def test_other_formats(self):
+        """The other formats are built by the job too."""
+        executor = LocalExecutor(workers=0)
+        status = json.loads(self.get(
+            'export=xlsx', export_executor=executor,
+            export_formats=('csv', 'xlsx'),
+        ).content)
+        response = self.get(
+            status['download_url'][1:], export_executor=executor,
+        )
+        self.assertEqual(
+            response['Content-Type'], registry.get('xlsx').content_type,
+        )
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename=file.xlsx',
+        )
+        self.assertEqual(
+            b''.join(response.streaming_content)[:4], b'PK\x03\x04',
+        )
+
+    def test_status_page(self):
+        """Without AJAX the status is a page."""
+        executor = LocalExecutor(workers=0)
+        response = self.get('export=csv', ajax=False, export_executor=executor)
+        self.assertIn(b'export=download', response.content)
+
+    def test_unknown_job(self):
+        """Unknown jobs are not found."""
+        for query_string in ['export=status', 'export=download&job_id=1']:
+            with self.assertRaises(Http404):
+                self.get(query_string, export_executor=LocalExecutor())
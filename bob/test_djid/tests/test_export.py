@@ -0,0 +1,478 @@
+"""Tests for the djid exports."""
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import warnings
+import zipfile
+
+import mock
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from bob.djid import Djid, make_report_shard, merge_report
+from bob.djid.column import CharColumn
+from bob.export import registry as export_registry
+from bob.jobs import Job, LocalExecutor, Progress
+from bob.reports import FileReportStorage
+from bob.test_djid.models import Person
+from bob.test_djid.djids import PersonsGrid
+
+
+class StubExecutor(object):
+    """Queues the jobs without running them."""
+
+    def __init__(self):
+        self.jobs = {}
+
+    def submit(self, func, *args, **kwargs):
+        job = Job('job{}'.format(len(self.jobs)))
+        self.jobs[job.id] = job
+        return job.id
+
+    def fetch(self, job_id):
+        return self.jobs.get(job_id)
+
+
+class TestExport(TestCase):
+
+    def test_csv(self):
+        """The CSV is written with the stdlib dialect in UTF-8."""
+        query_set = Person.objects.order_by('pk')[:30]
+        content_type, data = PersonsGrid.get_export_data(
+            PersonsGrid, query_set, 'text/csv',
+        )
+        self.assertEqual(content_type, 'text/csv')
+        buf = io.BytesIO()
+        writer = csv.writer(buf)
+        columns = PersonsGrid._meta.column_dict.values()
+        writer.writerow([column.label.encode('utf-8') for column in columns])
+        for person in query_set:
+            writer.writerow([
+                column.get_csv_value(person) for column in columns
+            ])
+        self.assertEqual(data, buf.getvalue())
+        self.assertEqual(PersonsGrid.get_export_data_csv(query_set), data)
+
+    def test_csv_value_overridden(self):
+        """The deprecated get_csv_value of the columns is still used."""
+        class OldColumn(CharColumn):
+            def get_csv_value(self, model):
+                return model.last_name.upper().encode('utf-8')
+
+        class Grid(Djid):
+            last_name = OldColumn(label='Last name')
+
+            class Meta:
+                Model = Person
+
+        query_set = Person.objects.order_by('pk')[:3]
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            rows = list(Grid.get_export_rows(query_set))
+        self.assertEqual(caught[0].category, DeprecationWarning)
+        self.assertEqual(
+            [row[0] for row in rows[1:]],
+            [person.last_name.upper() for person in query_set],
+        )
+
+    def test_jsonl(self):
+        query_set = Person.objects.order_by('pk')
+        content_type, data = PersonsGrid.get_export_data(
+            PersonsGrid, query_set, 'application/x-jsonlines',
+        )
+        rows = [json.loads(line) for line in data.splitlines()]
+        self.assertEqual(len(rows), 501)
+        self.assertEqual(rows[0], PersonsGrid.col_names())
+        person = query_set[0]
+        self.assertEqual(
+            rows[1][:4],
+            [
+                person.first_name, person.last_name,
+                person.registered.strftime('%Y-%m-%d %H:%M:%S'), person.score,
+            ],
+        )
+
+    def test_xlsx(self):
+        content_type = (
+            'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        )
+        __, data = PersonsGrid.get_export_data(
+            PersonsGrid, Person.objects.all(), content_type,
+        )
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(
+            archive.read('xl/worksheets/sheet1.xml').count(b'<row>'), 501,
+        )
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            PersonsGrid.get_export_data(
+                PersonsGrid, Person.objects.all(), 'application/pdf',
+            )
+
+
+class TestReportStorage(TestCase):
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.addCleanup(
+            setattr, PersonsGrid, 'report_storage', PersonsGrid.report_storage,
+        )
+        PersonsGrid.report_storage = FileReportStorage(
+            location, compression='gzip',
+        )
+
+    def test_download(self):
+        """The job result is a handle of the file streamed to the client."""
+        query_set = Person.objects.order_by('pk')
+        content_type, handle = PersonsGrid.save_report(query_set, 'text/csv')
+        self.assertEqual(content_type, 'text/csv')
+        self.assertTrue(handle.endswith('.csv.gz'))
+        job = Job('1', 'finished', (content_type, handle))
+        with mock.patch.object(
+            PersonsGrid, 'get_report_executor',
+            return_value=mock.Mock(**{'fetch.return_value': job}),
+        ):
+            response = PersonsGrid.get_report(
+                RequestFactory().get('/?job_id=1'),
+            )
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename=persons.csv',
+        )
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            PersonsGrid.get_export_data_csv(query_set),
+        )
+
+
+class TestProgress(TestCase):
+
+    def test_export_progress(self):
+        """The exported rows are counted in the job meta."""
+        meta = {}
+        progress = Progress(meta)
+        __, data = PersonsGrid.get_export_data(
+            PersonsGrid, Person.objects.all(), 'text/csv',
+        )
+        chunks = PersonsGrid.iter_export_data(
+            Person.objects.all(), export_registry.get('csv'), progress,
+        )
+        self.assertEqual(b''.join(chunks), data)
+        self.assertEqual(meta['done'], 500)
+        self.assertEqual(meta['total'], 500)
+
+    def test_status(self):
+        job = Job('1', 'started', meta={
+            'done': 100, 'total': 500, 'started': time.time() - 10,
+        })
+        status = json.loads(PersonsGrid.get_status_response(job).content)
+        self.assertEqual(status['progress'], 20)
+        self.assertAlmostEqual(status['eta'], 40, delta=1)
+        self.assertFalse(status['finished'])
+        self.assertFalse(status['failed'])
+        job.meta = {}
+        status = json.loads(PersonsGrid.get_status_response(job).content)
+        self.assertIsNone(status['progress'])
+        self.assertIsNone(status['eta'])
+
+
+class TestShardedExport(TestCase):
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        for name in ('report_storage', 'export_shards', 'export_shard_rows'):
+            self.addCleanup(
+                setattr, PersonsGrid, name, getattr(PersonsGrid, name),
+            )
+        PersonsGrid.report_storage = FileReportStorage(location)
+        PersonsGrid.export_shards = 4
+        PersonsGrid.export_shard_rows = 100
+
+    def test_shards(self):
+        query_set = Person.objects.all()
+        shards = PersonsGrid.get_shards(query_set)
+        self.assertEqual(len(shards), 4)
+        self.assertIsNone(shards[0][0])
+        self.assertIsNone(shards[-1][1])
+        for (__, stop), (start, __) in zip(shards, shards[1:]):
+            self.assertEqual(stop, start)
+        self.assertIsNone(PersonsGrid.get_shards(query_set[:0]))
+        self.assertIsNone(
+            PersonsGrid.get_shards(query_set.order_by('first_name')),
+        )
+        self.assertEqual(
+            len(PersonsGrid.get_shards(query_set.order_by('pk'))), 4,
+        )
+        PersonsGrid.export_shard_rows = 200
+        self.assertEqual(len(PersonsGrid.get_shards(query_set)), 2)
+
+    def test_shards_cheap(self):
+        """The shards are computed without counting or offsets."""
+        with CaptureQueriesContext(connection) as queries:
+            shards = PersonsGrid.get_shards(Person.objects.all())
+        self.assertEqual(len(queries), 1)
+        self.assertIn('MIN(', queries[0]['sql'])
+        self.assertNotIn('COUNT(', queries[0]['sql'])
+        self.assertNotIn('OFFSET', queries[0]['sql'])
+        counts = []
+        for start, stop in shards:
+            query_set = Person.objects.all()
+            if start is not None:
+                query_set = query_set.filter(pk__gte=start)
+            if stop is not None:
+                query_set = query_set.filter(pk__lt=stop)
+            counts.append(query_set.count())
+        self.assertEqual(sum(counts), Person.objects.count())
+
+    def test_merged(self):
+        """The merged shards are the same as the report exported at once."""
+        query_set = Person.objects.filter(first_name__icontains='a')
+        meta = {}
+        handles = [
+            PersonsGrid.save_report_shard(query_set, pk_range, Progress(meta))
+            for pk_range in PersonsGrid.get_shards(query_set)
+        ]
+        content_type, handle = PersonsGrid.merge_report_shards(
+            handles, 'text/csv',
+        )
+        with PersonsGrid.report_storage.open(handle) as f:
+            self.assertEqual(
+                f.read(),
+                PersonsGrid.get_export_data_csv(query_set.order_by('pk')),
+            )
+        self.assertEqual(
+            os.listdir(PersonsGrid.report_storage.location), [handle],
+        )
+
+    def test_status(self):
+        """The progress is the sum of the progress of the shards."""
+        executor = StubExecutor()
+        executor.jobs = {
+            'a': Job('a', 'started', meta={
+                'done': 100, 'total': 200, 'started': time.time() - 10,
+            }),
+            'b': Job('b', 'started', meta={
+                'done': 50, 'total': 100, 'started': time.time() - 5,
+            }),
+        }
+        job = Job('1', meta={'shards': ['a', 'b']})
+        with mock.patch.object(PersonsGrid, 'report_executor', executor):
+            status = json.loads(PersonsGrid.get_status_response(job).content)
+            self.assertEqual(
+                (status['done'], status['total'], status['progress']),
+                (150, 300, 50),
+            )
+            self.assertFalse(status['failed'])
+            executor.jobs['b'].meta = {}
+            status = json.loads(PersonsGrid.get_status_response(job).content)
+            self.assertEqual((status['done'], status['total']), (100, None))
+            executor.jobs['a'].status = 'failed'
+            status = json.loads(PersonsGrid.get_status_response(job).content)
+            self.assertTrue(status['failed'])
+
+    def test_jobs(self):
+        """The shard finished last queues the merging job."""
+        query_set = Person.objects.all()
+        shards = PersonsGrid.get_shards(query_set)
+        fields = {}
+
+        def hincrby(key, field, amount):
+            fields[field] = fields.get(field, 0) + amount
+            return fields[field]
+
+        job = mock.Mock(key='rq:job:merge', meta={}, origin='djid_reports')
+        job.connection.hset.side_effect = (
+            lambda key, field, value: fields.__setitem__(field, value)
+        )
+        job.connection.hincrby.side_effect = hincrby
+        job.connection.hget.side_effect = lambda key, field: fields[field]
+        with mock.patch('rq.get_current_job', return_value=job), \
+                mock.patch('rq.job.Job.fetch') as fetch, \
+                mock.patch('rq.Queue') as queue:
+            for index, pk_range in enumerate(shards):
+                self.assertFalse(queue.called)
+                make_report_shard(
+                    PersonsGrid, query_set.query, index, pk_range, 'merge',
+                    len(shards),
+                )
+            queue.return_value.enqueue_job.assert_called_once_with(
+                fetch.return_value,
+            )
+            job.connection.expire.assert_called_with(
+                'rq:job:merge', PersonsGrid.report_storage.max_age,
+            )
+            content_type, handle = merge_report(
+                PersonsGrid, 'text/csv', len(shards),
+            )
+        with PersonsGrid.report_storage.open(handle) as f:
+            self.assertEqual(
+                f.read(),
+                PersonsGrid.get_export_data_csv(query_set.order_by('pk')),
+            )
+
+    def test_merge_job_expires(self):
+        """The merging job expires when the shards don't finish."""
+        executor = mock.Mock(timeout=60)
+        connection = executor.get_queue.return_value.connection
+        with mock.patch('rq.job.Job.create') as create:
+            create.side_effect = lambda **kwargs: mock.Mock(
+                id=kwargs['func'].__name__, key='rq:job:merge', meta={},
+            )
+            job_id = PersonsGrid.start_sharded_report(
+                executor, Person.objects.all().query, 'text/csv',
+                [(None, 10), (10, None)],
+            )
+        self.assertEqual(job_id, 'merge_report')
+        connection.expire.assert_called_once_with(
+            'rq:job:merge', PersonsGrid.report_storage.max_age,
+        )
+        self.assertEqual(
+            executor.get_queue.return_value.enqueue_job.call_count, 2,
+        )
+
+
+@override_settings(BOB_TRACK_MODEL_VERSIONS=True)
+class TestSharedReports(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(
+            setattr, PersonsGrid, 'report_reuse_timeout',
+            PersonsGrid.report_reuse_timeout,
+        )
+        PersonsGrid.report_reuse_timeout = 60
+        self.executor = StubExecutor()
+
+    def get_query_set(self, query_string):
+        return PersonsGrid.get_filtered_query_set(
+            RequestFactory().get('/?' + query_string),
+        )
+
+    def get_fingerprint(self, query_string, content_type='text/csv'):
+        return PersonsGrid.get_report_fingerprint(
+            self.get_query_set(query_string), content_type,
+        )
+
+    def test_fingerprint(self):
+        fingerprint = self.get_fingerprint(
+            'first_name=an&sidx=last_name+&sord=desc&page=1&nd=1',
+        )
+        self.assertEqual(
+            self.get_fingerprint(
+                'page=3&nd=2&sord=desc&sidx=last_name+&first_name=an',
+            ),
+            fingerprint,
+        )
+        for query_string, content_type in [
+            ('first_name=en&sidx=last_name+&sord=desc', 'text/csv'),
+            ('first_name=an&sidx=last_name+&sord=asc', 'text/csv'),
+            ('first_name=an&sidx=last_name+&sord=desc', 'application/json'),
+        ]:
+            self.assertNotEqual(
+                self.get_fingerprint(query_string, content_type), fingerprint,
+            )
+        self.assertTrue(PersonsGrid.get_report_fingerprint(
+            Person.objects.none(), 'text/csv',
+        ))
+
+    def test_fingerprint_version(self):
+        fingerprint = self.get_fingerprint('first_name=an')
+        Person.objects.get(pk=1).save()
+        self.assertNotEqual(self.get_fingerprint('first_name=an'), fingerprint)
+
+    def start(self, query_string):
+        with mock.patch.object(
+            PersonsGrid, 'report_executor', self.executor,
+        ):
+            return PersonsGrid.get_shared_report_job(
+                self.get_query_set(query_string), 'text/csv',
+            )
+
+    def test_shared(self):
+        """Identical exports share the job while it's fresh and valid."""
+        job = self.start('first_name=an&page=1')
+        self.assertIs(self.start('first_name=an&page=2'), job)
+        self.assertIsNot(self.start('first_name=en'), job)
+        job.status = 'finished'
+        job.result = ('text/csv', 'missing.csv')
+        new_job = self.start('first_name=an')
+        self.assertIsNot(new_job, job)
+        self.assertIs(self.start('first_name=an'), new_job)
+        new_job.status = 'failed'
+        self.assertIsNot(self.start('first_name=an'), new_job)
+        self.assertEqual(len(self.executor.jobs), 4)
+
+    def test_expired(self):
+        self.start('first_name=an')
+        cache.clear()
+        self.start('first_name=an')
+        self.assertEqual(len(self.executor.jobs), 2)
+
+
+class TestExecutors(TestCase):
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        for name in ('report_storage', 'report_executor'):
+            self.addCleanup(
+                setattr, PersonsGrid, name, getattr(PersonsGrid, name),
+            )
+        PersonsGrid.report_storage = FileReportStorage(location)
+
+    def test_synchronous(self):
+        """The endpoints work the same with any executor."""
+        PersonsGrid.report_executor = LocalExecutor(workers=0)
+        status = json.loads(self.client.get(
+            '/djid/start_report/persons/?first_name=an',
+            HTTP_ACCEPT='text/csv',
+        ).content)
+        self.assertTrue(status['finished'])
+        self.assertFalse(status['failed'])
+        self.assertEqual(status['progress'], 100)
+        status = json.loads(self.client.get(
+            '/djid/update_status/persons/', {'job_id': status['job_id']},
+        ).content)
+        self.assertTrue(status['finished'])
+        response = self.client.get(
+            '/djid/get_report/persons/', {'job_id': status['job_id']},
+        )
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            PersonsGrid.get_export_data_csv(
+                Person.objects.filter(first_name__icontains='an'),
+            ),
+        )
+
+    def test_not_ready(self):
+        PersonsGrid.report_executor = StubExecutor()
+        status = json.loads(self.client.get(
+            '/djid/start_report/persons/', HTTP_ACCEPT='text/csv',
+        ).content)
+        self.assertFalse(status['finished'])
+        for action in ('get_report', 'update_status'):
+            self.assertEqual(self.client.get(
+                '/djid/{}/persons/'.format(action), {'job_id': 'unknown'},
+            ).status_code, 404)
+        self.assertEqual(self.client.get(
+            '/djid/get_report/persons/', {'job_id': status['job_id']},
+        ).status_code, 404)
+
+    def test_default(self):
+        PersonsGrid.report_executor = None
+        executor = PersonsGrid.get_report_executor()
+        self.assertEqual(executor.queue_name, 'djid_reports')
+        self.assertEqual(
+            executor.result_ttl, PersonsGrid.report_storage.max_age,
+        )
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import zipfile
+
+from django.http import StreamingHttpResponse
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from bob.compression import (
+    accepts_gzip,
+    compress_streaming_response,
+    iter_buffered,
+    iter_gzip,
+    iter_zip,
+)
+
+
+def make_response():
+    response = StreamingHttpResponse(
+        (b'row {}\n'.format(i) for i in range(1000)),
+        content_type='application/csv',
+    )
+    response['Content-Disposition'] = 'attachment; filename=rows.csv'
+    return response
+
+
+CONTENT = b''.join(b'row {}\n'.format(i) for i in range(1000))
+
+
+class IterBufferedTest(TestCase):
+    def test_buffered(self):
+        chunks = list(iter_buffered((b'x' * 3 for i in range(10)), 10))
+        self.assertEqual([len(chunk) for chunk in chunks], [12, 12, 6])
+
+    def test_empty(self):
+        self.assertEqual(list(iter_buffered([])), [])
+
+
+class IterZipTest(TestCase):
+    def test_archive(self):
+        content = [b'line {}\n'.format(i) for i in range(10000)]
+        data = b''.join(iter_zip([
+            ('a.txt', iter(content)),
+            ('dir/żółw.txt', [b'']),
+            ('b.txt', [b'b']),
+        ], buffer_size=1024))
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual(
+            archive.namelist(), ['a.txt', 'dir/żółw.txt', 'b.txt'],
+        )
+        self.assertEqual(archive.read('a.txt'), b''.join(content))
+        self.assertEqual(archive.read('dir/żółw.txt'), b'')
+        self.assertEqual(archive.read('b.txt'), b'b')
+
+    def test_chunks(self):
+        """The chunks are bounded by the buffer of zlib."""
+        chunks = list(iter_zip([
+            ('a.txt', (b'{}'.format(i) * 100 for i in range(100000))),
+        ], buffer_size=1024))
+        self.assertTrue(len(chunks) > 10)
+        self.assertTrue(all(len(chunk) < 64 * 1024 for chunk in chunks))
+
+
+class IterGzipTest(TestCase):
+    def test_gzip(self):
+        chunks = list(iter_gzip(
+            (b'line {}\n'.format(i) for i in range(100000)), buffer_size=1024,
+        ))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=io.BytesIO(b''.join(chunks))).read(),
+            b''.join(b'line {}\n'.format(i) for i in range(100000)),
+        )
+
+    def test_empty(self):
+        data = b''.join(iter_gzip([]))
+        self.assertEqual(gzip.GzipFile(fileobj=io.BytesIO(data)).read(), b'')
+
+
+class CompressStreamingResponseTest(TestCase):
+    def test_accepts_gzip(self):
+        factory = RequestFactory()
+        self.assertTrue(accepts_gzip(
+            factory.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate'),
+        ))
+        self.assertFalse(accepts_gzip(
+            factory.get('/', HTTP_ACCEPT_ENCODING='deflate'),
+        ))
+        self.assertFalse(accepts_gzip(factory.get('/')))
+
+    def test_content_encoding(self):
+        response = compress_streaming_response(
+            make_response(), 'gzip', 'rows.csv',
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename=rows.csv',
+        )
+        data = b''.join(response.streaming_content)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=io.BytesIO(data)).read(), CONTENT,
+        )
+
+    def test_gz(self):
+        response = compress_streaming_response(
+            make_response(), 'gz', 'rows.csv',
+        )
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertEqual(
+            response['Content-Disposition'],
+            'attachment; filename=rows.csv.gz',
+        )
+        data = b''.join(response.streaming_content)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=io.BytesIO(data)).read(), CONTENT,
+        )
+
+    def test_zip(self):
+        response = compress_streaming_response(
+            make_response(), 'zip', 'rows.csv',
+        )
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename=rows.zip',
+        )
+        archive = zipfile.ZipFile(
+            io.BytesIO(b''.join(response.streaming_content)),
+        )
+        self.assertEqual(archive.read('rows.csv'), CONTENT)
+
+    def test_none(self):
+        response = compress_streaming_response(
+            make_response(), None, 'rows.csv',
+        )
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        with self.assertRaises(ValueError):
+            compress_streaming_response(make_response(), 'rar', 'rows.csv')
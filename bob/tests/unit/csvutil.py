@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import cStringIO
+import io
+import os
+import tempfile
+import time
+from unittest import skipUnless
+
+from django.core.paginator import Paginator
+from django.test import TestCase
+
+from bob.csvutil import (
+    BufferedUnicodeWriter,
+    IndexedCsvReader,
+    UnicodeReader,
+    UnicodeWriter,
+    iter_csv,
+    make_csv_response,
+    make_csv_streaming_response,
+)
+
+
+ROWS = [
+    ['CAR', 'COLOR', 'PRICE'],
+    ['Ford', 'Czerwony; "ciemny"', 1000],
+    ['Škoda', 'Żółty\nz paskiem', 2000],
+]
+
+
+def write(writer_class, rows, **kwargs):
+    f = cStringIO.StringIO()
+    writer = writer_class(f, **kwargs)
+    writer.writerows([unicode(item) for item in row] for row in rows)
+    if hasattr(writer, 'flush'):
+        writer.flush()
+    return f.getvalue()
+
+
+class BufferedUnicodeWriterTest(TestCase):
+    def test_same_output(self):
+        rows = ROWS * 50
+        for encoding in ('cp1250', 'utf-8', 'UTF8', 'utf-8-sig', 'utf-16'):
+            for buffer_size in (1, 100, 1024 * 1024):
+                self.assertEqual(
+                    write(
+                        BufferedUnicodeWriter, rows, encoding=encoding,
+                        buffer_size=buffer_size,
+                    ),
+                    write(UnicodeWriter, rows, encoding=encoding),
+                )
+
+    def test_buffering(self):
+        f = cStringIO.StringIO()
+        writer = BufferedUnicodeWriter(f, buffer_size=100)
+        writer.writerow(['a', 'b'])
+        self.assertEqual(f.getvalue(), b'')
+        writer.writerows([['x' * 100]])
+        self.assertEqual(f.getvalue(), b'a;b\r\n' + b'x' * 100 + b'\r\n')
+
+    def test_unencodable(self):
+        with self.assertRaises(UnicodeEncodeError):
+            write(BufferedUnicodeWriter, [['日本']], encoding='cp1250')
+
+    @skipUnless(os.environ.get('BOB_BENCHMARK'), 'set BOB_BENCHMARK=1')
+    def test_benchmark(self):
+        """Exports a million rows with both writers."""
+        rows = [
+            ['{}'.format(i), 'Zażółć gęślą', 'jaźń; "x"', '12.5']
+            for i in xrange(1000000)
+        ]
+        results = {}
+        for writer_class in (UnicodeWriter, BufferedUnicodeWriter):
+            start = time.time()
+            output = write(writer_class, rows, encoding='cp1250')
+            results[writer_class] = time.time() - start, output
+            print('{}: {:.2f}s'.format(
+                writer_class.__name__, results[writer_class][0],
+            ))
+        self.assertEqual(
+            results[UnicodeWriter][1], results[BufferedUnicodeWriter][1],
+        )
+        self.assertTrue(
+            results[BufferedUnicodeWriter][0] < results[UnicodeWriter][0],
+        )
+
+
+class IterCsvTest(TestCase):
+    def test_same_as_response(self):
+        self.assertEqual(
+            b''.join(iter_csv(ROWS)),
+            make_csv_response(ROWS).content,
+        )
+
+    def test_chunks(self):
+        rows = ROWS * 100
+        chunks = list(iter_csv(rows, buffer_size=100))
+        self.assertTrue(len(chunks) > 10)
+        self.assertTrue(all(len(chunk) < 200 for chunk in chunks))
+        self.assertEqual(b''.join(chunks), make_csv_response(rows).content)
+
+    def test_empty(self):
+        self.assertEqual(list(iter_csv([])), [])
+
+
+class MakeCsvStreamingResponseTest(TestCase):
+    def test_response(self):
+        response = make_csv_streaming_response(
+            (row for row in ROWS), filename='cars.csv', encoding='utf-8',
+        )
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename=cars.csv',
+        )
+        self.assertEqual(
+            b''.join(response.streaming_content),
+            make_csv_response(ROWS, encoding='utf-8').content,
+        )
+
+
+class IndexedCsvReaderTest(TestCase):
+    def make_reader(self, content, **kwargs):
+        f = tempfile.TemporaryFile()
+        self.addCleanup(f.close)
+        f.write(content)
+        reader = IndexedCsvReader(f, **kwargs)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_random_access(self):
+        rows = [
+            ['{}'.format(i), 'Żółty\nz "paskiem"' if i % 3 else 'x']
+            for i in range(1000)
+        ]
+        content = make_csv_response(rows, encoding='utf-8').content
+        reader = self.make_reader(content, index_step=7)
+        self.assertEqual(len(reader), 1000)
+        self.assertEqual(len(reader.offsets), 143)
+        self.assertEqual(
+            list(reader), list(UnicodeReader(io.BytesIO(content))),
+        )
+        self.assertEqual(reader[500:510], rows[500:510])
+        self.assertEqual(reader[995:1200], rows[995:])
+        self.assertEqual(reader[1200:1300], [])
+        self.assertEqual(reader[13], rows[13])
+        self.assertEqual(reader[-1], rows[-1])
+        with self.assertRaises(IndexError):
+            reader[1000]
+
+    def test_encoding(self):
+        content = make_csv_response(ROWS, encoding='cp1250').content
+        self.assertEqual(
+            list(self.make_reader(content, encoding='cp1250')),
+            [[unicode(item) for item in row] for row in ROWS],
+        )
+        with self.assertRaises(ValueError):
+            self.make_reader(content, encoding='utf-16')
+
+    def test_bom_and_no_trailing_newline(self):
+        reader = self.make_reader(b'\xef\xbb\xbfa;b\r\nc;d')
+        self.assertEqual(list(reader), [['a', 'b'], ['c', 'd']])
+
+    def test_empty(self):
+        reader = self.make_reader(b'')
+        self.assertEqual(len(reader), 0)
+        self.assertEqual(reader[0:10], [])
+
+    def test_paginator(self):
+        rows = [['{}'.format(i)] for i in range(95)]
+        reader = self.make_reader(
+            make_csv_response(rows, encoding='utf-8').content, index_step=10,
+        )
+        paginator = Paginator(reader, 20)
+        self.assertEqual(paginator.count, 95)
+        self.assertEqual(paginator.num_pages, 5)
+        self.assertEqual(paginator.page(3).object_list, rows[40:60])
+        self.assertEqual(paginator.page(5).object_list, rows[80:])
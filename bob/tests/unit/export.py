@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import datetime
+import io
+import json
+import zipfile
+from xml.etree import ElementTree
+
+from django.test import TestCase
+
+from bob.csvutil import make_csv_response
+from bob.export import registry
+
+
+ROWS = [
+    ['CAR', 'COLOR', 'PRICE'],
+    ['Ford', 'Czerwony; "ciemny"', 1000],
+    ['Škoda', 'Żółty\nz <paskiem> & \x01', 2000.5],
+    ['Fiat', None, datetime.date(2014, 1, 31)],
+]
+SHEET = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def big_rows(count):
+    yield ['NUMBER', 'TEXT']
+    for i in range(count):
+        yield [i, 'Zażółć gęślą jaźń {}'.format(i)]
+
+
+class RegistryTest(TestCase):
+    def test_get(self):
+        self.assertEqual(registry.get('csv').content_type, 'text/csv')
+        self.assertEqual(registry.get('text/csv').name, 'csv')
+        self.assertEqual(
+            [export_format.name for export_format in registry],
+            ['csv', 'jsonl', 'xlsx'],
+        )
+        with self.assertRaises(ValueError):
+            registry.get('application/pdf')
+
+    def test_file_name(self):
+        self.assertEqual(
+            registry.get('xlsx').get_file_name('cars.csv'), 'cars.xlsx',
+        )
+        self.assertEqual(
+            registry.get('jsonl').get_file_name('cars'), 'cars.jsonl',
+        )
+
+    def test_csv(self):
+        self.assertEqual(
+            b''.join(registry.get('csv').write(iter(ROWS[:3]))),
+            make_csv_response(ROWS[:3]).content,
+        )
+
+    def test_jsonl(self):
+        data = b''.join(registry.get('jsonl').write(iter(ROWS)))
+        self.assertEqual(
+            [json.loads(line) for line in data.decode('utf-8').splitlines()],
+            [
+                ['CAR', 'COLOR', 'PRICE'],
+                ['Ford', 'Czerwony; "ciemny"', 1000],
+                ['Škoda', 'Żółty\nz <paskiem> & \x01', 2000.5],
+                ['Fiat', None, '2014-01-31'],
+            ],
+        )
+
+    def test_xlsx(self):
+        data = b''.join(registry.get('xlsx').write(iter(ROWS)))
+        archive = zipfile.ZipFile(io.BytesIO(data))
+        self.assertIsNone(archive.testzip())
+        sheet = ElementTree.fromstring(
+            archive.read('xl/worksheets/sheet1.xml'),
+        )
+        rows = []
+        for row in sheet.iter(SHEET + 'row'):
+            rows.append([
+                cell.findtext(SHEET + 'v') or
+                cell.findtext('{0}is/{0}t'.format(SHEET))
+                for cell in row
+            ])
+        self.assertEqual(rows, [
+            ['CAR', 'COLOR', 'PRICE'],
+            ['Ford', 'Czerwony; "ciemny"', '1000'],
+            ['Škoda', 'Żółty\nz <paskiem> & ', '2000.5'],
+            ['Fiat', None, '2014-01-31'],
+        ])
+        for name in archive.namelist():
+            ElementTree.fromstring(archive.read(name))
+
+    def test_bounded_chunks(self):
+        for name, limit in [('csv', 8192), ('jsonl', 8192), ('xlsx', 65536)]:
+            chunks = list(registry.get(name).write(
+                big_rows(50000), buffer_size=4096,
+            ))
+            self.assertTrue(len(chunks) > 10, name)
+            self.assertTrue(
+                all(len(chunk) < limit for chunk in chunks), name,
+            )
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import threading
+import time
+
+import mock
+from django.test import TestCase
+
+from bob.jobs import LocalExecutor, Progress, estimate, get_current_progress
+
+
+def fail():
+    raise ValueError('Oops')
+
+
+def count(items):
+    progress = get_current_progress()
+    for item in progress.iterate(items):
+        pass
+    return progress.done
+
+
+def wait_for(executor, job_id, timeout=5):
+    deadline = time.time() + timeout
+    job = executor.fetch(job_id)
+    while job.status not in ('finished', 'failed') and time.time() < deadline:
+        time.sleep(0.01)
+    return job
+
+
+class LocalExecutorTest(TestCase):
+    def test_threads(self):
+        executor = LocalExecutor(workers=2)
+        event = threading.Event()
+        job_id = executor.submit(event.wait, 5)
+        job = executor.fetch(job_id)
+        self.assertFalse(job.finished)
+        event.set()
+        job = wait_for(executor, job_id)
+        self.assertTrue(job.finished)
+        self.assertTrue(job.result)
+
+    def test_synchronous(self):
+        executor = LocalExecutor(workers=0)
+        job = executor.fetch(executor.submit(sum, [1, 2, 3]))
+        self.assertTrue(job.finished)
+        self.assertEqual(job.result, 6)
+
+    def test_failed(self):
+        executor = LocalExecutor(workers=1)
+        job = wait_for(executor, executor.submit(fail))
+        self.assertTrue(job.failed)
+        self.assertIn('ValueError: Oops', job.exc_info)
+
+    def test_unknown(self):
+        self.assertIsNone(LocalExecutor().fetch('unknown'))
+
+    def test_processes(self):
+        executor = LocalExecutor(workers=2, processes=True)
+        jobs = [executor.submit(sum, [i, 1]) for i in range(4)]
+        failed = executor.submit(fail)
+        self.assertEqual(
+            [wait_for(executor, job_id).result for job_id in jobs],
+            [1, 2, 3, 4],
+        )
+        job = wait_for(executor, failed)
+        self.assertTrue(job.failed)
+        self.assertIn('ValueError: Oops', job.exc_info)
+
+    def test_progress(self):
+        executor = LocalExecutor(workers=0)
+        job = executor.fetch(executor.submit(count, range(10)))
+        self.assertEqual(job.result, 10)
+        self.assertEqual((job.meta['done'], job.meta['total']), (10, None))
+        self.assertIsNone(get_current_progress())
+
+    def test_forget_old_jobs(self):
+        executor = LocalExecutor(workers=0, ttl=0)
+        job_id = executor.submit(sum, [1])
+        executor.submit(sum, [2])
+        self.assertIsNone(executor.fetch(job_id))
+
+
+class ProgressTest(TestCase):
+    def test_bounded_rate(self):
+        saves = []
+        meta = {}
+        progress = Progress(
+            meta, total=1000, save=lambda: saves.append(dict(meta)),
+            interval=60,
+        )
+        self.assertEqual(list(progress.iterate(range(1000))), range(1000))
+        # the first item and the end
+        self.assertEqual([save['done'] for save in saves], [1, 1000])
+        self.assertEqual(meta['total'], 1000)
+
+    def test_interval(self):
+        meta = {}
+        progress = Progress(meta, interval=2)
+        with mock.patch('time.time', return_value=100):
+            progress.update()
+            progress.update()
+        self.assertEqual(meta['done'], 1)
+        with mock.patch('time.time', return_value=102):
+            progress.update()
+        self.assertEqual(meta['done'], 3)
+
+    def test_estimate(self):
+        self.assertEqual(estimate({}), (None, None))
+        meta = {'done': 0, 'total': 200, 'started': 100}
+        self.assertEqual(estimate(meta, now=110), (0, None))
+        meta['done'] = 50
+        self.assertEqual(estimate(meta, now=110), (25, 30))
+        meta['done'] = 200
+        self.assertEqual(estimate(meta, now=110), (100, 0))
+        self.assertEqual(estimate({'done': 0, 'total': 0}), (None, None))
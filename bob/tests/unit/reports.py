@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from django.http import Http404
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from bob.reports import FileReportStorage
+
+
+CONTENT = b''.join(b'row {}\n'.format(i) for i in range(10000))
+
+
+def chunks():
+    for i in range(0, len(CONTENT), 1000):
+        yield CONTENT[i:i + 1000]
+
+
+class FileReportStorageTest(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.location)
+
+    def test_save(self):
+        storage = FileReportStorage(self.location)
+        handle = storage.save(chunks(), 'csv')
+        self.assertTrue(handle.endswith('.csv'))
+        self.assertEqual(os.listdir(self.location), [handle])
+        with storage.open(handle) as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_compressed(self):
+        storage = FileReportStorage(self.location, compression='gzip')
+        handle = storage.save(chunks(), 'csv')
+        self.assertTrue(handle.endswith('.csv.gz'))
+        self.assertTrue(
+            os.path.getsize(storage.path(handle)) < len(CONTENT) // 2,
+        )
+        with storage.open(handle) as f:
+            self.assertEqual(f.read(), CONTENT)
+
+    def test_response(self):
+        storage = FileReportStorage(self.location)
+        handle = storage.save(chunks(), 'csv')
+        response = storage.make_response(
+            RequestFactory().get('/'), handle, 'text/csv', 'rows.csv',
+        )
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(
+            response['Content-Disposition'], 'attachment; filename=rows.csv',
+        )
+        self.assertEqual(int(response['Content-Length']), len(CONTENT))
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+
+    def test_compressed_response(self):
+        storage = FileReportStorage(self.location, compression='gzip')
+        handle = storage.save(chunks(), 'csv')
+        response = storage.make_response(
+            RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip, deflate'),
+            handle, 'text/csv', 'rows.csv',
+        )
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        data = b''.join(response.streaming_content)
+        self.assertEqual(
+            gzip.GzipFile(fileobj=io.BytesIO(data)).read(), CONTENT,
+        )
+        # decompressed for the clients not accepting gzip
+        response = storage.make_response(
+            RequestFactory().get('/'), handle, 'text/csv', 'rows.csv',
+        )
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+
+    def test_invalid_handle(self):
+        storage = FileReportStorage(self.location)
+        for handle in ['../../etc/passwd', '{}.csv'.format('0' * 32)]:
+            with self.assertRaises(Http404):
+                storage.open(handle)
+
+    def test_failed_write(self):
+        def failing():
+            yield b'row'
+            raise ValueError()
+
+        storage = FileReportStorage(self.location)
+        with self.assertRaises(ValueError):
+            storage.save(failing(), 'csv')
+        self.assertEqual(os.listdir(self.location), [])
+
+    def test_clean(self):
+        storage = FileReportStorage(self.location, max_age=60)
+        old = storage.save(chunks(), 'csv')
+        past = time.time() - 120
+        os.utime(storage.path(old), (past, past))
+        new = storage.save(chunks(), 'csv')
+        self.assertEqual(os.listdir(self.location), [new])
+
+    def test_location_setting(self):
+        with override_settings(BOB_REPORTS_ROOT=self.location):
+            self.assertEqual(FileReportStorage().location, self.location)
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+from django.test import TestCase
+
+
+# runs in a fresh interpreter, so that nothing is imported yet
+SCRIPT = textwrap.dedent("""
+    import json, sys, time
+    started = time.time()
+    import {module}
+    print(json.dumps({{
+        'elapsed': time.time() - started,
+        'modules': [
+            name for name in (
+                'rq', 'django_rq', 'bob.data_table', 'django.db.models',
+            )
+            if name in sys.modules
+        ],
+    }}))
+""")
+
+
+def measure_import(module):
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE='bob.tests.settings')
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT.format(module=module)], env=env,
+    )
+    return json.loads(output.decode('utf-8'))
+
+
+class TestStartup(TestCase):
+    """Importing the library doesn't connect to Redis or load the unneeded
+    modules, so that the processes using it start quickly."""
+
+    def test_djid(self):
+        result = measure_import('bob.djid')
+        self.assertNotIn('rq', result['modules'])
+        self.assertNotIn('django_rq', result['modules'])
+        self.assertLess(result['elapsed'], 2)
+
+    def test_template_tags(self):
+        result = measure_import('bob.templatetags.bob')
+        self.assertEqual(result['modules'], [])
+        self.assertLess(result['elapsed'], 2)
+
+    def test_forms(self):
+        result = measure_import('bob.forms')
+        self.assertEqual(result['modules'], [])
+        self.assertLess(result['elapsed'], 2)
+
+    def test_forms_names(self):
+        """The names of the forms modules are still exported."""
+        import bob.forms
+        from bob.forms import dependency, widgets
+        for module in (dependency, widgets):
+            for name in dir(module):
+                value = getattr(module, name)
+                if getattr(value, '__module__', '').startswith('bob.'):
+                    self.assertIs(getattr(bob.forms, name), value)